@@ -33,10 +33,12 @@ newaliases; postmap /etc/postfix/transport; postfix start # Postfix mail server
 service ssh start # SSH daemon
 service xinetd start # Telnet daemon
 socat TCP-LISTEN:24,reuseaddr,fork EXEC:"/usr/local/bin/timedial-priv-raw-login",pty,setsid,stderr,raw,echo=0,sane &
+timedial-priv-auth-daemon & # Auth daemon for PAM and sshd
 timedial-priv-create-user-daemon & # User creation daemon
 timedial-priv-session-reaper & # Idle session reaper
 timedial-priv-stale-files & # Stale files handler
 timedial-priv-stats-exporter & # Export statistics for website
+timedial-priv-stage-simulators & # Decompress the simulators onto the home filesystem
 
 echo "Following logs..."
 tail -F /var/log/messages # Show syslog
@@ -17,77 +17,396 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
-import socket
-import threading
+import asyncio
+import os
+import re
 import time
+from dataclasses import dataclass
 
-HOST = "timedial"
+import tomllib
 
+CONFIG_FILE = os.getenv("SLOWPROXY_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "slowproxy.toml"))
+BATCH_INTERVAL = 0.05  # Deliver bytes in batches every 50ms
+READ_SIZE = 4096
+STATS_INTERVAL = 60
+FRAMING_PATTERN = re.compile(r"^([78])([NEO])([12])$")
+SEVEN_BIT = bytes(byte & 0x7F for byte in range(256))  # Translation table stripping the eighth bit
 
-def throttle_relay(src: socket.socket, dst: socket.socket, baud: int) -> None:
-    """Relays data from one socket to another with throttling to simulate baud rate.
+# Telnet commands, RFC 854
+IAC = 255
+SB = 250
+SE = 240
+WILL, DONT = 251, 254  # WILL, WONT, DO and DONT are followed by an option byte
+
+SESSIONS: set["Session"] = set()
+
+
+@dataclass
+class Listener:
+    """A listening port and the line it emulates.
+
+    Attributes:
+        port (int): Local TCP port.
+        baud (int): Baud rate.
+        host (str): Upstream host.
+        upstream_port (int): Upstream TCP port.
+        framing (str): Line discipline as data bits, parity and stop bits, e.g. 8N1 or 7E1.
+        telnet (bool): The upstream speaks telnet, whose commands aren't masked on 7 bit lines.
+        max_sessions (int): Maximum number of concurrent sessions, further callers get BUSY.
+        connect_timeout (float): Seconds to wait for a single upstream connection attempt.
+        connect_retries (int): Number of upstream connection attempts.
+        backoff (float): Seconds to wait after the first failed attempt, doubled after every attempt.
+    """
+
+    port: int
+    baud: int
+    host: str = "timedial"
+    upstream_port: int = 23
+    framing: str = "8N1"
+    telnet: bool = True
+    max_sessions: int = 100
+    connect_timeout: float = 5.0
+    connect_retries: int = 3
+    backoff: float = 0.5
+
+    def __post_init__(self) -> None:
+        """Validate the line discipline and initialize the session count."""
+        match = FRAMING_PATTERN.match(self.framing.upper())
+        if not match:
+            raise ValueError(f"Invalid framing for port {self.port}: {self.framing}")
+        data_bits, parity, stop_bits = int(match.group(1)), match.group(2), int(match.group(3))
+        # Start bit, data bits, optional parity bit and stop bits
+        self.bits_per_byte = 1 + data_bits + (parity != "N") + stop_bits
+        self.seven_bit = data_bits == 7
+        self.active = 0
+
+
+def load_config(path: str = CONFIG_FILE) -> list[Listener]:
+    """Load the listener table.
+
+    The file has an optional `[defaults]` table and a `[[listener]]` entry per port.
+    Any listener setting can be given in the defaults.
+
+    Args:
+        path (str): Path of the TOML file.
+
+    Returns:
+        list[Listener]: The configured listeners.
+    """
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+
+    defaults = data.get("defaults", {})
+    return [Listener(**{**defaults, **entry}) for entry in data.get("listener", [])]
+
+
+class SevenBitFilter:
+    """Strips the eighth bit of the data, like a 7 bit line does.
+
+    On telnet connections only the data bytes are masked: commands, option negotiation
+    and subnegotiation pass through unchanged, and an escaped 0xFF data byte becomes
+    0x7F. Commands may be split across reads, so the parser state is kept between calls.
+    """
+
+    DATA, COMMAND, OPTION, SUBNEGOTIATION, SUBNEGOTIATION_IAC = range(5)
+
+    def __init__(self, telnet: bool) -> None:
+        """Initialize the filter.
+
+        Args:
+            telnet (bool): Parse telnet commands instead of masking every byte.
+        """
+        self.telnet = telnet
+        self.state = self.DATA
+
+    def feed(self, data: bytes) -> bytes:
+        """Mask the data bytes of a chunk.
+
+        Args:
+            data (bytes): The bytes read from the connection.
+
+        Returns:
+            bytes: The bytes to send on.
+        """
+        if not self.telnet or (self.state == self.DATA and IAC not in data):
+            return data.translate(SEVEN_BIT)
+
+        out = bytearray()
+        for byte in data:
+            if self.state == self.DATA:
+                if byte == IAC:
+                    self.state = self.COMMAND
+                else:
+                    out.append(byte & 0x7F)
+            elif self.state == self.COMMAND:
+                if byte == IAC:
+                    out.append(IAC & 0x7F)  # Escaped data byte
+                    self.state = self.DATA
+                    continue
+                out += bytes((IAC, byte))
+                if byte == SB:
+                    self.state = self.SUBNEGOTIATION
+                elif WILL <= byte <= DONT:
+                    self.state = self.OPTION
+                else:
+                    self.state = self.DATA
+            elif self.state == self.OPTION:
+                out.append(byte)
+                self.state = self.DATA
+            elif self.state == self.SUBNEGOTIATION:
+                out.append(byte)
+                if byte == IAC:
+                    self.state = self.SUBNEGOTIATION_IAC
+            else:
+                out.append(byte)
+                self.state = self.DATA if byte == SE else self.SUBNEGOTIATION
+        return bytes(out)
+
+
+class TokenBucket:
+    """Token bucket that releases bytes at the configured baud rate on average.
+
+    Tokens are refilled from the monotonic clock, so sleep overshoot doesn't lower the
+    achieved rate: the time lost is paid back with a larger batch on the next send.
+    """
+
+    def __init__(self, baud: int, bits_per_byte: int) -> None:
+        """Initialize the bucket.
+
+        Args:
+            baud (int): Baud rate to emulate.
+            bits_per_byte (int): Bits on the line per byte, including start, parity and stop bits.
+        """
+        self.rate = baud / bits_per_byte  # Bytes per second
+        self.batch = max(1.0, self.rate * BATCH_INTERVAL)
+        self.burst = self.batch * 2  # Leaves room to catch up after a late wake-up
+        self.tokens = 0.0
+        self.last = time.monotonic()
+
+    def _refill(self) -> None:
+        """Add the tokens earned since the last refill, up to the burst size."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    async def take(self, wanted: int) -> int:
+        """Wait until a batch may be sent and take as many tokens as are available.
+
+        Args:
+            wanted (int): The number of bytes waiting to be sent.
+
+        Returns:
+            int: The number of bytes that may be sent now, between 1 and `wanted`.
+        """
+        self._refill()
+        target = min(wanted, self.batch)
+        if self.tokens < target:
+            await asyncio.sleep((target - self.tokens) / self.rate)
+            self._refill()
+
+        granted = max(1, min(wanted, int(self.tokens)))
+        self.tokens -= granted
+        return granted
+
+
+class Session:
+    """A single emulated modem connection and its statistics."""
+
+    def __init__(self, peer: str, listener: Listener) -> None:
+        """Initialize the session.
+
+        Args:
+            peer (str): Address of the connecting client.
+            listener (Listener): The listener the client connected to.
+        """
+        self.peer = peer
+        self.listener = listener
+        self.start = time.monotonic()
+        self.sent = {"down": 0, "up": 0}
+        self.active = {"down": 0.0, "up": 0.0}  # Seconds spent with data waiting, per direction
+
+    def achieved_baud(self, direction: str) -> float:
+        """Return the achieved baud rate while data was flowing in a direction.
+
+        Args:
+            direction (str): "down" (to the client) or "up" (to the server).
+
+        Returns:
+            float: Achieved baud rate.
+        """
+        if not self.active[direction]:
+            return 0.0
+        return self.sent[direction] * self.listener.bits_per_byte / self.active[direction]
+
+    def stats(self) -> str:
+        """Return a one-line summary of the session.
+
+        Returns:
+            str: The summary.
+        """
+        return (
+            f"{self.peer} at {self.listener.baud} baud {self.listener.framing} for {time.monotonic() - self.start:.0f}s: "
+            f"down {self.sent['down']} bytes ({self.achieved_baud('down'):.0f} baud), "
+            f"up {self.sent['up']} bytes ({self.achieved_baud('up'):.0f} baud)"
+        )
+
+
+async def throttle_relay(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, session: Session, direction: str) -> None:
+    """Relays data from one stream to another with throttling to simulate baud rate.
+
+    Each direction has its own token bucket, like a real full duplex modem.
 
     Args:
-        src (socket.socket): Source socket to read from.
-        dst (socket.socket): Destination socket to send to.
-        baud (int): Baud rate for throttling.
+        reader (asyncio.StreamReader): Stream to read from.
+        writer (asyncio.StreamWriter): Stream to send to.
+        session (Session): The session, updated with statistics.
+        direction (str): "down" or "up", used for the statistics.
     """
+    bucket = TokenBucket(session.listener.baud, session.listener.bits_per_byte)
+    seven_bit = SevenBitFilter(session.listener.telnet)
     try:
         while True:
-            data: bytes = src.recv(1)
+            data = await reader.read(READ_SIZE)
             if not data:
                 break
-            dst.sendall(data)
-            time.sleep(1 / (baud // 10))
+            if session.listener.seven_bit:
+                data = seven_bit.feed(data)
+
+            started = time.monotonic()
+            view = memoryview(data)
+            while view:
+                count = await bucket.take(len(view))
+                writer.write(view[:count])
+                await writer.drain()
+                view = view[count:]
+            session.sent[direction] += len(data)
+            session.active[direction] += time.monotonic() - started
     except (ConnectionResetError, BrokenPipeError, OSError):
         pass
 
     try:
-        dst.shutdown(socket.SHUT_WR)
+        if writer.can_write_eof():
+            writer.write_eof()
     except OSError:
         pass
 
 
-def start_tcp_server(lport: int, rport: int, baud: int) -> None:
+async def connect_upstream(listener: Listener) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Connect to the upstream host, with a timeout per attempt and exponential backoff.
+
+    Args:
+        listener (Listener): The listener that defines the upstream.
+
+    Returns:
+        tuple[asyncio.StreamReader, asyncio.StreamWriter]: The upstream streams.
+
+    Raises:
+        OSError: If all attempts failed.
+    """
+    delay = listener.backoff
+    for attempt in range(1, listener.connect_retries + 1):
+        try:
+            return await asyncio.wait_for(asyncio.open_connection(listener.host, listener.upstream_port), listener.connect_timeout)
+        except (OSError, asyncio.TimeoutError) as exc:
+            print(f"Attempt {attempt} to connect to remote {listener.host}:{listener.upstream_port} failed: {exc!r}")
+            if attempt < listener.connect_retries:
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    raise OSError(f"Unable to connect to {listener.host}:{listener.upstream_port}")
+
+
+async def handle_client(client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter, listener: Listener) -> None:
+    """Connect a new client to the remote and relay in both directions.
+
+    Every client runs in its own task, so a slow upstream connect doesn't hold up
+    accepting other callers.
+
+    Args:
+        client_reader (asyncio.StreamReader): Client stream reader.
+        client_writer (asyncio.StreamWriter): Client stream writer.
+        listener (Listener): The listener the client connected to.
+    """
+    peer = client_writer.get_extra_info("peername")
+    if listener.active >= listener.max_sessions:
+        print(f"[TCP] Rejected {peer} on port {listener.port}, {listener.active} sessions active")
+        client_writer.write(b"\r\nBUSY\r\n")
+        client_writer.close()
+        return
+
+    listener.active += 1
+    try:
+        print(f"[TCP] Emulator connected from {peer}")
+        try:
+            remote_reader, remote_writer = await connect_upstream(listener)
+        except OSError as exc:
+            print(f"Failed to connect to remote: {exc}")
+            client_writer.write(b"\r\nNO CARRIER\r\n")
+            client_writer.close()
+            return
+        print(f"Connected to remote {listener.host}:{listener.upstream_port}")
+
+        session = Session(str(peer), listener)
+        SESSIONS.add(session)
+        try:
+            await asyncio.gather(
+                throttle_relay(client_reader, remote_writer, session, "up"),
+                throttle_relay(remote_reader, client_writer, session, "down"),
+            )
+        finally:
+            SESSIONS.discard(session)
+            for writer in (client_writer, remote_writer):
+                writer.close()
+            print(f"[TCP] Closed {session.stats()}")
+    finally:
+        listener.active -= 1
+
+
+async def start_tcp_server(listener: Listener) -> asyncio.Server:
     """Starts a TCP server to listen for incoming client connections.
 
     Args:
-        lport: Local TCP port
-        rport: Remote TCP port
-        baud: Baud rate
+        listener (Listener): The port and line to emulate.
+
+    Returns:
+        asyncio.Server: The listening server.
     """
-    server_sock: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_sock.bind(("0.0.0.0", lport))
-    server_sock.listen(5)
-    print(f"[TCP] Listening on 0.0.0.0:{lport} at {baud} baud")
+    server = await asyncio.start_server(
+        lambda r, w: handle_client(r, w, listener),
+        "0.0.0.0",
+        listener.port,
+        reuse_address=True,
+        backlog=max(100, listener.max_sessions),
+    )
+    print(
+        f"[TCP] Listening on 0.0.0.0:{listener.port} at {listener.baud} baud {listener.framing}, "
+        f"upstream {listener.host}:{listener.upstream_port}, max {listener.max_sessions} sessions"
+    )
+    return server
 
-    def loop() -> None:
-        while True:
-            client_sock, addr = server_sock.accept()
-            print(f"[TCP] Emulator connected from {addr}")
-            remote_sock: socket.socket = socket.create_connection((HOST, rport))
-            print(f"Connected to remote {HOST}:{rport}")
-            threading.Thread(target=throttle_relay, args=(client_sock, remote_sock, baud), daemon=True).start()
-            threading.Thread(target=throttle_relay, args=(remote_sock, client_sock, baud), daemon=True).start()
 
-    threading.Thread(target=loop, daemon=True).start()
+async def report_stats() -> None:
+    """Periodically print the statistics of all active sessions."""
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        if SESSIONS:
+            print(f"[STATS] {len(SESSIONS)} active sessions")
+            for session in SESSIONS:
+                print(f"[STATS] {session.stats()}")
 
 
-def main() -> None:
-    """Main entry point for the serial emulator."""
-    start_tcp_server(lport=1223, rport=23, baud=1200)
-    # start_tcp_server(lport=1224, rport=24, baud=1200)
+async def serve() -> None:
+    """Start all configured listeners and run until cancelled."""
+    for listener in load_config():
+        await start_tcp_server(listener)
 
-    start_tcp_server(lport=2423, rport=23, baud=2400)
-    # start_tcp_server(lport=2424, rport=24, baud=2400)
+    await report_stats()
 
-    start_tcp_server(lport=9623, rport=23, baud=9600)
-    # start_tcp_server(lport=9624, rport=24, baud=9600)
 
+def main() -> None:
+    """Main entry point for the serial emulator."""
     try:
-        while True:
-            time.sleep(1)
+        asyncio.run(serve())
     except KeyboardInterrupt:
         print("\nShutting down.")
 
@@ -2,6 +2,8 @@
 
 import json
 import os
+import sqlite3
+from contextlib import closing
 from functools import wraps
 from typing import Any, Callable, Optional, TypeVar, cast
 
@@ -12,10 +14,22 @@ ResponseType = str | WerkzeugResponse
 
 F = TypeVar("F", bound=Callable[..., ResponseType])
 USER_DATA_DIR: str = os.path.abspath("/data/guests")
+USER_DB: str = os.path.abspath("/data/guests.db")
+GUEST_BACKEND: str = os.getenv("TIMEDIAL_GUEST_BACKEND", "json")  # json or sqlite, the same setting as timedial.config
 
 
 def load_user(username: str) -> Optional[dict[str, Any]]:
-    """Load user data from a file."""
+    """Load user data from the guest store selected by TIMEDIAL_GUEST_BACKEND.
+
+    With the sqlite backend a user that isn't in the database yet is read from its file,
+    like `timedial.accounts.account.read` does.
+    """
+    if GUEST_BACKEND == "sqlite" and os.path.isfile(USER_DB):
+        with closing(sqlite3.connect(f"file:{USER_DB}?mode=ro", uri=True)) as conn:
+            row = conn.execute("SELECT data FROM guests WHERE username = ?", (username,)).fetchone()
+        if row is not None:
+            return cast(dict[str, Any], json.loads(row[0]))
+
     user_file: str = os.path.join(USER_DATA_DIR, f"{username}.json")
     if not os.path.isfile(user_file):
         return None
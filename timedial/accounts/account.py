@@ -17,16 +17,16 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
+import crypt
 import getpass
-import grp
 import os
-import pwd
 import re
 import time
 from typing import Any
 
 from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, field_validator
 
+from timedial.accounts import guest_db
 from timedial.config import config
 
 USERNAME_REGEX = re.compile(r"^[a-z0-9]+$")
@@ -45,31 +45,51 @@ def validate_username(username: str) -> bool:
     return bool(USERNAME_REGEX.fullmatch(username))
 
 
-def read(username: str = getpass.getuser()) -> "UserModel":
-    """Read and parse a UserModel from the JSON file associated with the given username.
+def read(username: str | None = None) -> "UserModel":
+    """Read and parse a UserModel from the guest store.
+
+    Depending on `config.guest_backend` the user is looked up in the JSON file
+    associated with the given username, or in the indexed guest database. A user
+    missing from the database, or whose JSON file changed since it was stored, is
+    read from the JSON file, which is always written.
 
     Args:
-        username (str): The username to look up.
+        username (str | None): The username to look up. Defaults to the current user.
 
     Returns:
         UserModel: The parsed user model.
 
     Raises:
         ValueError: If the username is invalid.
-        FileNotFoundError: If the user's file does not exist.
+        FileNotFoundError: If the user does not exist.
 
     """
+    if username is None:
+        username = getpass.getuser()
+
     if not validate_username(username):
         raise ValueError("Invalid username")
 
-    with open(os.path.join(config.guest_dir, f"{username}.json")) as f:
+    path = os.path.join(config.guest_dir, f"{username}.json")
+    if config.guest_backend == "sqlite":
+        row = guest_db.fetch(username)
+        if row is not None:
+            data, updated = row
+            try:
+                stale = os.stat(path).st_mtime > updated
+            except FileNotFoundError:
+                stale = False
+            if not stale:
+                return UserModel.model_validate_json(data)
+
+    with open(path) as f:
         json_data = f.read()
 
     return UserModel.model_validate_json(json_data)
 
 
 def user_exists(username: str) -> bool:
-    """Check if json file exists for a given user.
+    """Check if a user exists in the guest store.
 
     Args:
         username (str): The username to look up.
@@ -78,35 +98,11 @@ def user_exists(username: str) -> bool:
         bool
 
     """
+    if config.guest_backend == "sqlite" and guest_db.exists(username):
+        return True
     return os.path.isfile(os.path.join(config.guest_dir, f"{username}.json"))
 
 
-def availble_ids(start: int = 1000, max_id: int = 60000) -> tuple[int, int]:
-    """Find the next available UID and GID that are equal in value and unused.
-
-    This function ensures the returned UID and GID are the same number,
-    and that number is unused by any existing user or group on the system.
-
-    Args:
-        start (int, optional): The minimum UID/GID to consider. Defaults to 1000.
-        max_id (int, optional): The maximum UID/GID to check. Defaults to 60000.
-
-    Returns:
-        tuple: A tuple (uid_gid, uid_gid) where the UID and GID are equal.
-
-    Raises:
-        ValueError: If no matching UID/GID pair is found in the specified range.
-    """
-    used_uids = {user.pw_uid for user in pwd.getpwall() if user.pw_uid >= start}
-    used_gids = {group.gr_gid for group in grp.getgrall() if group.gr_gid >= start}
-
-    for id_val in range(start, max_id):
-        if id_val not in used_uids and id_val not in used_gids:
-            return id_val, id_val
-
-    raise ValueError("No matching UID and GID found in the specified range.")
-
-
 class UserModel(BaseModel):
     """Pydantic model representing a user with optional fields and validation.
 
@@ -121,11 +117,11 @@ class UserModel(BaseModel):
     """
 
     id: tuple[int, int] = Field(
+        ...,
         frozen=True,
         title="User ID",
         description="A unique, immutable POSIX user and group ID.",
         json_schema_extra={"menu_visible": False},
-        default=availble_ids(),
     )
 
     username: str = Field(
@@ -194,10 +190,26 @@ class UserModel(BaseModel):
         """Return user-editable fields only (excluding system-managed fields)."""
         return {name: field for name, field in UserModel.model_fields.items() if name not in {"lastlogin"}}
 
+    def check_password(self, password: str) -> bool:
+        """Check a plain text password against the stored password hash.
+
+        Args:
+            password (str): The password to check.
+
+        Returns:
+            bool: True if the password matches.
+        """
+        return crypt.crypt(password, self.password_hash) == self.password_hash
+
     def write(self) -> None:
-        """Write the given UserModel to its corresponding JSON file."""
+        """Write the given UserModel to its corresponding JSON file.
+
+        This also runs as the guest, so only the JSON file is written. With the sqlite
+        backend the user creation daemon imports the changed file into the guest database.
+        """
+        data = self.model_dump_json(indent=4)
         with open(self._yaml_path, "w") as f:
-            f.write(self.model_dump_json(indent=4))
+            f.write(data)
 
     def new_login(self) -> None:
         """Reset the last login time and write the data."""
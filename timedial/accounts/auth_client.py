@@ -0,0 +1,71 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import socket
+
+# Kept out of timedial.config on purpose, importing the config pulls in pydantic
+SOCKET_PATH = os.getenv("TIMEDIAL_AUTH_SOCKET", "/run/timedial/auth.sock")
+TIMEOUT = 10
+MAX_REPLY = 64 * 1024
+
+
+def request(command: str, username: str, secret: str = "") -> tuple[bool, list[str]] | None:
+    """Send a single request to the auth daemon.
+
+    The request is a `<command> <username>` line followed by an optional secret,
+    terminated by closing the write side of the socket. The daemon answers with
+    `OK` or `FAIL` on the first line, followed by any payload lines.
+
+    This module only depends on the standard library so the sshd and PAM helpers
+    can use it without loading the rest of TimeDial.
+
+    Args:
+        command (str): One of `auth`, `account` or `pubkeys`.
+        username (str): The user the request is about.
+        secret (str): The password for `auth` requests.
+
+    Returns:
+        tuple[bool, list[str]] | None: Success flag and payload lines, or None
+        if the daemon couldn't be reached and the caller should fall back.
+    """
+    if not os.path.exists(SOCKET_PATH):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(TIMEOUT)
+            sock.connect(SOCKET_PATH)
+            sock.sendall(f"{command} {username}\n{secret}".encode())
+            sock.shutdown(socket.SHUT_WR)
+
+            reply = b""
+            while len(reply) < MAX_REPLY:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                reply += chunk
+    except OSError:
+        return None
+
+    lines = reply.decode(errors="replace").splitlines()
+    if not lines or lines[0] not in ("OK", "FAIL"):
+        return None
+
+    return lines[0] == "OK", lines[1:]
@@ -0,0 +1,163 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import grp
+import logging
+import os
+import socketserver
+from pathlib import Path
+
+from timedial.accounts import account
+from timedial.accounts.auth_client import SOCKET_PATH
+from timedial.config import config
+from timedial.logger import auth_logger_config
+
+auth_logger_config()
+logger = logging.getLogger("timedial.authd")
+
+MAX_REQUEST = 4096
+
+_cache: dict[str, tuple[float, account.UserModel]] = {}
+
+
+def get_user(username: str) -> account.UserModel | None:
+    """Return the account for a user from the cache, reloading it when the guest file changed.
+
+    The JSON file is written on every account change regardless of the guest backend,
+    so its mtime is used to invalidate the cache entry.
+
+    Args:
+        username (str): The username to look up.
+
+    Returns:
+        account.UserModel | None: The account, or None if the user doesn't exist.
+    """
+    if not account.validate_username(username):
+        return None
+
+    try:
+        mtime = os.stat(os.path.join(config.guest_dir, f"{username}.json")).st_mtime
+    except FileNotFoundError:
+        _cache.pop(username, None)
+        return None
+
+    cached = _cache.get(username)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        user = account.read(username)
+    except FileNotFoundError:
+        return None
+    _cache[username] = (mtime, user)
+    return user
+
+
+def handle(command: str, username: str, secret: str) -> tuple[bool, list[str]]:
+    """Answer a single auth request.
+
+    Args:
+        command (str): One of `auth`, `account` or `pubkeys`.
+        username (str): The user the request is about.
+        secret (str): The password for `auth` requests.
+
+    Returns:
+        tuple[bool, list[str]]: Success flag and payload lines.
+    """
+    if command == "pubkeys" and username == "guest":
+        # No pub keys allowed for guest
+        return True, []
+
+    user = get_user(username)
+    if user is None:
+        logger.error(f"User: {username} doesn't exist")
+        return False, []
+
+    if command == "auth":
+        if not secret:
+            logger.error("No password supplied")
+            return False, []
+        if not user.check_password(secret):
+            logger.error("Invalid password!")
+            return False, []
+        logger.info(f"Passed PAM auth request for: {username}")
+        return True, []
+
+    if command == "account":
+        logger.info(f"Passed PAM account request for: {username}")
+        return True, []
+
+    if command == "pubkeys":
+        return True, [key for key in user.pubkeys if "\n" not in key]
+
+    logger.error(f"Unknown request: {command}")
+    return False, []
+
+
+class AuthRequestHandler(socketserver.StreamRequestHandler):
+    """Handle a single request on the auth socket."""
+
+    def handle(self) -> None:
+        """Read the request, answer it and close the connection."""
+        data = self.rfile.read(MAX_REQUEST).decode(errors="replace")
+        header, _, secret = data.partition("\n")
+        command, _, username = header.strip().partition(" ")
+
+        try:
+            ok, payload = handle(command, username, secret)
+        except Exception as exc:
+            logger.error(f"Failed to handle {command} request for {username}: {exc}", exc_info=True)
+            ok, payload = False, []
+
+        self.wfile.write("\n".join(["OK" if ok else "FAIL", *payload, ""]).encode())
+
+
+class AuthServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Threaded UNIX socket server for auth requests."""
+
+    daemon_threads = True
+
+
+def main() -> None:
+    """Start the auth daemon.
+
+    The socket is owned by root and the guest group, so sshd's AuthorizedKeysCommand
+    (which runs as guest) and pam_exec (which runs as root) can both connect.
+    """
+    socket_dir = Path(SOCKET_PATH).parent
+    socket_dir.mkdir(parents=True, exist_ok=True)
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+
+    with AuthServer(SOCKET_PATH, AuthRequestHandler) as server:
+        try:
+            gid = grp.getgrnam("guest").gr_gid
+            os.chown(socket_dir, 0, gid)
+            os.chown(SOCKET_PATH, 0, gid)
+        except (KeyError, PermissionError) as exc:
+            logger.warning(f"Unable to hand the auth socket to the guest group: {exc}")
+        os.chmod(socket_dir, 0o750)
+        os.chmod(SOCKET_PATH, 0o660)
+
+        logger.info(f"Listening on {SOCKET_PATH}")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -26,7 +26,7 @@ from email.message import EmailMessage
 
 import bcrypt
 
-from timedial.accounts import account
+from timedial.accounts import account, id_allocator
 
 SSH = any(var in os.environ for var in ["SSH_CONNECTION", "SSH_CLIENT", "SSH_TTY"])
 
@@ -58,7 +58,7 @@ def create_user() -> None:
 
     Once all inputs are collected and validated:
     - The password is securely hashed using SHA-512.
-    - A UserModel instance is created and saved using `account.write()`.
+    - A UID/GID is reserved, and a UserModel instance is created and saved using `account.write()`.
     - The function waits for the system user to be recognized via `pwd.getpwnam()`.
 
     On successful creation, the user is notified and prompted to log in.
@@ -115,14 +115,17 @@ def create_user() -> None:
     # Put it all together:
     hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
 
-    model = account.UserModel(
-        username=username,
-        password_hash=hashed.decode("utf-8"),
-        email=email,
-        pubkeys=pubkeys,
-        realname=realname,
-    )
-    model.write()
+    # The ID stays locked until the guest is stored, and is freed again if that fails
+    with id_allocator.reserve() as ids:
+        model = account.UserModel(
+            id=ids,
+            username=username,
+            password_hash=hashed.decode("utf-8"),
+            email=email,
+            pubkeys=pubkeys,
+            realname=realname,
+        )
+        model.write()
 
     time.sleep(1)
     while True:
@@ -20,176 +20,258 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 import argparse
 import logging
 import os
-import re
-import subprocess
+import queue
 import time
+from collections.abc import Iterable
 from pathlib import Path
 
-from watchdog.events import DirCreatedEvent, FileCreatedEvent, FileSystemEventHandler
+from watchdog.events import DirCreatedEvent, DirModifiedEvent, FileCreatedEvent, FileModifiedEvent, FileSystemEvent, FileSystemEventHandler
 from watchdog.observers import Observer
 
-from timedial.accounts import account
+from timedial import metrics
+from timedial.accounts import account, guest_db, id_allocator, provision
 from timedial.config import config
 from timedial.logger import auth_logger_config
 
-USERNAME_PATTERN = re.compile(r"^[a-zA-Z0-9]+$")
+BATCH_SIZE = 500  # Accounts written to the account files at once
+BATCH_DELAY = 0.2  # Seconds to wait for more guest files before writing a batch
 
 auth_logger_config()
 logger = logging.getLogger("timedial.crd")
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--no-home-dir", action="store_true", help="If set, do not create the home directory.")
+BATCH_SECONDS = metrics.histogram("timedial_provision_batch_seconds", "Time spent writing a batch of accounts to the account files.")
+USER_SECONDS = metrics.histogram("timedial_provision_user_seconds", "Time spent setting up the home directory and files of a user.")
+BATCH_SIZES = metrics.histogram("timedial_provision_batch_size", "Accounts per batch.", buckets=(1, 2, 5, 10, 25, 50, 100, 250, BATCH_SIZE))
+CREATED = metrics.counter("timedial_provision_users_created_total", "Users created.")
+ERRORS = metrics.counter("timedial_provision_errors_total", "Failures while provisioning users.", ["stage"])
+GUESTS = metrics.gauge("timedial_provision_guest_files", "Guest files found at startup.")
 
-args = parser.parse_args()
 
-
-def process_file(path: str) -> None:
-    """Create a user if the username (derived from the filename) does not already exist.
+def load_accounts(usernames: Iterable[str]) -> list[provision.Account]:
+    """Read the guests from the guest store.
 
     Args:
-        path (str): The full path to the JSON file containing guest info.
+        usernames (Iterable[str]): The guests to read.
 
+    Returns:
+        list[provision.Account]: The accounts of the guests that could be read.
     """
-    username = Path(path).stem
-    userdata = account.read(username)
+    accounts = []
+    for username in usernames:
+        try:
+            userdata = account.read(username)
+        except Exception as exc:
+            ERRORS.labels("read").inc()
+            logger.error(f"Failed to read guest {username}: {exc}")
+            continue
+        accounts.append(provision.Account(username, *userdata.id))
+    return accounts
 
-    try:
-        subprocess.run(
-            ["id", username],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-        logger.error(f"User already exists: {username}")
-        return
-    except subprocess.CalledProcessError:
-        # User doesn't exist yet
-        pass
 
-    try:
-        logger.info(f"Creating group: {username}")
-        subprocess.run(
-            [
-                "groupadd",
-                "-g",
-                str(userdata.id[1]),
-                username,
-            ],
-            check=True,
-        )
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Failed to create group {username}: {e}")
-
-    if args.no_home_dir:
+def provision_users(files: provision.AccountFiles, usernames: list[str], no_home_dir: bool) -> None:
+    """Create the system accounts of guests that don't have one yet.
+
+    The accounts are written to the account files in batches, after which the home
+    directories, Maildirs and guest file ownership are set up.
+
+    Args:
+        files (provision.AccountFiles): The parsed account files.
+        usernames (list[str]): The guests, derived from the guest file names.
+        no_home_dir (bool): Create users without a home directory or login shell.
+    """
+    accounts = load_accounts(files.missing(usernames))
+    shell = provision.NOLOGIN_SHELL if no_home_dir else provision.LOGIN_SHELL
+    mode = provision.home_mode()
+    guest_gid = files.groups.get("guest", -1)
+
+    for i in range(0, len(accounts), BATCH_SIZE):
+        batch = accounts[i : i + BATCH_SIZE]
+        BATCH_SIZES.observe(len(batch))
         try:
-            logger.info(f"Creating user: {username}")
-            subprocess.run(
-                [
-                    "useradd",
-                    "-M",
-                    "-s",
-                    "/usr/sbin/nologin",
-                    "-u",
-                    str(userdata.id[0]),
-                    "-g",
-                    str(userdata.id[1]),
-                    "-G",
-                    "guestusers",
-                    username,
-                ],
-                check=True,
-            )
-            return
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to create user {username}: {e}")
+            with BATCH_SECONDS.time():
+                added = files.add(batch, shell)
+        except Exception as exc:
+            ERRORS.labels("account").inc(len(batch))
+            logger.error(f"Failed to create users {', '.join(entry.username for entry in batch)}: {exc}")
+            continue
+
+        ERRORS.labels("account").inc(len(batch) - len(added))
+        CREATED.inc(len(added))
+        for entry in added:
+            logger.info(f"Created user: {entry.username}")
+            if no_home_dir:
+                continue
+
+            with USER_SECONDS.time():
+                setup_user(entry, mode, guest_gid)
 
+
+def setup_user(entry: provision.Account, mode: int, guest_gid: int) -> None:
+    """Create the home directory and Maildir of a new user and hand it its guest file.
+
+    Args:
+        entry (provision.Account): The new user.
+        mode (int): Mode of the home directory.
+        guest_gid (int): GID of the guest group, which keeps access to the guest file.
+    """
     try:
-        logger.info(f"Creating user: {username}")
-        subprocess.run(
-            [
-                "useradd",
-                "-m",
-                "-k",
-                "/etc/skel-guest",
-                "-s",
-                "/usr/local/bin/timedial-login",
-                "-u",
-                str(userdata.id[0]),
-                "-g",
-                str(userdata.id[1]),
-                "-G",
-                "guestusers",
-                username,
-            ],
-            check=True,
-        )
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Failed to create user {username}: {e}")
+        home = provision.create_home(entry, mode=mode)
+        provision.create_maildir(entry, home)
+    except Exception as exc:
+        ERRORS.labels("home").inc()
+        logger.error(f"Failed to create home directory for {entry.username}: {exc}")
 
     try:
-        maildir = Path(os.path.join(os.path.expanduser(f"~{username}"), "Maildir"))
-        if maildir.exists() and not maildir.is_dir():
-            logger.warning(f"Maildir: {maildir} exists, but is not a directory!")
-            maildir.unlink()  # Deletes file, symlink, etc.
-        if not maildir.exists():
-            os.mkdir(maildir)
-        os.chown(maildir, userdata.id[0], userdata.id[1])
-        os.chmod(maildir, 0o700)
+        os.chown(os.path.join(config.guest_dir, f"{entry.username}.json"), entry.uid, guest_gid)
     except Exception as exc:
-        logger.error(f"Failed to create maildir: {maildir}: {exc}")
+        ERRORS.labels("ownership").inc()
+        logger.error(f"Failed to set ownership for user file {entry.username}: {exc}")
+
+
+def reconcile_ids(files: provision.AccountFiles) -> None:
+    """Free the IDs of deleted guests in the shared ID map.
+
+    The guests are listed again while the map is locked, so IDs reserved by signups
+    during the startup pass aren't freed. Guests without an account, those that failed
+    or are still queued, are read from the guest store so their IDs stay reserved.
+
+    Args:
+        files (provision.AccountFiles): The parsed account files.
+    """
+
+    def used() -> set[int]:
+        files.refresh()
+        usernames = [entry.stem for entry in Path(config.guest_dir).glob("*.json")]
+        ids = set(files.users.values()) | set(files.groups.values())
+        ids.update(entry.uid for entry in load_accounts(files.missing(usernames)))
+        return ids
 
     try:
-        logger.info(f"Set user file ownership: {username}")
-        subprocess.run(["chown", f"{username}:guest", path], check=True)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Failed to set ownership for user file {username}: {e}")
+        freed = id_allocator.IdAllocator().reconcile(used)
+        logger.info(f"Freed {freed} IDs of deleted guests.")
+    except Exception as exc:
+        logger.error(f"Failed to reconcile the ID map: {exc}")
+
+
+def sync_guest_db(usernames: list[str]) -> None:
+    """Import the changed guest files into the guest database, with the sqlite backend.
+
+    Args:
+        usernames (list[str]): The guests whose files may have changed.
+    """
+    if config.guest_backend != "sqlite":
+        return
+    try:
+        count = guest_db.sync(config.guest_dir, usernames)
+        if count:
+            logger.info(f"Imported {count} changed guest files into the guest database.")
+    except Exception as exc:
+        ERRORS.labels("database").inc()
+        logger.error(f"Failed to update the guest database: {exc}")
 
 
 class GuestFileHandler(FileSystemEventHandler):
-    """Handle system events and process newly created JSON files."""
+    """Handle system events and queue the usernames of created and modified JSON files."""
 
-    def on_created(self, event: DirCreatedEvent | FileCreatedEvent) -> None:
-        """Handle newly created files.
+    def __init__(self, pending: "queue.Queue[str]") -> None:
+        """Initialize the handler.
 
         Args:
-            event (FileSystemEvent): The event representing file creation.
+            pending (queue.Queue[str]): Queue receiving the usernames.
+        """
+        self.pending = pending
+
+    def queue(self, event: FileSystemEvent) -> None:
+        """Queue the username of a guest file.
 
+        Args:
+            event (FileSystemEvent): An event of the guest directory.
         """
         if event.is_directory:
             return
         if not str(event.src_path).endswith(".json"):
             return
 
-        process_file(str(event.src_path))
+        self.pending.put(Path(str(event.src_path)).stem)
+
+    def on_created(self, event: DirCreatedEvent | FileCreatedEvent) -> None:
+        """Handle newly created files.
+
+        Args:
+            event (FileSystemEvent): The event representing file creation.
+
+        """
+        self.queue(event)
+
+    def on_modified(self, event: DirModifiedEvent | FileModifiedEvent) -> None:
+        """Handle modified files, which are queued like new ones.
+
+        Args:
+            event (FileSystemEvent): The event representing file modification.
+
+        """
+        self.queue(event)
+
+
+def next_batch(pending: "queue.Queue[str]") -> list[str]:
+    """Wait for a new guest, then collect the guests created right after it.
+
+    Args:
+        pending (queue.Queue[str]): Queue receiving the usernames.
+
+    Returns:
+        list[str]: Up to BATCH_SIZE usernames.
+    """
+    batch = [pending.get()]
+    while len(batch) < BATCH_SIZE:
+        try:
+            batch.append(pending.get(timeout=BATCH_DELAY))
+        except queue.Empty:
+            break
+    return batch
 
 
 def create_user_daemon() -> None:
     """Start the guest user creation daemon.
 
     This function sets up a directory watcher using watchdog to monitor
-    for new JSON files in a specified directory. For each new file detected,
-    it processes the file to create a new system user if the user does not exist.
+    for new JSON files in a specified directory. New guests are collected
+    into batches and a system user is created for each that does not exist.
 
-    The function also ensures the directory exists and processes all existing
-    JSON files on startup.
+    The function also ensures the directory exists and, on startup, creates
+    the users of all existing JSON files missing from the account files.
     """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-home-dir", action="store_true", help="If set, do not create the home directory.")
+    args = parser.parse_args()
+
     logger.info("GuestWatcher starting up.")
+    metrics.start_exporter("create_user_daemon")
     Path(config.guest_dir).mkdir(parents=True, exist_ok=True)
 
-    # Process existing files on startup
-    for entry in Path(config.guest_dir).glob("*.json"):
-        process_file(str(entry))
-
-    # Set up watchdog observer
-    event_handler = GuestFileHandler()
+    # Watch before the startup pass, so guests created during it are queued
+    pending: queue.Queue[str] = queue.Queue()
     observer = Observer()
-    observer.schedule(event_handler, config.guest_dir, recursive=False)
+    observer.schedule(GuestFileHandler(pending), config.guest_dir, recursive=False)
     observer.start()
 
-    logger.info(f"Monitoring {config.guest_dir} for new guest files.")
-
     try:
-        observer.join()
+        files = provision.AccountFiles()
+        start = time.monotonic()
+        usernames = [entry.stem for entry in Path(config.guest_dir).glob("*.json")]
+        GUESTS.set(len(usernames))
+        provision_users(files, usernames, args.no_home_dir)
+        logger.info(f"Checked {len(usernames)} guest files in {time.monotonic() - start:.2f}s.")
+        if not args.no_home_dir:  # The sidecars mount the guest directory read-only
+            sync_guest_db(usernames)
+            reconcile_ids(files)
+
+        logger.info(f"Monitoring {config.guest_dir} for new guest files.")
+        while True:
+            batch = next_batch(pending)
+            provision_users(files, batch, args.no_home_dir)
+            if not args.no_home_dir:
+                sync_guest_db(list(dict.fromkeys(batch)))
     except Exception as e:
         logger.exception(f"Unexpected error: {e}")
         observer.stop()
@@ -21,20 +21,10 @@ import argparse
 import logging
 import sys
 
-from timedial.accounts import account
-from timedial.logger import auth_logger_config
+from timedial.accounts import auth_client
 
-auth_logger_config()
 logger = logging.getLogger("timedial.pubkeys")
 
-parser = argparse.ArgumentParser(description="Script that takes a username as a positional argument.")
-
-# Add the positional username argument
-parser.add_argument("username", type=str, help="Your username")
-
-# Parse the arguments
-args = parser.parse_args()
-
 
 def main() -> None:
     """Main entry point for the TimeDial public key retrieval script.
@@ -44,7 +34,8 @@ def main() -> None:
     argument. If the username is "guest", the script exits silently, as guest
     accounts are not allowed to have public keys.
 
-    The function performs the following steps:
+    The keys are requested from the auth daemon. If the daemon can't be reached,
+    the function performs the following steps in-process:
     - Validates that a username has been provided.
     - Checks whether the user exists in the system.
     - Reads the user's account data from storage.
@@ -57,6 +48,28 @@ def main() -> None:
 
     This script is intended to be run from sshd.
     """
+    parser = argparse.ArgumentParser(description="Script that takes a username as a positional argument.")
+
+    # Add the positional username argument
+    parser.add_argument("username", type=str, help="Your username")
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    if args.username and args.username != "guest":
+        reply = auth_client.request("pubkeys", args.username)
+        if reply is not None:
+            ok, keys = reply
+            for key in keys:
+                print(key)
+            sys.exit(0 if ok else 1)
+
+    # Daemon isn't available, handle the request in-process
+    from timedial.accounts import account
+    from timedial.logger import auth_logger_config
+
+    auth_logger_config()
+
     if not args.username:
         logger.error("No username received")
         sys.exit(1)
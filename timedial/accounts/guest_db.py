@@ -0,0 +1,201 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from collections.abc import Iterable
+from pathlib import Path
+
+from timedial.config import config
+
+logger = logging.getLogger("timedial.guestdb")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS guests (
+    username TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+_connections: dict[bool, sqlite3.Connection] = {}
+
+
+def connect(readonly: bool = True) -> sqlite3.Connection:
+    """Return a cached connection to the guest database.
+
+    Read-only connections are opened with the `mode=ro` URI so processes without
+    write access to the data directory (sshd helpers, sidecars) can still read.
+    Writable connections create the schema and switch the database to WAL mode,
+    which lets any number of readers run alongside a single writer.
+
+    Args:
+        readonly (bool): Open the database read-only. Defaults to True.
+
+    Returns:
+        sqlite3.Connection: The (cached) connection.
+    """
+    if readonly in _connections:
+        return _connections[readonly]
+
+    if readonly:
+        conn = sqlite3.connect(f"file:{config.guest_db}?mode=ro", uri=True, timeout=5)
+    else:
+        conn = sqlite3.connect(config.guest_db, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(SCHEMA)
+        conn.commit()
+
+    _connections[readonly] = conn
+    return conn
+
+
+def fetch(username: str) -> tuple[str, float] | None:
+    """Look up the JSON document for a single user.
+
+    Args:
+        username (str): The username to look up.
+
+    Returns:
+        tuple[str, float] | None: The stored JSON document and the mtime of the guest file it was
+        stored from, or None if the user doesn't exist.
+    """
+    row = connect().execute("SELECT data, updated FROM guests WHERE username = ?", (username,)).fetchone()
+    return None if row is None else (str(row[0]), float(row[1]))
+
+
+def exists(username: str) -> bool:
+    """Check if a user exists in the guest database.
+
+    Args:
+        username (str): The username to look up.
+
+    Returns:
+        bool
+    """
+    return connect().execute("SELECT 1 FROM guests WHERE username = ?", (username,)).fetchone() is not None
+
+
+def store(username: str, data: str, updated: float | None = None) -> None:
+    """Insert or replace the JSON document for a user.
+
+    Args:
+        username (str): The username to store.
+        data (str): The serialized UserModel.
+        updated (float | None): The mtime of the guest file the document comes from. Defaults to now.
+    """
+    conn = connect(readonly=False)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO guests (username, data, updated) VALUES (?, ?, ?)",
+            (username, data, time.time() if updated is None else updated),
+        )
+
+
+def sync(guest_dir: str, usernames: Iterable[str]) -> int:
+    """Import the guest files that changed since they were stored into the guest database.
+
+    Guests only write their JSON file, the database is kept up to date by root. All
+    changed files are imported in a single transaction.
+
+    Args:
+        guest_dir (str): Directory containing the `<username>.json` files.
+        usernames (Iterable[str]): The guests to check.
+
+    Returns:
+        int: The number of imported users.
+    """
+    # Imported here, account imports this module
+    from timedial.accounts.account import UserModel
+
+    conn = connect(readonly=False)
+    rows: list[tuple[str, str, float]] = []
+    for username in usernames:
+        path = os.path.join(guest_dir, f"{username}.json")
+        try:
+            mtime = os.stat(path).st_mtime
+            row = conn.execute("SELECT updated FROM guests WHERE username = ?", (username,)).fetchone()
+            if row is not None and row[0] >= mtime:
+                continue
+            data = UserModel.model_validate_json(Path(path).read_text()).model_dump_json(indent=4)
+        except Exception as exc:
+            logger.error(f"Skipping {path}: {exc}")
+            continue
+        rows.append((username, data, mtime))
+
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO guests (username, data, updated) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+
+def migrate(guest_dir: str, validate: bool = True) -> int:
+    """Import all JSON guest files into the guest database.
+
+    Existing rows are replaced, so the migration can be run repeatedly.
+    All files are imported in a single transaction.
+
+    Args:
+        guest_dir (str): Directory containing the `<username>.json` files.
+        validate (bool): Validate every file against the UserModel before importing it.
+
+    Returns:
+        int: The number of imported users.
+    """
+    # Imported here, account imports this module
+    from timedial.accounts.account import UserModel
+
+    rows: list[tuple[str, str, float]] = []
+    for entry in sorted(Path(guest_dir).glob("*.json")):
+        try:
+            data = entry.read_text()
+            if validate:
+                data = UserModel.model_validate_json(data).model_dump_json(indent=4)
+        except Exception as exc:
+            logger.error(f"Skipping {entry}: {exc}")
+            continue
+        rows.append((entry.stem, data, entry.stat().st_mtime))
+
+    conn = connect(readonly=False)
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO guests (username, data, updated) VALUES (?, ?, ?)", rows)
+
+    return len(rows)
+
+
+def main() -> None:
+    """Entry point for importing the JSON guest files into the guest database."""
+    parser = argparse.ArgumentParser(description="Import JSON guest files into the guest database.")
+    parser.add_argument("--guest-dir", default=config.guest_dir, help="Directory with the JSON guest files.")
+    parser.add_argument("--db", default=config.guest_db, help="Path of the SQLite database.")
+    parser.add_argument("--no-validate", action="store_true", help="Import files without validating them.")
+    args = parser.parse_args()
+
+    config.guest_db = args.db
+    os.makedirs(os.path.dirname(os.path.abspath(config.guest_db)), exist_ok=True)
+
+    count = migrate(args.guest_dir, validate=not args.no_validate)
+    print(f"Imported {count} users into {config.guest_db}")
+
+
+if __name__ == "__main__":
+    main()
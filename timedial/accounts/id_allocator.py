@@ -0,0 +1,249 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import fcntl
+import grp
+import logging
+import mmap
+import os
+import pwd
+import re
+import struct
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import AbstractContextManager, contextmanager
+
+from timedial.config import config
+
+logger = logging.getLogger("timedial.ids")
+
+FIRST_ID = 1000
+LAST_ID = 60000  # Exclusive
+
+MAGIC = b"TDID"
+VERSION = 1
+HEADER = struct.Struct("<4sHIII")  # magic, version, first ID, ID count, byte offset of the first possibly free ID
+FREE_BYTE = re.compile(rb"[^\xff]")
+
+
+def system_id_in_use(id_val: int) -> bool:
+    """Check whether a UID or GID is used by an account the allocator doesn't know about.
+
+    Args:
+        id_val (int): The ID to look up.
+
+    Returns:
+        bool
+    """
+    try:
+        pwd.getpwuid(id_val)
+        return True
+    except KeyError:
+        pass
+    try:
+        grp.getgrgid(id_val)
+        return True
+    except KeyError:
+        return False
+
+
+class IdAllocator:
+    """Allocates matching UID/GID pairs from a persistent bitmap.
+
+    The bitmap file holds one bit per ID in the range and is shared by every process
+    that creates guests, web and terminal signup alike. Reservations are made under an
+    exclusive flock, which `reserve` holds until the guest is stored, so concurrent
+    signups never get the same ID and `reconcile` never frees one that is still being
+    stored. The header keeps the offset of the first byte that may hold a free ID, so
+    allocation skips the allocated prefix instead of probing every ID; releasing an ID
+    moves it back.
+    """
+
+    def __init__(self, path: str | None = None, first: int = FIRST_ID, last: int = LAST_ID) -> None:
+        """Initialize the allocator.
+
+        Args:
+            path (str | None): Path of the bitmap file. Defaults to `config.id_map`.
+            first (int): The lowest ID to allocate.
+            last (int): The end of the range, exclusive.
+        """
+        self.path = path or config.id_map
+        self.first = first
+        self.count = last - first
+        self.size = HEADER.size + (self.count + 7) // 8
+
+    def _initialize(self, fd: int, used: Iterable[int]) -> None:
+        """Write an empty bitmap with the given IDs allocated."""
+        bitmap = bytearray((self.count + 7) // 8)
+        for bit in range(self.count, len(bitmap) * 8):  # Padding past the end of the range
+            bitmap[bit // 8] |= 1 << (bit % 8)
+        for id_val in used:
+            offset = id_val - self.first
+            if 0 <= offset < self.count:
+                bitmap[offset // 8] |= 1 << (offset % 8)
+
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, HEADER.pack(MAGIC, VERSION, self.first, self.count, 0) + bitmap, 0)
+
+    @contextmanager
+    def _locked(self) -> Iterator[mmap.mmap]:
+        """Lock and map the bitmap, creating it from the system accounts if it doesn't exist or doesn't match the range."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o660)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            header = os.pread(fd, HEADER.size, 0)
+            if (
+                len(header) != HEADER.size
+                or HEADER.unpack(header)[:4] != (MAGIC, VERSION, self.first, self.count)
+                or os.fstat(fd).st_size != self.size
+            ):
+                logger.info(f"Creating ID map: {self.path}")
+                if os.geteuid() == 0:
+                    # Signup runs as the guest user, which has group access to the guest directory
+                    os.fchown(fd, -1, os.stat(os.path.dirname(os.path.abspath(self.path))).st_gid)
+                self._initialize(
+                    fd,
+                    [user.pw_uid for user in pwd.getpwall()] + [group.gr_gid for group in grp.getgrall()],
+                )
+
+            with mmap.mmap(fd, self.size) as bitmap:
+                yield bitmap
+                bitmap.flush()
+        finally:
+            os.close(fd)
+
+    def _set(self, bitmap: mmap.mmap, offset: int, used: bool) -> None:
+        """Mark an ID offset as allocated or free, moving the free hint back if needed."""
+        pos = HEADER.size + offset // 8
+        if used:
+            bitmap[pos] |= 1 << (offset % 8)
+            return
+        bitmap[pos] &= ~(1 << (offset % 8))
+        magic, version, first, count, hint = HEADER.unpack_from(bitmap)
+        if offset // 8 < hint:
+            HEADER.pack_into(bitmap, 0, magic, version, first, count, offset // 8)
+
+    def _allocate(self, bitmap: mmap.mmap) -> tuple[int, int]:
+        """Mark the lowest free ID as allocated in a locked bitmap, skipping IDs taken by system accounts."""
+        magic, version, first, count, hint = HEADER.unpack_from(bitmap)
+        match = FREE_BYTE.search(bitmap, HEADER.size + hint)
+        while match:
+            pos = match.start()
+            byte = bitmap[pos]
+            bit = (~byte & (byte + 1)).bit_length() - 1  # Lowest clear bit
+            offset = (pos - HEADER.size) * 8 + bit
+            self._set(bitmap, offset, True)
+            HEADER.pack_into(bitmap, 0, magic, version, first, count, pos - HEADER.size)
+
+            id_val = self.first + offset
+            if not system_id_in_use(id_val):
+                return id_val, id_val
+            logger.warning(f"ID {id_val} is in use by a system account, skipping")
+            match = FREE_BYTE.search(bitmap, pos)
+
+        HEADER.pack_into(bitmap, 0, magic, version, first, count, count // 8)
+        raise ValueError("No matching UID and GID found in the specified range.")
+
+    def allocate(self) -> tuple[int, int]:
+        """Reserve the lowest free ID as both UID and GID.
+
+        IDs taken by accounts created outside the allocator are marked as allocated and skipped.
+
+        Returns:
+            tuple[int, int]: The UID and GID, equal in value.
+
+        Raises:
+            ValueError: If every ID in the range is allocated.
+        """
+        with self._locked() as bitmap:
+            return self._allocate(bitmap)
+
+    @contextmanager
+    def reserve(self) -> Iterator[tuple[int, int]]:
+        """Reserve the lowest free ID as both UID and GID, keeping the map locked while the guest is stored.
+
+        If the guest isn't stored, because the body raises, the ID is freed again.
+
+        Yields:
+            tuple[int, int]: The UID and GID, equal in value.
+
+        Raises:
+            ValueError: If every ID in the range is allocated.
+        """
+        with self._locked() as bitmap:
+            ids = self._allocate(bitmap)
+            try:
+                yield ids
+            except BaseException:
+                self._set(bitmap, ids[0] - self.first, False)
+                raise
+
+    def release(self, id_val: int) -> None:
+        """Return an ID to the pool, after its account was deleted.
+
+        Args:
+            id_val (int): The UID/GID to free.
+        """
+        offset = id_val - self.first
+        if 0 <= offset < self.count:
+            with self._locked() as bitmap:
+                self._set(bitmap, offset, False)
+
+    def reconcile(self, used: Callable[[], Iterable[int]]) -> int:
+        """Rebuild the bitmap from the IDs that are actually in use.
+
+        IDs of accounts that were deleted since they were allocated become free again.
+        The IDs in use are read while the map is locked, so an ID that a signup reserved
+        and is still storing can't be freed.
+
+        Args:
+            used (Callable[[], Iterable[int]]): Returns the IDs of all guests and system accounts.
+
+        Returns:
+            int: The number of IDs that were freed.
+        """
+        with self._locked() as bitmap:
+            in_use = set(used())
+            freed = 0
+            for offset in range(self.count):
+                pos = HEADER.size + offset // 8
+                if bitmap[pos] & (1 << (offset % 8)) and self.first + offset not in in_use:
+                    self._set(bitmap, offset, False)
+                    freed += 1
+            for id_val in in_use:
+                offset = id_val - self.first
+                if 0 <= offset < self.count:
+                    self._set(bitmap, offset, True)
+        return freed
+
+
+def reserve() -> AbstractContextManager[tuple[int, int]]:
+    """Reserve a matching UID and GID from the shared ID map, until the guest is stored.
+
+    Create the guest inside the `with` block, so the ID is freed again if that fails:
+
+        with id_allocator.reserve() as ids:
+            UserModel(id=ids, ...).write()
+
+    Returns:
+        AbstractContextManager[tuple[int, int]]: Yields the UID and GID, equal in value.
+
+    Raises:
+        ValueError: If every ID in the range is allocated.
+    """
+    return IdAllocator().reserve()
@@ -17,33 +17,56 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
-import crypt
 import logging
 import os
 import sys
 
-from timedial.accounts import account
-from timedial.logger import auth_logger_config
+from timedial.accounts import auth_client
 
-auth_logger_config()
 logger = logging.getLogger("timedial.pam")
 
 
 def pam_module() -> None:
     """Entry point for the PAM module.
 
-    Initializes a GuestDB instance, which performs either authentication
+    Forwards the request to the auth daemon. If the daemon can't be reached,
+    initializes a GuestDB instance, which performs either authentication
     or account checks based on the PAM_TYPE environment variable.
 
     Exits with code 1 in case of an unhandled exception.
     """
+    username = os.environ.get("PAM_USER", "")
+    pam_type = os.environ.get("PAM_TYPE", "")
+    password = read_password() if pam_type == "auth" else ""
+
+    if username and pam_type in ("auth", "account"):
+        reply = auth_client.request(pam_type, username, password)
+        if reply is not None:
+            sys.exit(0 if reply[0] else 1)
+
+    # Daemon isn't available, handle the request in-process
+    from timedial.logger import auth_logger_config
+
+    auth_logger_config()
     try:
-        GuestDB()
+        GuestDB(password)
     except Exception as exc:
         logger.error(f"Unhandled exception {exc}")
         sys.exit(1)
 
 
+def read_password() -> str:
+    """Read the password from stdin or the PAM_AUTHTOK environment variable.
+
+    Returns:
+        str: The password, or an empty string if none was supplied.
+    """
+    password = sys.stdin.read()
+    if not password:
+        password = os.environ.get("PAM_AUTHTOK", "")
+    return password
+
+
 class GuestDB:
     """PAM integration class for guest account authentication and access control.
 
@@ -56,8 +79,15 @@ class GuestDB:
 
     """
 
-    def __init__(self) -> None:
-        """Initialize the GuestDB instance."""
+    def __init__(self, password: str = "") -> None:
+        """Initialize the GuestDB instance.
+
+        Args:
+            password (str): The password for authentication requests, already read by the caller.
+        """
+        from timedial.accounts import account
+
+        self.password = password
         self.username = os.environ.get("PAM_USER", "")
         if not self.username:
             logger.error("No username received")
@@ -82,21 +112,16 @@ class GuestDB:
     def auth(self) -> None:
         """Handle PAM authentication requests.
 
-        Reads the password from stdin or the PAM_AUTHTOK environment variable.
         Validates the password using crypt against the stored password hash.
 
         Exits with code 0 if authentication is successful,
         or code 1 if it fails due to missing or incorrect credentials.
         """
-        password = sys.stdin.read()
-        if not password:
-            password = os.environ.get("PAM_AUTHTOK", "")
-        if not password:
+        if not self.password:
             logger.error("No password supplied")
             sys.exit(1)
 
-        new_hash = crypt.crypt(password, self.user_account.password_hash)
-        if new_hash != self.user_account.password_hash:
+        if not self.user_account.check_password(self.password):
             logger.error("Invalid password!")
             sys.exit(1)
 
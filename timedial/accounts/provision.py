@@ -0,0 +1,402 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import stat
+import time
+from collections.abc import Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from typing import NamedTuple
+
+logger = logging.getLogger("timedial.provision")
+
+ETC_DIR = "/etc"
+HOME_DIR = "/home"
+SKEL_DIR = "/etc/skel-guest"
+LOGIN_SHELL = "/usr/local/bin/timedial-login"
+NOLOGIN_SHELL = "/usr/sbin/nologin"
+GUEST_GROUP = "guestusers"
+
+LOCK_TIMEOUT = 15  # Seconds to wait for other tools to release the account files
+# Shadow ageing fields as written by useradd with the Debian login.defs defaults
+SHADOW_AGEING = "0:99999:7:::"
+
+
+class Account(NamedTuple):
+    """A guest account to provision."""
+
+    username: str
+    uid: int
+    gid: int
+
+
+def read_entries(path: str) -> list[list[str]]:
+    """Read a colon separated account file.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        list[list[str]]: The fields of every non-empty line, an empty list if the file doesn't exist.
+    """
+    try:
+        with open(path) as f:
+            return [line.rstrip("\n").split(":") for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def write_entries(path: str, entries: list[list[str]]) -> None:
+    """Atomically replace a colon separated account file, keeping its mode and ownership.
+
+    Like the shadow tools, the old file is kept as a backup with a `-` suffix.
+
+    Args:
+        path (str): Path to the file.
+        entries (list[list[str]]): The fields of every line.
+    """
+    st = os.stat(path)
+    tmp_path = f"{path}+"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        os.fchown(fd, st.st_uid, st.st_gid)
+        os.fchmod(fd, stat.S_IMODE(st.st_mode))
+        f.write("".join(":".join(fields) + "\n" for fields in entries))
+        f.flush()
+        os.fsync(fd)
+
+    backup = f"{path}-"
+    try:
+        os.unlink(backup)
+    except FileNotFoundError:
+        pass
+    os.link(path, backup)
+    os.replace(tmp_path, path)
+
+
+def _lock_file(path: str, deadline: float) -> str:
+    """Take a shadow-utils style lock on an account file.
+
+    The lock is a `<path>.lock` file holding the pid of its owner, created with link()
+    so it is atomic. Locks left behind by processes that no longer exist are removed.
+
+    Args:
+        path (str): Path of the account file to lock.
+        deadline (float): Monotonic time after which to give up.
+
+    Returns:
+        str: Path of the lock file.
+
+    Raises:
+        TimeoutError: If the lock wasn't released in time.
+    """
+    lock_path = f"{path}.lock"
+    tmp_path = f"{path}.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        f.write(str(os.getpid()))
+
+    try:
+        while True:
+            try:
+                os.link(tmp_path, lock_path)
+                return lock_path
+            except FileExistsError:
+                pass
+
+            try:
+                with open(lock_path) as f:
+                    pid = int(f.read().strip() or 0)
+                if pid > 0:
+                    os.kill(pid, 0)
+            except (FileNotFoundError, ValueError):
+                continue
+            except ProcessLookupError:
+                logger.warning(f"Removing stale lock: {lock_path}")
+                os.unlink(lock_path)
+                continue
+            except PermissionError:
+                pass  # The owner exists but runs as another user
+
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for {lock_path}")
+            time.sleep(0.1)
+    finally:
+        os.unlink(tmp_path)
+
+
+@contextmanager
+def locked(etc_dir: str = ETC_DIR, timeout: float = LOCK_TIMEOUT) -> Iterator[None]:
+    """Lock the account files the way useradd does.
+
+    Takes the lckpwdf(3) lock on `.pwd.lock`, then the per file locks of the shadow tools,
+    so neither glibc nor the shadow tools change the files while they are rewritten.
+
+    Args:
+        etc_dir (str): Directory holding the account files.
+        timeout (float): Seconds to wait for the locks.
+
+    Raises:
+        TimeoutError: If the locks weren't released in time.
+    """
+    deadline = time.monotonic() + timeout
+    fd = os.open(os.path.join(etc_dir, ".pwd.lock"), os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC, 0o600)
+    lock_paths: list[str] = []
+    try:
+        while True:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError as exc:
+                if exc.errno not in (errno.EACCES, errno.EAGAIN) or time.monotonic() > deadline:
+                    raise TimeoutError(f"Timed out waiting for {etc_dir}/.pwd.lock") from exc
+                time.sleep(0.1)
+
+        for name in ("passwd", "group", "shadow", "gshadow"):
+            path = os.path.join(etc_dir, name)
+            if os.path.exists(path):
+                lock_paths.append(_lock_file(path, deadline))
+        yield
+    finally:
+        for lock_path in reversed(lock_paths):
+            os.unlink(lock_path)
+        os.close(fd)
+
+
+def home_mode(etc_dir: str = ETC_DIR) -> int:
+    """Return the mode for new home directories, from HOME_MODE or UMASK in login.defs like useradd.
+
+    Args:
+        etc_dir (str): Directory holding login.defs.
+
+    Returns:
+        int: The mode.
+    """
+    settings = {}
+    try:
+        with open(os.path.join(etc_dir, "login.defs")) as f:
+            for line in f:
+                words = line.split()
+                if len(words) == 2 and not words[0].startswith("#"):
+                    settings[words[0]] = words[1]
+    except FileNotFoundError:
+        pass
+
+    try:
+        if "HOME_MODE" in settings:
+            return int(settings["HOME_MODE"], 8)
+        return 0o777 & ~int(settings.get("UMASK", "022"), 8)
+    except ValueError:
+        return 0o755
+
+
+def copy_skel(skel: str, home: str, uid: int, gid: int) -> None:
+    """Copy the skeleton directory into a home directory, owned by the user.
+
+    Args:
+        skel (str): The skeleton directory.
+        home (str): The home directory, which must exist.
+        uid (int): The owner.
+        gid (int): The group.
+    """
+    for root, dirs, files in os.walk(skel):
+        target_root = os.path.join(home, os.path.relpath(root, skel))
+        for name in dirs + files:
+            source = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+            elif os.path.isdir(source):
+                os.mkdir(target)
+                shutil.copystat(source, target)
+            else:
+                shutil.copy2(source, target)
+            os.lchown(target, uid, gid)
+
+
+class AccountFiles:
+    """The users and groups in the system account files.
+
+    The files are parsed once, so checking many guests against them takes no lookups
+    through NSS. The parsed state is refreshed when another tool changes the files.
+    """
+
+    def __init__(self, etc_dir: str = ETC_DIR) -> None:
+        """Parse the account files.
+
+        Args:
+            etc_dir (str): Directory holding the account files.
+        """
+        self.etc_dir = etc_dir
+        self.users: dict[str, int] = {}
+        self.groups: dict[str, int] = {}
+        self._stamp: tuple[int, ...] = ()
+        self.load()
+
+    def path(self, name: str) -> str:
+        """Return the path of an account file."""
+        return os.path.join(self.etc_dir, name)
+
+    def _mtimes(self) -> tuple[int, ...]:
+        return tuple(os.stat(self.path(name)).st_mtime_ns for name in ("passwd", "group"))
+
+    def load(self) -> None:
+        """Parse the passwd and group files."""
+        self._stamp = self._mtimes()
+        self.users = {fields[0]: int(fields[2]) for fields in read_entries(self.path("passwd")) if len(fields) > 2}
+        self.groups = {fields[0]: int(fields[2]) for fields in read_entries(self.path("group")) if len(fields) > 2}
+
+    def refresh(self) -> None:
+        """Parse the files again if they changed since they were last parsed."""
+        if self._mtimes() != self._stamp:
+            self.load()
+
+    def missing(self, usernames: Iterable[str]) -> list[str]:
+        """Find the users that don't exist yet.
+
+        Args:
+            usernames (Iterable[str]): The users in the guest store.
+
+        Returns:
+            list[str]: The users without a passwd entry.
+        """
+        self.refresh()
+        return [username for username in usernames if username not in self.users]
+
+    def _conflict(self, account: Account, uids: set[int], gids: dict[int, str]) -> str | None:
+        if account.username in self.users:
+            return "user already exists"
+        if account.uid in uids:
+            return f"UID {account.uid} is in use"
+        owner = gids.get(account.gid)
+        if owner is not None and owner != account.username:
+            return f"GID {account.gid} belongs to group {owner}"
+        if account.username in self.groups and self.groups[account.username] != account.gid:
+            return f"group exists with GID {self.groups[account.username]}"
+        return None
+
+    def add(self, accounts: Sequence[Account], shell: str, home_dir: str = HOME_DIR) -> list[Account]:
+        """Add users, their personal groups and their guest group membership in one pass.
+
+        The files are read again under the lock, so changes made by other tools since
+        they were parsed are kept. Accounts that conflict with existing entries are skipped.
+
+        Args:
+            accounts (Sequence[Account]): The accounts to add.
+            shell (str): The login shell of the new users.
+            home_dir (str): The directory holding the home directories.
+
+        Returns:
+            list[Account]: The accounts that were added.
+        """
+        with locked(self.etc_dir):
+            self.load()
+            passwd = read_entries(self.path("passwd"))
+            group = read_entries(self.path("group"))
+            shadow = read_entries(self.path("shadow"))
+            gshadow = read_entries(self.path("gshadow"))
+
+            uids = set(self.users.values())
+            gids = {gid: name for name, gid in self.groups.items()}
+            days = str(int(time.time() // 86400))
+
+            added = []
+            for account in accounts:
+                reason = self._conflict(account, uids, gids)
+                if reason:
+                    logger.error(f"Failed to create user {account.username}: {reason}")
+                    continue
+
+                name = account.username
+                passwd.append([name, "x", str(account.uid), str(account.gid), "", os.path.join(home_dir, name), shell])
+                shadow.append([name, "!", days, *SHADOW_AGEING.split(":")])
+                if name not in self.groups:
+                    group.append([name, "x", str(account.gid), ""])
+                    gshadow.append([name, "!", "", ""])
+                    self.groups[name] = account.gid
+                    gids[account.gid] = name
+                self.users[name] = account.uid
+                uids.add(account.uid)
+                added.append(account)
+
+            if not added:
+                return added
+
+            names = [account.username for account in added]
+            for entries in (group, gshadow):
+                for fields in entries:
+                    if fields[0] == GUEST_GROUP and len(fields) == 4:
+                        members = [member for member in fields[3].split(",") if member]
+                        fields[3] = ",".join(members + names)
+
+            write_entries(self.path("passwd"), passwd)
+            write_entries(self.path("group"), group)
+            if os.path.exists(self.path("shadow")):
+                write_entries(self.path("shadow"), shadow)
+            if os.path.exists(self.path("gshadow")):
+                write_entries(self.path("gshadow"), gshadow)
+            self._stamp = self._mtimes()
+
+        return added
+
+
+def create_home(account: Account, home_dir: str = HOME_DIR, skel: str = SKEL_DIR, mode: int = 0o755) -> str:
+    """Create a home directory from the skeleton, unless it already exists.
+
+    Args:
+        account (Account): The owner.
+        home_dir (str): The directory holding the home directories.
+        skel (str): The skeleton directory.
+        mode (int): Mode of the home directory.
+
+    Returns:
+        str: Path of the home directory.
+    """
+    home = os.path.join(home_dir, account.username)
+    try:
+        os.mkdir(home)
+    except FileExistsError:
+        logger.warning(f"Home directory already exists, not copying {skel}: {home}")
+        return home
+
+    os.chown(home, account.uid, account.gid)
+    os.chmod(home, mode)
+    if os.path.isdir(skel):
+        copy_skel(skel, home, account.uid, account.gid)
+    return home
+
+
+def create_maildir(account: Account, home: str) -> None:
+    """Create the Maildir in a home directory, owned by and private to the user.
+
+    Args:
+        account (Account): The owner.
+        home (str): The home directory.
+    """
+    maildir = os.path.join(home, "Maildir")
+    if os.path.lexists(maildir) and not os.path.isdir(maildir):
+        logger.warning(f"Maildir: {maildir} exists, but is not a directory!")
+        os.unlink(maildir)  # Deletes file, symlink, etc.
+    if not os.path.exists(maildir):
+        os.mkdir(maildir)
+    os.chown(maildir, account.uid, account.gid)
+    os.chmod(maildir, 0o700)
@@ -17,21 +17,61 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
+import heapq
 import json
 import logging
 import os
 import signal
+import threading
 import time
-from typing import Any
+from collections import defaultdict
+from collections.abc import Sequence
+from typing import Any, Protocol
 
 import psutil
-
+from watchdog.events import (
+    EVENT_TYPE_CREATED,
+    EVENT_TYPE_DELETED,
+    EVENT_TYPE_MODIFIED,
+    EVENT_TYPE_MOVED,
+    FileSystemEvent,
+    FileSystemEventHandler,
+)
+from watchdog.observers import Observer
+
+from timedial import metrics
 from timedial.config import config
 from timedial.logger import auth_logger_config
 
 auth_logger_config()
 logger = logging.getLogger("timedial.reaper")
 
+# Process attributes fetched in the single process table pass, also used for logging
+PROC_ATTRS = ["pid", "ppid", "name", "username", "terminal", "cmdline", "create_time"]
+# Events that mean utmp changed
+UTMP_EVENTS = {EVENT_TYPE_CREATED, EVENT_TYPE_DELETED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED}
+
+CYCLE_SECONDS = metrics.histogram("timedial_reaper_cycle_seconds", "Time spent handling the due sessions of a cycle.")
+SCAN_SECONDS = metrics.histogram("timedial_reaper_process_scan_seconds", "Time spent indexing the process table.")
+PROCESSES_SCANNED = metrics.counter("timedial_reaper_processes_scanned_total", "Processes seen while indexing the process table.")
+SESSIONS = metrics.gauge("timedial_reaper_sessions", "Sessions in utmp.")
+REAPED = metrics.counter("timedial_reaper_sessions_reaped_total", "Sessions whose processes were killed.", ["reason"])
+SIGNALS = metrics.counter("timedial_reaper_signals_sent_total", "Signals sent to processes.")
+
+
+class UserSession(Protocol):
+    """A logged in session, as returned by `psutil.users()`."""
+
+    @property
+    def name(self) -> str:
+        """The username."""
+        ...
+
+    @property
+    def terminal(self) -> str | None:
+        """The terminal relative to /dev, None for sessions without one."""
+        ...
+
 
 def log_dict(d: dict[str, Any], max_size: int = 512, prefix: str = "Chunk") -> None:
     """Logs a dictionary in JSON-serializable chunks, split by key groups.
@@ -75,106 +115,219 @@ def log_dict(d: dict[str, Any], max_size: int = 512, prefix: str = "Chunk") -> N
         logger.info("%s %d: %s", prefix, chunk_index, json.dumps(current, default=str))
 
 
-def kill_processes_by_user(user: psutil._common.suser, signal_type: int = signal.SIGTERM) -> None:
+class ProcessIndex:
+    """Index of the process table by user and by terminal, built in a single pass.
+
+    Attributes:
+        by_user (dict[str, list[psutil.Process]]): Processes per username.
+        by_tty (dict[str, list[psutil.Process]]): Processes per terminal device path.
+    """
+
+    def __init__(self) -> None:
+        """Walk the process table once and index every process."""
+        self.by_user: dict[str, list[psutil.Process]] = defaultdict(list)
+        self.by_tty: dict[str, list[psutil.Process]] = defaultdict(list)
+
+        count = 0
+        with SCAN_SECONDS.time():
+            for proc in psutil.process_iter(PROC_ATTRS):
+                count += 1
+                if proc.info["username"]:
+                    self.by_user[proc.info["username"]].append(proc)
+                if proc.info["terminal"]:
+                    self.by_tty[proc.info["terminal"]].append(proc)
+        PROCESSES_SCANNED.inc(count)
+
+
+def kill_processes_by_user(user: UserSession, index: ProcessIndex, signal_type: int = signal.SIGTERM) -> None:
     """Kill all processes for a given user, regardless of TTY.
 
     Args:
-        user (psutil._common.suser): The user whose processes should be killed.
+        user (UserSession): The user whose processes should be killed.
+        index (ProcessIndex): The process index for this cycle.
         signal_type (int, optional): The signal to send (default is SIGTERM).
     """
     count = 0
-    for proc in psutil.process_iter(["pid", "username"]):
+    for proc in index.by_user.get(user.name, []):
         try:
-            if proc.info["username"] == user.name:
-                logger.info(f"Killing PID {proc.pid} (user: {user.name}) because it has no terminal. Proc info: {proc.as_dict()}")
-                proc.send_signal(signal_type)
-                count += 1
+            logger.info(f"Killing PID {proc.pid} (user: {user.name}) because it has no terminal. Proc info: {proc.info}")
+            proc.send_signal(signal_type)
+            count += 1
         except (psutil.NoSuchProcess, psutil.AccessDenied):
             continue
         except Exception as exc:
             logger.error(f"Failed to kill process {proc.pid}: {exc}")
+    SIGNALS.inc(count)
     logger.info(f"Killed {count} non-TTY processes for user: {user.name}")
 
 
-def kill_processes_on_tty(user: psutil._common.suser, signal_type: int = signal.SIGTERM) -> None:
+def kill_processes_on_tty(user: UserSession, index: ProcessIndex, signal_type: int = signal.SIGTERM) -> None:
     """Kill all processes associated with the user's terminal (TTY).
 
     Args:
-        user (psutil._common.suser): The user session whose processes should be killed.
+        user (UserSession): The user session whose processes should be killed.
+        index (ProcessIndex): The process index for this cycle.
         signal_type (int, optional): The signal to send (default is SIGTERM).
     """
     count = 0
-    for proc in psutil.process_iter(["pid", "terminal"]):
+    for proc in index.by_tty.get(f"/dev/{user.terminal}", []):
         try:
-            if proc.info["terminal"] and proc.info["terminal"] == f"/dev/{user.terminal}":
-                logger.info(f"Killing PID {proc.pid} on {proc.info['terminal']}.")
-                log_dict(proc.as_dict())
+            logger.info(f"Killing PID {proc.pid} on {proc.info['terminal']}.")
+            log_dict(proc.info)
 
-                proc.send_signal(signal_type)
-                count += 1
+            proc.send_signal(signal_type)
+            count += 1
         except (psutil.NoSuchProcess, psutil.AccessDenied):
             continue
         except Exception as exc:
             logger.error(f"Failed to kill process {proc.pid} for : {exc}")
+    SIGNALS.inc(count)
     logger.info(f"Killed {count} processes for: {user.name} {user.terminal}")
 
 
-def check_idle(user: psutil._common.suser) -> bool:
-    """Check whether a user's session has been idle beyond the configured threshold.
+def idle_deadline(user: UserSession) -> float | None:
+    """Return the time at which a user's session exceeds the configured idle threshold.
 
     Args:
-        user (psutil._common.suser): The user session to check.
+        user (UserSession): The user session to check.
 
     Returns:
-        bool: True if the session has been idle too long, False otherwise.
+        float | None: Epoch time of the deadline, or None if the TTY can't be found.
     """
-    tty = user.terminal
-    tty_path = f"/dev/{tty}"
+    tty_path = f"/dev/{user.terminal}"
     try:
         atime = os.stat(tty_path).st_atime
     except FileNotFoundError:
-        logger.warning(f"Failed to get stat for: {user.name} {tty}")
-        return False
+        logger.warning(f"Failed to get stat for: {user.name} {user.terminal}")
+        return None
 
-    idle_seconds = int(time.time() - atime)
-    if idle_seconds > config.max_idle_session:
-        logger.info(f"Identified session for user: {user.name} {tty} that has been idle for: {idle_seconds} seconds")
-        return True
+    return atime + config.max_idle_session
 
-    return False
 
+class UtmpHandler(FileSystemEventHandler):
+    """Signal the reaper whenever utmp changes."""
 
-def main() -> None:
-    """Main routine for the idle session reaper.
+    def __init__(self, changed: threading.Event) -> None:
+        """Initialize the handler.
 
-    Iterates through all current user sessions. If any session for a user
-    lacks a proper TTY, all processes for that user are killed. Otherwise,
-    only idle sessions are reaped.
+        Args:
+            changed (threading.Event): Event to set when utmp changes.
+        """
+        self.changed = changed
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        """Handle any event in the utmp directory.
+
+        Args:
+            event (FileSystemEvent): The file system event.
+        """
+        if event.event_type not in UTMP_EVENTS:
+            return  # Reading utmp, which the reaper does itself, causes opened and closed events
+        if config.utmp_path in (str(event.src_path), str(getattr(event, "dest_path", ""))):
+            self.changed.set()
+
+
+class Reaper:
+    """Idle session reaper driven by utmp changes and per-session idle deadlines.
+
+    The session list is only re-read when utmp changes. Every PTY session gets an idle
+    deadline on a heap, so the reaper sleeps until the next deadline or utmp change.
+    The process table is walked at most once per cycle, and only when something
+    needs to be killed.
     """
-    while True:
-        sessions = psutil.users()
-        users_with_no_tty = set()
-        handled_users = set()
 
-        # Identify users who have any session with no or invalid TTY
-        for session in sessions:
+    def __init__(self) -> None:
+        """Initialize the reaper and start watching utmp."""
+        self.utmp_changed = threading.Event()
+        self.utmp_changed.set()  # Read the sessions on the first cycle
+        self.sessions: Sequence[UserSession] = []
+        self.deadlines: list[tuple[float, str, str]] = []  # (deadline, username, terminal)
+
+        self.observer = Observer()
+        self.observer.schedule(UtmpHandler(self.utmp_changed), os.path.dirname(config.utmp_path), recursive=False)
+        self.observer.start()
+
+    def schedule(self) -> None:
+        """Re-read the sessions from utmp and rebuild the deadline heap."""
+        self.sessions = psutil.users()
+        SESSIONS.set(len(self.sessions))
+        self.deadlines = []
+        for session in self.sessions:
             if not session.terminal or not session.terminal.startswith("pts/"):
-                users_with_no_tty.add(session.name)
+                # Non-PTY sessions are handled every cycle, recheck them regularly while they exist
+                self.deadlines.append((time.time(), session.name, session.terminal or ""))
+                continue
+            deadline = idle_deadline(session)
+            if deadline is None:
+                deadline = time.time() + config.reaper_retry  # Check again once the TTY shows up
+            self.deadlines.append((deadline, session.name, session.terminal))
+        heapq.heapify(self.deadlines)
+
+    def cycle(self) -> None:
+        """Handle all sessions whose deadline has passed.
+
+        If any session for a user lacks a proper TTY, all processes for that user are killed.
+        Otherwise, only sessions that are still idle at their deadline are reaped.
+        """
+        now = time.time()
+        users_with_no_tty = {s.name for s in self.sessions if not s.terminal or not s.terminal.startswith("pts/")}
+        sessions = {(s.name, s.terminal or ""): s for s in self.sessions}
+        index: ProcessIndex | None = None
+        handled_users = set()
 
-        # Now iterate and act once per user
-        for session in sessions:
-            if session.name in handled_users:
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, name, terminal = heapq.heappop(self.deadlines)
+            session = sessions.get((name, terminal))
+            if session is None or name in handled_users:
+                heapq.heappush(self.deadlines, (now + config.reaper_retry, name, terminal))
                 continue
 
-            if session.name in users_with_no_tty:
-                logger.info(f"User {session.name} has a non-PTY session. Killing all their processes.")
-                kill_processes_by_user(session)
-            elif check_idle(session):
-                kill_processes_on_tty(session)
+            if name in users_with_no_tty:
+                logger.info(f"User {name} has a non-PTY session. Killing all their processes.")
+                index = index or ProcessIndex()
+                kill_processes_by_user(session, index)
+                REAPED.labels("no_tty").inc()
+                handled_users.add(name)
+                heapq.heappush(self.deadlines, (now + config.reaper_retry, name, terminal))
+                continue
 
-            handled_users.add(session.name)
+            # The user may have typed since the deadline was scheduled
+            deadline = idle_deadline(session)
+            if deadline is None:
+                heapq.heappush(self.deadlines, (now + config.reaper_retry, name, terminal))
+                continue
+            if deadline > now:
+                heapq.heappush(self.deadlines, (deadline, name, terminal))
+                continue
+
+            idle_seconds = int(now - deadline + config.max_idle_session)
+            logger.info(f"Identified session for user: {name} {terminal} that has been idle for: {idle_seconds} seconds")
+            index = index or ProcessIndex()
+            kill_processes_on_tty(session, index)
+            REAPED.labels("idle").inc()
+            handled_users.add(name)
+            heapq.heappush(self.deadlines, (now + config.reaper_retry, name, terminal))
+
+    def run(self) -> None:
+        """Sleep until the next deadline or utmp change and handle the due sessions."""
+        while True:
+            if self.utmp_changed.is_set():
+                self.utmp_changed.clear()
+                self.schedule()
 
-        time.sleep(1)
+            with CYCLE_SECONDS.time():
+                self.cycle()
+
+            timeout: float = config.max_idle_session
+            if self.deadlines:
+                timeout = max(0, min(timeout, self.deadlines[0][0] - time.time()))
+            self.utmp_changed.wait(timeout)
+
+
+def main() -> None:
+    """Main routine for the idle session reaper."""
+    metrics.start_exporter("session_reaper")
+    Reaper().run()
 
 
 if __name__ == "__main__":
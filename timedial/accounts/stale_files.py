@@ -18,51 +18,314 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
 import gzip
+import json
 import logging
+import math
+import multiprocessing
 import os
-import shutil
+import stat
+import tempfile
 import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from typing import Any, NamedTuple
 
+from timedial import metrics
 from timedial.config import config
 from timedial.logger import daemon_logger_config
 
 daemon_logger_config()
 logger = logging.getLogger("timedial.stale_files")
 
+HOME_DIR = "/home"
+COMPRESSED_MAGIC = (b"\x1f\x8b", b"\x28\xb5\x2f\xfd")  # gzip, zstd
+CHUNK_SIZE = 1024 * 1024
 
-def compress_stale() -> None:
-    """Recursively scan HOME_DIR and gzip stale, large, uncompressed files."""
-    age_limit: float = time.time() - (config.stale_files_age)
-    for dirpath, _, filenames in os.walk("/home"):
-        for fname in filenames:
-            path: str = os.path.join(dirpath, fname)
-            try:
-                if not os.path.isfile(path):
-                    continue
-                if os.path.getsize(path) < config.stale_files_size:
-                    continue
-                if os.path.getatime(path) > age_limit or os.path.getmtime(path) > age_limit:
+SCAN_SECONDS = metrics.histogram("timedial_stale_files_scan_seconds", "Time spent scanning the home directories per pass.")
+PASS_SECONDS = metrics.histogram("timedial_stale_files_pass_seconds", "Time spent on a pass, scanning and compressing.")
+DIRECTORIES = metrics.gauge("timedial_stale_files_directories", "Directories in the last pass.", ["state"])
+COMPRESSED = metrics.counter("timedial_stale_files_compressed_total", "Files compressed.")
+RECLAIMED = metrics.counter("timedial_stale_files_reclaimed_bytes_total", "Bytes reclaimed by compressing files.")
+ERRORS = metrics.counter("timedial_stale_files_errors_total", "Files that failed to compress.")
+
+
+class FileIdentity(NamedTuple):
+    """What a file was when it was scanned, to check it's still the same file when it's compressed."""
+
+    device: int
+    inode: int
+    size: int
+    mtime_ns: int
+
+    @classmethod
+    def of(cls, st: os.stat_result) -> "FileIdentity":
+        """Return the identity of a stat result."""
+        return cls(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class Scanner:
+    """Incremental scanner for stale, large, uncompressed files.
+
+    For every directory the index records its inode and mtime, its subdirectories and
+    the earliest time one of its large files becomes stale. A directory whose inode and
+    mtime didn't change and that has nothing due isn't listed again; only its
+    subdirectories are stat'ed. A directory with stale files is due right away, so
+    files that failed to compress are retried. Files that grow in place don't change
+    the directory, so every `stale_files_full_scan` passes all directories are listed
+    again. The staged simulators in `config.simulator_cache` are never scanned, the
+    homes clone them without reading them, so they would look stale.
+
+    Attributes:
+        index (dict[str, dict[str, Any]]): The index from the previous pass.
+        new_index (dict[str, dict[str, Any]]): The index built during this pass.
+        candidates (list[tuple[str, FileIdentity]]): Stale files and their identity found during this pass.
+    """
+
+    def __init__(self, index: dict[str, dict[str, Any]], full: bool = False) -> None:
+        """Initialize the scanner.
+
+        Args:
+            index (dict[str, dict[str, Any]]): The index from the previous pass.
+            full (bool): List every directory, regardless of the index.
+        """
+        self.index = index
+        self.full = full
+        self.new_index: dict[str, dict[str, Any]] = {}
+        self.candidates: list[tuple[str, FileIdentity]] = []
+        self.now = time.time()
+        self.excluded = {os.path.abspath(config.simulator_cache)}
+        self.listed = 0
+        self.skipped = 0
+
+    def scan(self, path: str, dir_stat: os.stat_result) -> None:
+        """Scan a directory and its subdirectories.
+
+        Args:
+            path (str): The directory to scan.
+            dir_stat (os.stat_result): The stat of the directory.
+        """
+        if os.path.abspath(path) in self.excluded:
+            return
+        entry = self.index.get(path)
+        if (
+            not self.full
+            and entry
+            and entry["inode"] == dir_stat.st_ino
+            and entry["mtime"] == dir_stat.st_mtime_ns
+            and entry["due"] > self.now
+        ):
+            self.skipped += 1
+            self.new_index[path] = entry
+            for name in entry["subdirs"]:
+                subdir = os.path.join(path, name)
+                try:
+                    sub_stat = os.stat(subdir, follow_symlinks=False)
+                except OSError:
                     continue
-                with open(path, "rb") as f_in:
-                    if f_in.read(2) == b"\x1f\x8b":
-                        continue
-                    with gzip.open(path + ".gz", "wb") as f_out:
-                        f_in.seek(0)
-                        shutil.copyfileobj(f_in, f_out)
-                os.remove(path)
-                logger.info(f"Compressed: {path}")
+                if stat.S_ISDIR(sub_stat.st_mode):
+                    self.scan(subdir, sub_stat)
+            return
+
+        self.listed += 1
+        age_limit = self.now - config.stale_files_age
+        due = math.inf
+        subdirs: list[tuple[str, os.stat_result]] = []
+        try:
+            with os.scandir(path) as it:
+                for dir_entry in it:
+                    try:
+                        if dir_entry.is_dir(follow_symlinks=False):
+                            subdirs.append((dir_entry.name, dir_entry.stat(follow_symlinks=False)))
+                            continue
+                        if not dir_entry.is_file(follow_symlinks=False):
+                            continue
+
+                        file_stat = dir_entry.stat(follow_symlinks=False)
+                        if file_stat.st_size < config.stale_files_size:
+                            continue
+                        if file_stat.st_atime > age_limit or file_stat.st_mtime > age_limit:
+                            due = min(due, max(file_stat.st_atime, file_stat.st_mtime) + config.stale_files_age)
+                            continue
+                        if is_compressed(dir_entry.path):
+                            continue
+                        self.candidates.append((dir_entry.path, FileIdentity.of(file_stat)))
+                        due = self.now  # List it again next pass, in case compressing the file fails
+                    except Exception as exc:
+                        logger.exception(f"Error processing {dir_entry.path}: {exc}")
+        except OSError as exc:
+            logger.error(f"Failed to scan {path}: {exc}")
+            return
+
+        self.new_index[path] = {
+            "inode": dir_stat.st_ino,
+            "mtime": dir_stat.st_mtime_ns,
+            "due": due,
+            "subdirs": [name for name, _ in subdirs],
+        }
+        for name, sub_stat in subdirs:
+            self.scan(os.path.join(path, name), sub_stat)
+
+
+def is_compressed(path: str) -> bool:
+    """Check whether a file starts with the gzip or zstd magic number.
+
+    Args:
+        path (str): The file to check.
+
+    Returns:
+        bool
+    """
+    with open(path, "rb") as f:
+        return f.read(4).startswith(COMPRESSED_MAGIC)
 
+
+def compress(path: str, identity: FileIdentity, rate: float) -> int:
+    """Gzip a file and remove the original, reading at most `rate` bytes per second.
+
+    Runs as root in a worker process, well after the scan, in directories the guests
+    control. The file is opened through its directory without following symlinks and
+    skipped unless it's still the regular file that was scanned. The compressed file
+    is created next to it, in the same directory, with the owner and mode of the original.
+
+    Args:
+        path (str): The file to compress.
+        identity (FileIdentity): The file as it was scanned.
+        rate (float): Maximum read rate in bytes per second, 0 for unlimited.
+
+    Returns:
+        int: The number of bytes reclaimed, 0 if the file was skipped.
+    """
+    directory, name = os.path.split(path)
+    dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+    try:
+        fd = os.open(name, os.O_RDONLY | os.O_NOFOLLOW | os.O_CLOEXEC, dir_fd=dir_fd)
+        with os.fdopen(fd, "rb") as f_in:
+            st = os.fstat(f_in.fileno())
+            if not stat.S_ISREG(st.st_mode) or FileIdentity.of(st) != identity:
+                logger.warning(f"Skipping {path}, it changed since it was scanned")
+                return 0
+            if f_in.read(4).startswith(COMPRESSED_MAGIC):
+                return 0
+            f_in.seek(0)
+
+            start = time.monotonic()
+            done = 0
+            out_fd = os.open(f"{name}.gz", os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW | os.O_CLOEXEC, 0o600, dir_fd=dir_fd)
+            try:
+                os.fchown(out_fd, st.st_uid, st.st_gid)
+                os.fchmod(out_fd, stat.S_IMODE(st.st_mode))
+                with os.fdopen(out_fd, "wb") as raw:
+                    with gzip.GzipFile(filename=name, mode="wb", fileobj=raw) as f_out:
+                        while chunk := f_in.read(CHUNK_SIZE):
+                            f_out.write(chunk)
+                            done += len(chunk)
+                            if rate:
+                                ahead = done / rate - (time.monotonic() - start)
+                                if ahead > 0:
+                                    time.sleep(ahead)
+                    compressed_size = raw.tell()
+            except BaseException:
+                os.unlink(f"{name}.gz", dir_fd=dir_fd)
+                raise
+
+        if FileIdentity.of(os.stat(name, dir_fd=dir_fd, follow_symlinks=False)) != identity:
+            logger.warning(f"Keeping {path}, it changed while it was compressed")
+            os.unlink(f"{name}.gz", dir_fd=dir_fd)
+            return 0
+        os.unlink(name, dir_fd=dir_fd)
+    finally:
+        os.close(dir_fd)
+    return identity.size - compressed_size
+
+
+def load_index() -> dict[str, dict[str, Any]]:
+    """Load the scan index from the previous pass.
+
+    Returns:
+        dict[str, dict[str, Any]]: The index, empty if it doesn't exist or can't be read.
+    """
+    try:
+        with open(config.stale_files_index) as f:
+            return dict(json.load(f))
+    except FileNotFoundError:
+        return {}
+    except Exception as exc:
+        logger.error(f"Failed to read scan index, starting over: {exc}")
+        return {}
+
+
+def save_index(index: dict[str, dict[str, Any]]) -> None:
+    """Atomically write the scan index.
+
+    Args:
+        index (dict[str, dict[str, Any]]): The index to save.
+    """
+    directory = os.path.dirname(config.stale_files_index)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".stale_files.")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, config.stale_files_index)
+    except Exception as exc:
+        logger.error(f"Failed to write scan index: {exc}")
+
+
+def compress_stale(full: bool = False) -> int:
+    """Recursively scan HOME_DIR and gzip stale, large, uncompressed files.
+
+    Args:
+        full (bool): List every directory instead of skipping unchanged ones.
+
+    Returns:
+        int: The number of bytes reclaimed.
+    """
+    scanner = Scanner(load_index(), full=full)
+    try:
+        with SCAN_SECONDS.time():
+            scanner.scan(HOME_DIR, os.stat(HOME_DIR))
+    except OSError as exc:
+        logger.error(f"Failed to scan {HOME_DIR}: {exc}")
+        return 0
+    save_index(scanner.new_index)
+    DIRECTORIES.labels("listed").set(scanner.listed)
+    DIRECTORIES.labels("skipped").set(scanner.skipped)
+    logger.info(f"Listed {scanner.listed} directories, skipped {scanner.skipped} unchanged, found {len(scanner.candidates)} stale files")
+
+    reclaimed = 0
+    if not scanner.candidates:
+        return reclaimed
+
+    workers = max(1, min(config.stale_files_workers, len(scanner.candidates)))
+    rate = config.stale_files_rate / workers
+    # The metrics exporter thread is running, forking this process could copy a held lock into the workers
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver")) as executor:
+        futures = {path: executor.submit(compress, path, identity, rate) for path, identity in scanner.candidates}
+        for path, future in futures.items():
+            try:
+                saved = future.result()
+                reclaimed += saved
+                COMPRESSED.inc()
+                RECLAIMED.inc(saved)
+                logger.info(f"Compressed: {path}, reclaimed {saved} bytes")
             except Exception as exc:
-                logger.exception(f"Error processing {path}: {exc}")
+                ERRORS.inc()
+                logger.error(f"Error processing {path}: {exc}")
+
+    return reclaimed
 
 
 def main() -> None:
     """Continuously run the scanner every SLEEP_INTERVAL_SECONDS."""
+    metrics.start_exporter("stale_files")
+    passes = 0
     while True:
-        logger.info(f"[{datetime.now()}] Starting scan...")
-        compress_stale()
-        logger.info(f"[{datetime.now()}] Scan complete. Sleeping for {config.stale_files_sleep} seconds.")
+        full = config.stale_files_full_scan <= 0 or passes % config.stale_files_full_scan == 0
+        logger.info(f"[{datetime.now()}] Starting {'full' if full else 'incremental'} scan...")
+        with PASS_SECONDS.time():
+            reclaimed = compress_stale(full=full)
+        passes += 1
+        logger.info(f"[{datetime.now()}] Scan complete, reclaimed {reclaimed} bytes. Sleeping for {config.stale_files_sleep} seconds.")
         time.sleep(config.stale_files_sleep)
 
 
@@ -28,16 +28,35 @@ class Config(BaseModel):
 
     _ephemeral: bool = not os.path.ismount("/home")
     guest_dir: str = "/data/guests"
+    guest_backend: str = os.getenv("TIMEDIAL_GUEST_BACKEND", "json")  # json or sqlite
+    guest_db: str = "/data/guests.db"
+    id_map: str = "/data/guests/.id_map"  # Allocated guest UIDs/GIDs, writable by signup
     menu_file: str = "/opt/timedial/menu.yaml"
+    menu_cache_dir: str = "/opt/timedial/cache"
+    user_cache_dir_str: str = "~/.cache/timedial"
+    ui_profile: str = os.getenv("TIMEDIAL_UI", "auto")  # auto, full or low
+    ui_low_bandwidth_baud: int = 9600  # Use the low bandwidth profile at or below this line speed
     simulator_path: str = "/opt/simulators"
+    simulator_cache: str = "/home/.simulators"  # Decompressed simulators on the home filesystem, cloned into the homes
+    sim_ledger_dir: str = "/var/lib/timedial/simulators"  # Ledger of completed simulator runs and the users running each
     ui_logger_path_str: str = "~/.timedial.log"
     ui_logger_level: int = logging.INFO
     auth_logger_level: int = logging.INFO
     stale_files_size: int = 20 * 1024 * 1024  # 20MiB
     stale_files_age: int = 24 * 3600  # 24 hours
     stale_files_sleep: int = 60 * 60  # Once per hour
+    stale_files_full_scan: int = 24  # List every directory once every 24 passes, 0 lists them every pass
+    stale_files_index: str = "/data/stale_files_index.json"
+    stale_files_workers: int = 2
+    stale_files_rate: int = 32 * 1024 * 1024  # 32MiB/s read rate across all workers
     max_idle_session: int = 60 * 30  # 30 minutes
+    reaper_retry: int = 5  # Recheck reaped sessions that are still in utmp
+    utmp_path: str = "/var/run/utmp"
+    wtmp_path: str = "/var/log/wtmp"
     stats_dir: str = "/data/stats"
+    stats_history_dir: str = "/data/stats_history"  # Usage history rings, not published with the stats
+    metrics_dir: str = "/var/lib/timedial/metrics"  # Prometheus textfile collector directory
+    metrics_interval: int = 15  # Seconds between metrics exports
 
     @property
     def ui_logger_path(self) -> str:
@@ -48,11 +67,22 @@ class Config(BaseModel):
         """
         return os.path.expanduser(self.ui_logger_path_str)
 
+    @property
+    def user_cache_dir(self) -> str:
+        """Returns the expanded file system path for the user's cache directory.
+
+        Returns:
+            str: Absolute path with '~' expanded to the user's home directory.
+        """
+        return os.path.expanduser(self.user_cache_dir_str)
+
 
 config = Config()
 
 if os.getenv("TIMEDIAL_ENV", "") == "local":
     config.guest_dir = "files/data/guests"
+    config.guest_db = "files/data/guests.db"
+    config.id_map = "files/data/guests/.id_map"
     config.menu_file = "files/opt/timedial/menu.yaml"
     # config.ui_logger_path_str = "files/log/timedial.log"
     config.ui_logger_level = logging.DEBUG
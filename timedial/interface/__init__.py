@@ -17,11 +17,19 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
-from typing import Callable
+from typing import TYPE_CHECKING, Callable
 
-from timedial.interface.menu_data import MainMenu
-from timedial.interface.simulators import load_simulators
+if TYPE_CHECKING:
+    from timedial.interface.menu_data import MainMenu
 
-MENU_CALLABLES: dict[str, Callable[[], MainMenu]] = {
+
+def load_simulators() -> "MainMenu":
+    """Load the simulator menu through the menu cache, imported on first use as it's not needed to draw the first screen."""
+    from timedial.interface.menu_cache import cached_simulators
+
+    return cached_simulators()
+
+
+MENU_CALLABLES: dict[str, Callable[[], "MainMenu"]] = {
     "simulators": load_simulators,
 }
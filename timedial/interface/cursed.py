@@ -20,16 +20,148 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 import curses
 import logging
 import os
+import select
+import sys
 import textwrap
 from abc import ABC, abstractmethod
+from collections.abc import Iterable
+from functools import lru_cache
+from typing import NamedTuple
+
+from timedial.config import config
 
 logger = logging.getLogger(__name__)
 
 LOG_COORDINATES = False
 
+Cell = tuple[str, int]  # Character and attributes
+BLANK: Cell = (" ", curses.A_NORMAL)
+
+# Vintage terminals, usually on a slow serial line
+LOW_BANDWIDTH_TERMS = ["adm3a", "vt52", "vt100", "vt102", "vt220"]
+
+
+class Profile(NamedTuple):
+    """Rendering options, chosen to suit the link to the terminal."""
+
+    name: str
+    border: bool  # Draw borders around windows, titles are drawn either way
+    attributes: bool  # Use bold and reverse video, otherwise the selection is marked with '>'
+    descriptions: bool  # Keep the description box up to date, otherwise it's shown on request
+    batch: bool  # Hold back updates while more input is waiting
+
+
+FULL = Profile("full", border=True, attributes=True, descriptions=True, batch=False)
+LOW_BANDWIDTH = Profile("low", border=False, attributes=False, descriptions=False, batch=True)
+PROFILES = {profile.name: profile for profile in (FULL, LOW_BANDWIDTH)}
+
+profile = FULL
+
+
+def select_profile(term: str, baudrate: int) -> Profile:
+    """Chooses the rendering profile from the configuration, the terminal type and the line speed.
+
+    Args:
+        term (str): The terminal type, from $TERM.
+        baudrate (int): The output speed of the terminal, as reported by curses.baudrate().
+
+    Returns:
+        Profile: The profile to use.
+    """
+    if config.ui_profile in PROFILES:
+        return PROFILES[config.ui_profile]
+    if term.split("-")[0] in LOW_BANDWIDTH_TERMS or 0 < baudrate <= config.ui_low_bandwidth_baud:
+        return LOW_BANDWIDTH
+    return FULL
+
+
+@lru_cache(maxsize=1024)
+def wrap(text: str, width: int) -> tuple[str, ...]:
+    """Wraps text to a width, cached as the same descriptions are wrapped on every move.
+
+    Args:
+        text (str): The text to wrap.
+        width (int): The maximum line width.
+
+    Returns:
+        tuple[str, ...]: The wrapped lines.
+    """
+    return tuple(textwrap.wrap(text, width))
+
+
+def _bytes_written() -> int:
+    """Returns the number of bytes this process has written, from /proc/self/io.
+
+    Returns:
+        int: The write counter, or 0 if it isn't available.
+    """
+    try:
+        with open("/proc/self/io", "rb") as f:
+            for line in f:
+                if line.startswith(b"wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class RenderStats:
+    """Counts the output of the interface, in total and since the last keypress."""
+
+    def __init__(self) -> None:
+        """Initializes the counters."""
+        self.total_bytes = 0
+        self.key_bytes = 0
+        self.key_cells = 0
+
+    def keypress(self) -> None:
+        """Starts counting for a new keypress."""
+        self.key_bytes = 0
+        self.key_cells = 0
+
+
+stats = RenderStats()
+
+
+def input_pending() -> bool:
+    """Checks whether there is unread input on stdin.
+
+    Returns:
+        bool: True if a read wouldn't block.
+    """
+    try:
+        return bool(select.select([sys.stdin], [], [], 0)[0])
+    except (OSError, ValueError):
+        return False
+
+
+def doupdate(force: bool = False) -> None:
+    """Writes all pending window updates to the terminal, counting the bytes sent.
+
+    With a batching profile the update is held back while more keys are waiting, the
+    next update after those keys have been handled sends the combined result.
+
+    Args:
+        force (bool): Update even if input is waiting.
+    """
+    if profile.batch and not force and input_pending():
+        return
+
+    before = _bytes_written()
+    curses.doupdate()
+    sent = _bytes_written() - before
+    stats.total_bytes += sent
+    stats.key_bytes += sent
+
 
 class Window(ABC):
-    """Abstract base class for curses-based UI windows."""
+    """Abstract base class for curses-based UI windows.
+
+    Windows are retained: _generate composes the content into a buffer of cells with
+    _put, and _commit only writes the cells that differ from what is already on the
+    window. The border and title only change with the geometry and are drawn by
+    _decorate after the window has been damaged, e.g. by moving or resizing it.
+    """
 
     _size_x = 0
     _size_y = 0
@@ -37,6 +169,8 @@ class Window(ABC):
     _pos_y = 0
     _min_tsize_x = 0
     _min_tsize_y = 0
+    _title_x = 2
+    border = False
 
     def __init__(self, tdscr: curses.window, name: str):
         """Initializes a window with terminal screen reference and name.
@@ -53,6 +187,10 @@ class Window(ABC):
         self._log_coordinates()
 
         self._win = curses.newwin(self._size_y, self._size_x, self._pos_y, self._pos_x)
+        self.visible = True
+        self._damaged = True
+        self._pending: list[list[Cell]] = []
+        self._shown: list[list[Cell]] = []
 
     def _verify_term_size(self, min_x: int = 40, min_y: int = 24) -> bool:
         """Checks if terminal size meets the minimum required dimensions.
@@ -79,17 +217,116 @@ class Window(ABC):
             logger.error(f"Terminal went below minimum size: {self._tsize_x}, {self._tsize_y}")
             return
 
+        geometry = (self._size_y, self._size_x, self._pos_y, self._pos_x)
         self._position()
         self._log_coordinates()
-        self._win.erase()
-        self._win.noutrefresh()
+        if (self._size_y, self._size_x, self._pos_y, self._pos_x) != geometry:
+            # Clear the old area before moving
+            self._win.erase()
+            self._win.noutrefresh()
+            self._win.resize(self._size_y, self._size_x)
+            self._win.mvwin(self._pos_y, self._pos_x)
+            self._damaged = True
 
-        self._win.resize(self._size_y, self._size_x)
-        self._win.mvwin(self._pos_y, self._pos_x)
-        self._win.erase()
-        self._win.noutrefresh()
         self._generate()
 
+    def rename(self, name: str) -> None:
+        """Changes the name of the window, shown in the title.
+
+        Args:
+            name (str): The new name.
+        """
+        self.name = name
+        if not self._damaged:
+            self._decorate()
+
+    def invalidate(self) -> None:
+        """Marks the whole window for repainting, after something else has drawn over it."""
+        self._damaged = True
+
+    @property
+    def _bordered(self) -> bool:
+        """Whether the window has a border on screen."""
+        return self.border and profile.border
+
+    def _title(self) -> str:
+        """Returns the title of the window."""
+        return self.name
+
+    def _decorate(self) -> None:
+        """Draws the border and title."""
+        width = max(0, self._size_x - self._title_x - 1)
+        if self._bordered:
+            self._win.border()
+            self._win.addstr(0, self._title_x, f" {self._title()} "[:width])
+        elif self.border:
+            self._win.move(0, 0)
+            self._win.clrtoeol()
+            self._win.addstr(0, self._title_x, self._title()[:width])
+
+    def _begin(self) -> None:
+        """Starts composing the window content into a blank buffer."""
+        self._pending = [[BLANK] * self._size_x for _ in range(self._size_y)]
+
+    def _put(self, y: int, x: int, text: str, attr: int = curses.A_NORMAL) -> None:
+        """Puts text in the buffer, clipped to the window and kept off the border.
+
+        Args:
+            y (int): Row within the window.
+            x (int): Column within the window.
+            text (str): The text to put.
+            attr (int): Curses attributes for the text.
+        """
+        edge = 1 if self._bordered else 0
+        if not edge <= y < self._size_y - edge:
+            return
+        if not profile.attributes:
+            attr = curses.A_NORMAL
+        row = self._pending[y]
+        for column in range(max(x, edge), min(x + len(text), self._size_x - edge)):
+            row[column] = (text[column - x], attr)
+
+    def _commit(self) -> None:
+        """Writes the changed cells of the buffer to the window, in runs of equal attributes."""
+        if self._damaged:
+            self._win.erase()
+            self._decorate()
+            self._shown = [[BLANK] * self._size_x for _ in range(self._size_y)]
+            self._damaged = False
+
+        for y, (row, shown) in enumerate(zip(self._pending, self._shown)):
+            if row == shown:
+                continue
+            x = 0
+            while x < self._size_x:
+                if row[x] == shown[x]:
+                    x += 1
+                    continue
+                start, attr = x, row[x][1]
+                while x < self._size_x and row[x] != shown[x] and row[x][1] == attr:
+                    x += 1
+                self._write(y, start, "".join(char for char, _ in row[start:x]), attr)
+            self._shown[y] = row
+
+        self._win.noutrefresh()
+
+    def _write(self, y: int, x: int, text: str, attr: int) -> None:
+        """Writes a run of cells to the window.
+
+        Args:
+            y (int): Row within the window.
+            x (int): Column within the window.
+            text (str): The characters to write.
+            attr (int): Curses attributes for the text.
+        """
+        stats.key_cells += len(text)
+        try:
+            self._win.addstr(y, x, text, attr)
+        except curses.error:
+            # Writing the bottom right cell moves the cursor out of the window, the text is written anyway
+            if (y, x + len(text)) != (self._size_y - 1, self._size_x):
+                raise
+
     def _log_coordinates(self) -> None:
         """Logs the current terminal and window size and position if LOG_COORDINATES logging is enabled."""
         if LOG_COORDINATES:
@@ -111,6 +348,7 @@ class Window(ABC):
         """Erases and removes the window from display."""
         self._win.erase()
         self._win.noutrefresh()
+        self._damaged = True
 
 
 class Header(Window):
@@ -126,9 +364,9 @@ class Header(Window):
     def _generate(self) -> None:
         """Generates and renders the header content."""
         text = "TimeDial.org"
-        self._win.erase()
-        self._win.addstr(0, max(0, (self._tsize_x - 1 - len(text)) // 2), text, curses.A_BOLD)
-        self._win.noutrefresh()
+        self._begin()
+        self._put(0, max(0, (self._tsize_x - 1 - len(text)) // 2), text, curses.A_BOLD)
+        self._commit()
 
 
 class Footer(Window):
@@ -154,17 +392,17 @@ class Footer(Window):
     def _generate(self) -> None:
         """Generates and renders the footer content."""
         # self._win.bkgd(" ", curses.A_REVERSE)
-        self._win.erase()
+        self._begin()
         message = [
             f"Terminal: {os.getenv('TERM')} ({self._tsize_x}x{self._tsize_y})",
             f"Unread mail: {self._unread}",
         ]
         logger.info(message)
 
-        self._win.addstr(0, 1, "    ".join(message))
-        text = "F1 for help"
-        self._win.addstr(0, self._tsize_x - len(text) - 1, text)
-        self._win.noutrefresh()
+        self._put(0, 1, "    ".join(message))
+        text = "F1 for help" if profile.descriptions else "? for info, F1 for help"
+        self._put(0, self._tsize_x - len(text) - 1, text)
+        self._commit()
 
     def update(self, unread: int) -> None:
         """Updates the unread count and refreshes the window if it has changed.
@@ -181,12 +419,14 @@ class Footer(Window):
         self._unread = unread
         self._generate()
         # Really refresh, because this shouldn't happen frequently
-        self._win.refresh()
+        doupdate()
 
 
 class DescriptionBox(Window):
     """Displays multi-line descriptions in a bordered box."""
 
+    border = True
+
     def __init__(self, tdscr: curses.window, name: str) -> None:
         """Initializes the DescriptionBox window.
 
@@ -209,10 +449,7 @@ class DescriptionBox(Window):
         if not self._verify_term_size(80):
             return
 
-        self._win.erase()
-        self._win.border()
-        # Title
-        self._win.addstr(0, 2, f" {self.name} ")
+        self._begin()
 
         # Entries
         y = 1
@@ -222,15 +459,15 @@ class DescriptionBox(Window):
                 y += 1
                 continue
 
-            wrapped_lines = textwrap.wrap(entry, self._size_x - 4)
+            wrapped_lines = wrap(entry, self._size_x - 4)
             for line in wrapped_lines:
                 if y < self._size_y - 1:  # Prevent writing beyond window height
-                    self._win.addstr(y, 2, line)
+                    self._put(y, 2, line)
                     y += 1
                 else:
                     break  # Avoid overflow
 
-        self._win.noutrefresh()
+        self._commit()
 
 
 class TextBox(Window):
@@ -244,8 +481,8 @@ class TextBox(Window):
             name (str): The name of the window, used as a title if border is enabled.
         """
         self._entries: list[str] = []
-        self._last_entries: list[str] = []  # Store last rendered state
         self.border: bool = False
+        self._title_x = 0
         super().__init__(tdscr, name)
 
     def _position(self) -> None:
@@ -256,26 +493,25 @@ class TextBox(Window):
         self._pos_y = int((self._tsize_y - self._size_y) / 2) - 1
 
     def _generate(self) -> None:
-        """Generates and renders text lines, only updating lines that have changed."""
-        if self.border:
-            self._win.border()
-            self._win.addstr(0, 0, f" {self.name} ")
-
+        """Generates and renders text lines."""
         offset = 2 if self.border else 0
 
+        self._begin()
         for line, entry in enumerate(self._entries):
-            # Only redraw line if it's changed
-            if line >= len(self._last_entries) or entry != self._last_entries[line]:
-                self._win.move(line + 1, offset)
-                self._win.clrtoeol()
-                self._win.addstr(line + 1, offset, entry)
-
-        self._last_entries = self._entries.copy()
-        self._win.noutrefresh()
+            self._put(line + 1, offset, entry)
+        self._commit()
 
 
 class Menu(Window):
-    """Displays a selectable list of menu items with cursor navigation support."""
+    """Displays a selectable list of menu items with cursor navigation support.
+
+    Only the rows in view are drawn, so the cost of a key press doesn't depend on the
+    length of the list. Typing filters the list on entry names.
+    """
+
+    border = True
+    # Keys handled by the interface, they don't go into the filter
+    RESERVED_KEYS = "?/"
 
     def __init__(self, tdscr: curses.window, name: str) -> None:
         """Initializes the Menu window.
@@ -285,9 +521,37 @@ class Menu(Window):
             name (str): The name of the window, used as the menu title.
         """
         self._entries: list[str] = []
-        self.selected_index: int = 0
+        self._folded: list[str] = []  # Lower case entries for the filter
+        self._matches: list[int] = []  # Indexes of the entries matching the filter
+        self._cursor = 0  # Position of the selection in the matches
+        self._top = 0  # Position of the first visible match
+        self.filter = ""
         super().__init__(tdscr, name)
 
+    @property
+    def selected_index(self) -> int:
+        """The index of the selected entry, or -1 if no entry matches the filter."""
+        return self._matches[self._cursor] if self._matches else -1
+
+    @selected_index.setter
+    def selected_index(self, index: int) -> None:
+        """Selects an entry, scrolling it into view.
+
+        Args:
+            index (int): The index of the entry, the first match is selected if it's filtered out.
+        """
+        self._cursor = self._matches.index(index) if index in self._matches else 0
+        self._scroll()
+
+    @property
+    def _rows(self) -> int:
+        """The number of entries that fit in the window."""
+        return max(1, self._size_y - 2)
+
+    def _title(self) -> str:
+        """Returns the title, followed by the filter if there is one."""
+        return f"{self.name} /{self.filter}" if self.filter else self.name
+
     def _position(self) -> None:
         """Sets size and position of the menu window based on its entries."""
         if self._tsize_x < 80:
@@ -298,22 +562,31 @@ class Menu(Window):
         self._size_y = min([self._tsize_y - 4, len(self._entries) + 2])
         self._pos_x = 2
         self._pos_y = 2
+        self._scroll()
+
+    def _scroll(self) -> None:
+        """Moves the view so the selection is visible."""
+        if self._cursor < self._top:
+            self._top = self._cursor
+        elif self._cursor >= self._top + self._rows:
+            self._top = self._cursor - self._rows + 1
+        self._top = max(0, min(self._top, len(self._matches) - self._rows))
 
     def _generate(self) -> None:
-        """Generates and renders menu items, highlighting the selected one."""
-        self._win.erase()
-        self._win.border()
-        # Title
-        self._win.addstr(0, 2, f" {self.name} ")
+        """Generates and renders the visible menu items, highlighting the selected one."""
+        self._begin()
 
         # Entries
-        for line, entry in enumerate(self._entries, start=0):
-            if line == self.selected_index:
-                self._win.addstr(line + 1, 2, entry, curses.A_REVERSE)
+        for line, match in enumerate(self._matches[self._top : self._top + self._rows]):
+            entry = self._entries[match]
+            if self._top + line == self._cursor:
+                self._put(line + 1, 2, entry, curses.A_REVERSE)
+                if not profile.attributes:
+                    self._put(line + 1, 1, ">")
             else:
-                self._win.addstr(line + 1, 2, entry)
+                self._put(line + 1, 2, entry)
 
-        self._win.noutrefresh()
+        self._commit()
 
     def add_entry(self, item: str) -> None:
         """Adds a new item to the menu.
@@ -322,25 +595,78 @@ class Menu(Window):
             item (str): The menu item text to add.
         """
         self._entries.append(item)
+        self._folded.append(item.lower())
+        if self.filter.lower() in self._folded[-1]:
+            self._matches.append(len(self._entries) - 1)
 
     def clear_enties(self) -> None:
-        """Clears all menu entries and resets selection index."""
+        """Clears all menu entries, the filter and resets selection index."""
         self._entries = []
-        self.selected_index = 0
+        self._folded = []
+        self._matches = []
+        self._cursor = 0
+        self._top = 0
+        self.filter = ""
+
+    def set_filter(self, text: str) -> None:
+        """Shows only the entries containing the text, ignoring case.
 
-    def handle_key(self, key: int) -> None:
-        """Handles key input to navigate menu items.
+        The selection is kept if it still matches. Extending the filter only searches the
+        current matches.
 
         Args:
-            key (int): The input key code (e.g., curses.KEY_UP or curses.KEY_DOWN).
+            text (str): The text to filter on, empty to show all entries.
         """
-        old_selection = self.selected_index
-        if key == curses.KEY_UP:
-            self.selected_index = (self.selected_index - 1) % len(self._entries)
-        elif key == curses.KEY_DOWN:
-            self.selected_index = (self.selected_index + 1) % len(self._entries)
-
-        if old_selection != self.selected_index:
-            self._win.addstr(old_selection + 1, 2, self._entries[old_selection])
-            self._win.addstr(self.selected_index + 1, 2, self._entries[self.selected_index], curses.A_REVERSE)
-            self._win.noutrefresh()
+        selected = self.selected_index
+        needle = text.lower()
+        if self.filter and needle.startswith(self.filter.lower()):
+            candidates: Iterable[int] = self._matches
+        else:
+            candidates = range(len(self._entries))
+        self._matches = [index for index in candidates if needle in self._folded[index]]
+        self.filter = text
+        self.selected_index = selected
+        self._decorate()
+        self._generate()
+
+    def handle_key(self, key: int) -> bool:
+        """Handles key input to navigate and filter menu items.
+
+        Args:
+            key (int): The input key code, arrows, page up and down, home and end move the
+                selection, printable characters and backspace edit the filter.
+
+        Returns:
+            bool: True if the key was handled.
+        """
+        if key in (curses.KEY_BACKSPACE, 8, 127):
+            if not self.filter:
+                return False
+            self.set_filter(self.filter[:-1])
+            return True
+        if 32 <= key < 127 and chr(key) not in self.RESERVED_KEYS:
+            self.set_filter(self.filter + chr(key))
+            return True
+
+        count = len(self._matches)
+        old_cursor = self._cursor
+        if key == curses.KEY_UP and count:
+            self._cursor = (self._cursor - 1) % count
+        elif key == curses.KEY_DOWN and count:
+            self._cursor = (self._cursor + 1) % count
+        elif key == curses.KEY_PPAGE:
+            self._cursor = max(0, self._cursor - self._rows)
+        elif key == curses.KEY_NPAGE:
+            self._cursor = max(0, min(count - 1, self._cursor + self._rows))
+        elif key == curses.KEY_HOME:
+            self._cursor = 0
+        elif key == curses.KEY_END:
+            self._cursor = max(0, count - 1)
+        else:
+            return False
+
+        if old_cursor != self._cursor:
+            self._scroll()
+            # Only the changed lines differ from what's on the window
+            self._generate()
+        return True
@@ -20,16 +20,30 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 import curses
 import logging
 import os
+import signal
+import sys
 import time
-from typing import TypeVar
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, TypeVar
 
-from timedial.accounts import account
-from timedial.interface import MENU_CALLABLES, cursed
-from timedial.interface.menu_data import MainMenu, MenuItem, load_menu
+from timedial.interface import MENU_CALLABLES, cursed, events
+from timedial.interface.menu_cache import cached_menu
+from timedial.interface.menu_data import MainMenu, MenuItem
+
+if TYPE_CHECKING:
+    from timedial.accounts.account import UserModel
+    from timedial.interface.search_index import SearchIndex
 
 logger = logging.getLogger(__name__)
 banner = ((),)
 
+MAILDIR_NEW = "~/Maildir/new"
+MAIL_CHECK_INTERVAL = 30  # Seconds, only used when inotify isn't available
+START_SIM = "timedial-start-sim"
+RUNNING_REFRESH = 5  # Seconds the counts of users running each simulator are reused
+# Deliveries and reads move messages in and out of new, the others catch the directory itself changing
+MAIL_EVENTS = events.IN_CREATE | events.IN_DELETE | events.IN_MOVED_FROM | events.IN_MOVED_TO | events.IN_DELETE_SELF | events.IN_MOVE_SELF
+
 
 help = [
     " _____ _                ____  _       _ ",
@@ -44,6 +58,7 @@ help = [
     "----------------------------------------",
     "",
     "   - Use ARROW KEYS to move",
+    "   - Type to filter, press / to search",
     "   - Press ENTER to select",
     "   - Press F1 for help",
     "",
@@ -67,11 +82,32 @@ class Menu:
         """
         self.menu = menu_window
         self.description = description_window
-        self.data = load_menu()
+        # Without room for updates on every move, the description is only drawn when asked for
+        self.description.visible = cursed.profile.descriptions
+        self.data = cached_menu()
         self.history: list[tuple[MenuItem | MainMenu, int]] = []
+        self.title = self.menu.name
+        # The search query while searching, None otherwise
+        self.query: str | None = None
+        self.results: list[dict[str, Any]] = []
+        self.search_origin: tuple[MenuItem | MainMenu, int] = (self.data, 0)
+        # When the counts of users per running simulator were read, and the counts
+        self.running: tuple[float, dict[str, int]] = (-RUNNING_REFRESH, {})
 
         self.display_menu(self.data)
 
+    @cached_property
+    def search_index(self) -> "SearchIndex":
+        """The search index, loaded when the first search starts."""
+        from timedial.interface.search_index import cached_search_index
+
+        return cached_search_index()
+
+    @cached_property
+    def callables(self) -> dict[str, MainMenu]:
+        """The menus returned by MENU_CALLABLES, loaded to follow search results into them."""
+        return {name: load() for name, load in MENU_CALLABLES.items()}
+
     def display_menu(self, menu_data: MainMenu | MenuItem | None = None, location: int = 0) -> None:
         """Displays the menu and populates it with entries.
 
@@ -80,6 +116,7 @@ class Menu:
             location (int): The index of the selected menu item. Defaults to 0.
         """
         self.menu.clear_enties()
+        self.hide_description()
         if not menu_data:
             menu_data = self.data
         if not menu_data.items:
@@ -102,14 +139,31 @@ class Menu:
         Args:
             key (int): The key code input by the user.
         """
-        if key == curses.KEY_UP or key == curses.KEY_DOWN:
-            self.menu_move(key)
-            curses.doupdate()
+        if self.query is not None:
+            self.handle_search_key(key)
+
+        elif key == ord("/"):
+            self.query = ""
+            self.search_origin = (self.current_data, self.menu.selected_index)
+            self.show_results()
+            cursed.doupdate()
+
+        elif key == 27 and self.menu.filter:
+            self.menu.set_filter("")
+            self.selection_changed()
+            cursed.doupdate()
+
+        elif key == ord("?") or (key == curses.KEY_RIGHT and not cursed.profile.descriptions):
+            self.show_description()
+            cursed.doupdate()
+
+        elif key == 10 and self.menu.selected_index < 0:
+            logger.debug("No menu item matches the filter")
 
         elif key == 10 and self.current_item.items:
             self.history.append((self.current_data, self.menu.selected_index))
             self.display_menu(self.current_item)
-            curses.doupdate()
+            cursed.doupdate()
 
         elif key == 10 and self.current_item.command:
             self.execute()
@@ -117,30 +171,120 @@ class Menu:
         elif key == 10 and self.current_item.callable:
             self.history.append((self.current_data, self.menu.selected_index))
             self.display_menu(MENU_CALLABLES[self.current_item.callable]())
-            curses.doupdate()
+            cursed.doupdate()
 
         elif key == 27 or key == curses.KEY_LEFT:
             if self.history:
                 prev_data, prev_index = self.history.pop()
                 self.display_menu(prev_data, prev_index)
-                curses.doupdate()
+                cursed.doupdate()
             else:
                 logger.debug("No previous menu to return to.")
 
+        elif self.menu_move(key):
+            cursed.doupdate()
+
         else:
             logger.debug(f"Unknown key: {key}")
 
-    def menu_move(self, key: int) -> None:
-        """Moves the menu selection based on the key input.
+    def menu_move(self, key: int) -> bool:
+        """Moves the menu selection or edits the filter based on the key input.
 
         Args:
-            key (int): The key code for moving selection (typically arrow keys).
+            key (int): The key code, see cursed.Menu.handle_key.
+
+        Returns:
+            bool: True if the menu handled the key.
         """
-        self.menu.handle_key(key)
-        if not self.current_data.items:
+        if not self.menu.handle_key(key):
+            return False
+        self.selection_changed()
+        return True
+
+    def handle_search_key(self, key: int) -> None:
+        """Handles keyboard input while searching.
+
+        Printable keys and backspace edit the query, Enter goes to the selected result and
+        Escape or the left arrow return to the menu the search was started from.
+
+        Args:
+            key (int): The key code input by the user.
+        """
+        assert self.query is not None
+        if key == 27 or key == curses.KEY_LEFT:
+            self.query = None
+            self.menu.rename(self.title)
+            self.display_menu(*self.search_origin)
+
+        elif key == 10 and self.menu.selected_index >= 0:
+            self.go_to(self.results[self.menu.selected_index]["path"])
+
+        elif key == ord("?"):
+            self.show_description()
+
+        elif key in (curses.KEY_BACKSPACE, 8, 127):
+            self.query = self.query[:-1]
+            self.show_results()
+
+        elif 32 <= key < 127:
+            self.query += chr(key)
+            self.show_results()
+
+        elif self.menu_move(key):
+            pass
+
+        else:
+            logger.debug(f"Unknown key: {key}")
+            return
+
+        cursed.doupdate()
+
+    def show_results(self) -> None:
+        """Searches for the query and lists the results in the menu window."""
+        assert self.query is not None
+        self.results = self.search_index.search(self.query)
+        self.menu.clear_enties()
+        for result in self.results:
+            self.menu.add_entry(result["trail"])
+        self.menu.rename(f"Search: {self.query}")
+        self.menu.refresh()
+        self.hide_description()
+        self.selection_changed()
+
+    def go_to(self, path: list[int]) -> None:
+        """Leaves the search and shows a search result in its menu.
+
+        Args:
+            path (list[int]): Item indexes from the main menu, from the search index.
+        """
+        from timedial.interface.search_index import resolve
+
+        levels = resolve(self.data, path, self.callables)
+        self.query = None
+        self.menu.rename(self.title)
+        self.history = levels[:-1]
+        self.display_menu(*levels[-1])
+
+    def selection_changed(self) -> None:
+        """Updates the current item and its description after the selection has moved."""
+        if self.menu.selected_index < 0:
             return
 
-        self.current_item = self.current_data.items[self.menu.selected_index]
+        if self.query is not None:
+            from timedial.interface.search_index import resolve
+
+            menu, position = resolve(self.data, self.results[self.menu.selected_index]["path"], self.callables)[-1]
+            assert menu.items
+            item = menu.items[position]
+        elif self.current_data.items:
+            item = self.current_data.items[self.menu.selected_index]
+        else:
+            return
+
+        if item is self.current_item:
+            return
+        self.current_item = item
+        self.hide_description()
         self.update_description()
 
     def update_description(self) -> None:
@@ -163,10 +307,49 @@ class Menu:
                 desc.append(f"Version: {self.current_item.command.version}")
             if self.current_item.command.original_date:
                 desc.append(f"First release: {self.current_item.command.original_date}")
+            command = self.current_item.command.exec
+            if len(command) == 2 and os.path.basename(command[0]) == START_SIM:
+                users = self.running_users(command[1])
+                if users:
+                    desc.append(f"Running right now: {users} user{'s' if users != 1 else ''}")
             self.description._entries += desc
 
+        if self.description.visible:
+            self.description.refresh()
+
+    def running_users(self, simulator: str) -> int:
+        """Return how many users are running a simulator right now.
+
+        Args:
+            simulator (str): The simulator name.
+
+        Returns:
+            int: The number of users published by the stats exporter, read at most every RUNNING_REFRESH seconds.
+        """
+        checked, counts = self.running
+        if time.monotonic() - checked >= RUNNING_REFRESH:
+            # The simulator ledger pulls in psutil and the stats collectors, only import it when needed
+            from timedial.other import sim_ledger
+
+            counts = sim_ledger.published_concurrency()
+            self.running = (time.monotonic(), counts)
+        return counts.get(simulator, 0)
+
+    def show_description(self) -> None:
+        """Draws the description of the selected item, if it isn't already on screen."""
+        if self.description.visible:
+            return
+        self.description.visible = True
+        self.description.invalidate()
         self.description.refresh()
 
+    def hide_description(self) -> None:
+        """Removes a description shown on request from the screen, as it no longer matches the selection."""
+        if cursed.profile.descriptions or not self.description.visible:
+            return
+        self.description.visible = False
+        self.description.delete()
+
     def execute(self) -> None:
         """Executes the command associated with the selected menu item, if any."""
         command = self.current_item.command
@@ -195,9 +378,13 @@ class CursedInterface:
         Args:
             tdscr (curses.window): The main terminal screen window.
         """
-        self.account_data = account.read()
         self._all_windows: list[cursed.Window] = []
         self._tdscr = tdscr
+        self.loop = events.EventLoop()
+        self._inotify: events.Inotify | None = None
+        self._watched = ""
+        cursed.profile = cursed.select_profile(os.getenv("TERM", ""), curses.baudrate())
+        logger.info(f"Using the {cursed.profile.name} interface profile")
         try:
             curses.curs_set(0)
         except curses.error:
@@ -215,12 +402,19 @@ class CursedInterface:
         self.welcome_screen()
         self.menu_interface()
 
+    @cached_property
+    def account_data(self) -> "UserModel":
+        """The account of the logged in user, read on first use."""
+        from timedial.accounts import account
+
+        return account.read()
+
     def welcome_screen(self) -> None:
         """Displays the welcome/help screen with usage instructions."""
         window = self.add_window(cursed.TextBox, "Welcome")
         window._entries = help
         window.refresh()
-        curses.doupdate()
+        cursed.doupdate()
         self._tdscr.getch()
         self.remove_window(window)
 
@@ -229,36 +423,62 @@ class CursedInterface:
         self.description_window = self.add_window(cursed.DescriptionBox, "Description")
         self.menu_window = self.add_window(cursed.Menu, "Main menu")
         self.menu_handler = Menu(self.menu_window, self.description_window)
-        curses.doupdate()
+        cursed.doupdate()
 
         self._active_window = self.menu_handler
         self.handle_keys()
 
     def handle_keys(self) -> None:
-        """Continuously listens for and processes key inputs."""
-        last_status_update = time.time()
-        while True:
-            if time.time() - last_status_update > 30:
-                self.footer_window.update(self.check_mail())
-                last_status_update = time.time()
-
-            key = self._tdscr.getch()
-            if key == curses.KEY_RESIZE:
-                self._tdscr.clear()
-                curses.update_lines_cols()
-                self._tdscr.refresh()
-                for window in self._all_windows:
-                    window.refresh()
-                curses.doupdate()
-            elif key == curses.KEY_F1:
-                self.welcome_screen()
-                self._tdscr.refresh()
-                for window in self._all_windows:
-                    window.refresh()
-                curses.doupdate()
-
-            elif self._active_window:
-                self._active_window.handle_key(key)
+        """Runs the event loop, dispatching key presses, terminal resizes and mail notifications."""
+        self.loop.add_reader(sys.stdin.fileno(), self.read_key)
+        self.loop.add_signal_handler(signal.SIGWINCH, self.resize)
+        self.watch_mail()
+        self.loop.run()
+
+    def read_key(self) -> None:
+        """Reads a key from the terminal, called by the event loop when stdin is readable."""
+        self.handle_key(self._tdscr.getch())
+
+    def resize(self) -> None:
+        """Resizes curses to the new terminal size, called by the event loop on SIGWINCH."""
+        try:
+            size = os.get_terminal_size(sys.stdout.fileno())
+        except OSError:
+            return
+        if size.lines and size.columns:
+            curses.resizeterm(size.lines, size.columns)
+            self.handle_key(curses.KEY_RESIZE)
+
+    def handle_key(self, key: int) -> None:
+        """Processes a key press.
+
+        Args:
+            key (int): The key code.
+        """
+        cursed.stats.keypress()
+        if key == curses.KEY_RESIZE:
+            self._tdscr.clear()
+            curses.update_lines_cols()
+            self.redraw()
+        elif key == curses.KEY_F1:
+            self.welcome_screen()
+            self.redraw()
+
+        elif self._active_window:
+            self._active_window.handle_key(key)
+
+        logger.debug(f"Key {key}: {cursed.stats.key_cells} cells, {cursed.stats.key_bytes} bytes sent")
+
+    def redraw(self) -> None:
+        """Repaints all windows, after the screen has been cleared or drawn over."""
+        # Flush the cleared areas first, curses sends less than when combining them with the repaint
+        self._tdscr.noutrefresh()
+        cursed.doupdate()
+        for window in self._all_windows:
+            window.invalidate()
+            if window.visible:
+                window.refresh()
+        cursed.doupdate()
 
     def add_window(self, windowclass: type[T], name: str) -> T:
         """Adds and initializes a new window to the interface.
@@ -283,6 +503,50 @@ class CursedInterface:
         window.delete()
         self._all_windows.remove(window)
 
+    def watch_mail(self) -> None:
+        """Watches the Maildir for new messages and updates the unread count in the footer.
+
+        If the Maildir doesn't exist yet, the closest existing parent is watched until it's
+        created. Without inotify the Maildir is checked every MAIL_CHECK_INTERVAL seconds.
+        """
+        if self._inotify:
+            self.loop.remove_reader(self._inotify.fileno())
+            self._inotify.close()
+            self._inotify = None
+
+        self.footer_window.update(self.check_mail())
+
+        try:
+            self._inotify = events.Inotify()
+        except OSError as exc:
+            logger.warning(f"Failed to start inotify, checking mail every {MAIL_CHECK_INTERVAL} seconds: {exc}")
+            self.loop.call_later(MAIL_CHECK_INTERVAL, self.watch_mail)
+            return
+
+        maildir_new = os.path.expanduser(MAILDIR_NEW)
+        for path in (maildir_new, os.path.dirname(maildir_new), os.path.expanduser("~")):
+            try:
+                self._inotify.add_watch(path, MAIL_EVENTS)
+            except OSError:
+                continue
+            self._watched = path
+            self.loop.add_reader(self._inotify.fileno(), self.mail_changed)
+            return
+
+        logger.warning(f"Nothing to watch for {MAILDIR_NEW}, checking mail every {MAIL_CHECK_INTERVAL} seconds")
+        self.loop.call_later(MAIL_CHECK_INTERVAL, self.watch_mail)
+
+    def mail_changed(self) -> None:
+        """Updates the unread count, called by the event loop on inotify events."""
+        if not self._inotify:
+            return
+        masks = [mask for _, mask in self._inotify.read()]
+        if self._watched != os.path.expanduser(MAILDIR_NEW) or any(mask & (events.IN_IGNORED | events.IN_MOVE_SELF) for mask in masks):
+            # The Maildir was created or went away, move the watch
+            self.watch_mail()
+        elif masks:
+            self.footer_window.update(self.check_mail())
+
     def check_mail(self) -> int:
         """Count the number of unread emails in the user's Maildir at ~/Maildir.
 
@@ -295,8 +559,9 @@ class CursedInterface:
             None: Silently ignores FileNotFoundError if the Maildir doesn't exist.
         """
         try:
-            new_maildir_path = os.path.expanduser("~/Maildir/new")
-            return len([f for f in os.listdir(new_maildir_path) if os.path.isfile(os.path.join(new_maildir_path, f))])
+            # The file type comes with the directory entries, so this doesn't stat every message
+            with os.scandir(os.path.expanduser(MAILDIR_NEW)) as entries:
+                return sum(1 for entry in entries if entry.is_file())
         except FileNotFoundError:
             return 0
         except Exception as exc:
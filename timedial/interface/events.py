@@ -0,0 +1,244 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import ctypes
+import ctypes.util
+import heapq
+import itertools
+import logging
+import os
+import select
+import signal
+import struct
+import time
+from collections.abc import Callable
+
+logger = logging.getLogger(__name__)
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+class Inotify:
+    """Minimal inotify binding, the file descriptor becomes readable when a watched path changes."""
+
+    def __init__(self) -> None:
+        """Creates the inotify instance.
+
+        Raises:
+            OSError: If inotify isn't available.
+        """
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd: int = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def fileno(self) -> int:
+        """Returns the inotify file descriptor."""
+        return self._fd
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watches a path.
+
+        Args:
+            path (str): The file or directory to watch.
+            mask (int): The IN_* events to report.
+
+        Returns:
+            int: The watch descriptor.
+
+        Raises:
+            OSError: If the path can't be watched, e.g. because it doesn't exist.
+        """
+        wd: int = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read(self) -> list[tuple[int, int]]:
+        """Reads the pending events.
+
+        Returns:
+            list[tuple[int, int]]: The watch descriptor and mask of each event.
+        """
+        events: list[tuple[int, int]] = []
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                events.append((wd, mask))
+                offset += INOTIFY_EVENT.size + length
+
+    def close(self) -> None:
+        """Closes the inotify instance, removing all watches."""
+        os.close(self._fd)
+
+
+class EventLoop:
+    """Single threaded loop multiplexing file descriptors, timers and signals.
+
+    The loop blocks in select until a file descriptor is readable, a signal arrives or
+    the next timer is due. Without timers it blocks indefinitely, so an idle loop
+    makes no system calls at all.
+    """
+
+    def __init__(self) -> None:
+        """Initializes an empty loop."""
+        self._readers: dict[int, Callable[[], None]] = {}
+        self._timers: list[tuple[float, int, Callable[[], None]]] = []
+        self._cancelled: set[int] = set()
+        self._sequence = itertools.count()
+        self._signals: dict[int, Callable[[], None]] = {}
+        self._wakeup: tuple[int, int] | None = None
+        self._running = False
+
+    def add_reader(self, fd: int, callback: Callable[[], None]) -> None:
+        """Calls a callback whenever a file descriptor is readable.
+
+        Args:
+            fd (int): The file descriptor.
+            callback (Callable[[], None]): Called without arguments, it must read the pending data.
+        """
+        self._readers[fd] = callback
+
+    def remove_reader(self, fd: int) -> None:
+        """Stops watching a file descriptor.
+
+        Args:
+            fd (int): The file descriptor.
+        """
+        self._readers.pop(fd, None)
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> int:
+        """Calls a callback once after a delay.
+
+        Args:
+            delay (float): Seconds from now.
+            callback (Callable[[], None]): Called without arguments.
+
+        Returns:
+            int: A handle for cancel().
+        """
+        handle = next(self._sequence)
+        heapq.heappush(self._timers, (time.monotonic() + delay, handle, callback))
+        return handle
+
+    def call_every(self, interval: float, callback: Callable[[], None]) -> None:
+        """Calls a callback repeatedly, starting after one interval.
+
+        Args:
+            interval (float): Seconds between calls.
+            callback (Callable[[], None]): Called without arguments.
+        """
+
+        def repeat() -> None:
+            callback()
+            self.call_later(interval, repeat)
+
+        self.call_later(interval, repeat)
+
+    def cancel(self, handle: int) -> None:
+        """Cancels a timer.
+
+        Args:
+            handle (int): The handle returned by call_later().
+        """
+        self._cancelled.add(handle)
+
+    def add_signal_handler(self, signum: int, callback: Callable[[], None]) -> None:
+        """Calls a callback from the loop when a signal arrives.
+
+        The signal wakes up the loop through a pipe registered with signal.set_wakeup_fd, so
+        the callback runs outside of the signal handler.
+
+        Args:
+            signum (int): The signal number.
+            callback (Callable[[], None]): Called without arguments.
+        """
+        if self._wakeup is None:
+            self._wakeup = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+            signal.set_wakeup_fd(self._wakeup[1], warn_on_full_buffer=False)
+            self.add_reader(self._wakeup[0], self._dispatch_signals)
+        self._signals[signum] = callback
+        signal.signal(signum, lambda *_: None)
+
+    def _dispatch_signals(self) -> None:
+        """Reads the signal numbers from the wakeup pipe and calls their callbacks."""
+        assert self._wakeup is not None
+        try:
+            received = os.read(self._wakeup[0], 512)
+        except BlockingIOError:
+            return
+        for signum in dict.fromkeys(received):
+            if signum in self._signals:
+                self._signals[signum]()
+
+    def _run_timers(self) -> float | None:
+        """Calls the timers that are due.
+
+        Returns:
+            float | None: Seconds until the next timer, or None if there are none.
+        """
+        while self._timers:
+            deadline, handle, callback = self._timers[0]
+            if handle in self._cancelled:
+                heapq.heappop(self._timers)
+                self._cancelled.discard(handle)
+                continue
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                return delay
+            heapq.heappop(self._timers)
+            callback()
+        return None
+
+    def run_once(self) -> None:
+        """Waits for the next event and dispatches it."""
+        timeout = self._run_timers()
+        ready, _, _ = select.select(list(self._readers), [], [], timeout)
+        for fd in ready:
+            # A previous callback may have removed the reader
+            if fd in self._readers:
+                self._readers[fd]()
+
+    def run(self) -> None:
+        """Runs the loop until stop() is called."""
+        self._running = True
+        while self._running:
+            self.run_once()
+
+    def stop(self) -> None:
+        """Stops the loop after the current event."""
+        self._running = False
@@ -0,0 +1,266 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Callable, TypeVar
+
+from timedial.config import config
+from timedial.interface.menu_data import MainMenu, load_menu
+
+logger = logging.getLogger("timedial.menucache")
+
+CACHE_VERSION = 2
+
+T = TypeVar("T")
+
+
+def digest(path: str) -> str:
+    """Return the SHA-256 of a file, or of the sorted listing of a directory.
+
+    Args:
+        path (str): The file or directory to hash.
+
+    Returns:
+        str: The hex digest.
+    """
+    sha = hashlib.sha256()
+    if os.path.isdir(path):
+        sha.update("\n".join(sorted(os.listdir(path))).encode())
+    else:
+        with open(path, "rb") as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def fingerprint(sources: list[str]) -> dict[str, dict[str, Any]]:
+    """Record the mtime, size and hash of every source.
+
+    Args:
+        sources (list[str]): Files and directories the cached menu was built from.
+
+    Returns:
+        dict[str, dict[str, Any]]: Fingerprint per source path.
+    """
+    result = {}
+    for path in sources:
+        stat = os.stat(path)
+        result[path] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest(path)}
+    return result
+
+
+def is_current(recorded: dict[str, dict[str, Any]], sources: list[str]) -> bool:
+    """Check whether the recorded fingerprints still match the sources.
+
+    The mtime and size are checked first; a source is only hashed when those changed,
+    so touching a file without changing it doesn't invalidate the cache.
+
+    Args:
+        recorded (dict[str, dict[str, Any]]): The fingerprints stored in the cache.
+        sources (list[str]): The current list of sources.
+
+    Returns:
+        bool: True if the cache can be used.
+    """
+    if set(recorded) != set(sources):
+        return False
+
+    for path, entry in recorded.items():
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime_ns == entry["mtime"] and stat.st_size == entry["size"]:
+                continue
+            if digest(path) != entry["sha256"]:
+                return False
+        except OSError:
+            return False
+
+    return True
+
+
+def cache_dirs() -> list[str]:
+    """Return the cache directories, the shared one first.
+
+    Returns:
+        list[str]: The shared cache directory and the user's own cache directory.
+    """
+    return [config.menu_cache_dir, config.user_cache_dir]
+
+
+def read_data(name: str, sources: list[str], validate: Callable[[Any], T]) -> T | None:
+    """Load cached data if one of the cache directories has a current copy.
+
+    Args:
+        name (str): Name of the cache.
+        sources (list[str]): Files and directories the data is built from.
+        validate (Callable[[Any], T]): Converts the stored JSON data, raising an exception if it's invalid.
+
+    Returns:
+        T | None: The cached data, or None if there's no usable cache.
+    """
+    for directory in cache_dirs():
+        path = os.path.join(directory, f"{name}.json")
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("version") != CACHE_VERSION or not is_current(data["sources"], sources):
+                logger.debug(f"Stale menu cache: {path}")
+                continue
+            return validate(data["data"])
+        except FileNotFoundError:
+            continue
+        except Exception as exc:
+            logger.warning(f"Failed to read menu cache {path}: {exc}")
+
+    return None
+
+
+def write_data(name: str, recorded: dict[str, dict[str, Any]], data: Any, directories: list[str] | None = None) -> None:
+    """Store data in the first writable cache directory.
+
+    The file is written to a temporary file and moved into place, so concurrent
+    readers never see a partial cache.
+
+    Args:
+        name (str): Name of the cache.
+        recorded (dict[str, dict[str, Any]]): Fingerprints of the sources, taken before the data was built.
+        data (Any): JSON serializable data to store.
+        directories (list[str] | None): Directories to try, defaults to `cache_dirs()`.
+    """
+    content = json.dumps({"version": CACHE_VERSION, "sources": recorded, "data": data})
+
+    for directory in directories or cache_dirs():
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.")
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, os.path.join(directory, f"{name}.json"))
+            logger.debug(f"Wrote menu cache {name} to {directory}")
+            return
+        except OSError:
+            continue
+
+    logger.warning(f"No writable cache directory for menu: {name}")
+
+
+def read_cache(name: str, sources: list[str]) -> MainMenu | None:
+    """Load a compiled menu if one of the cache directories has a current copy.
+
+    Args:
+        name (str): Name of the cached menu.
+        sources (list[str]): Files and directories the menu is built from.
+
+    Returns:
+        MainMenu | None: The cached menu, or None if there's no usable cache.
+    """
+    return read_data(name, sources, MainMenu.model_validate)
+
+
+def write_cache(name: str, recorded: dict[str, dict[str, Any]], menu: MainMenu, directories: list[str] | None = None) -> None:
+    """Store a compiled menu in the first writable cache directory, see `write_data`.
+
+    Args:
+        name (str): Name of the cached menu.
+        recorded (dict[str, dict[str, Any]]): Fingerprints of the sources, taken before the menu was built.
+        menu (MainMenu): The menu to store.
+        directories (list[str] | None): Directories to try, defaults to `cache_dirs()`.
+    """
+    write_data(name, recorded, menu.model_dump(mode="json"), directories)
+
+
+def load_cached(name: str, sources: list[str], build: Callable[[], MainMenu]) -> MainMenu:
+    """Return a menu from the cache, building and storing it if the cache is missing or stale.
+
+    Args:
+        name (str): Name of the cached menu.
+        sources (list[str]): Files and directories the menu is built from.
+        build (Callable[[], MainMenu]): Function that parses the sources.
+
+    Returns:
+        MainMenu: The menu.
+    """
+    menu = read_cache(name, sources)
+    if menu is not None:
+        return menu
+
+    recorded = fingerprint(sources)
+    menu = build()
+    write_cache(name, recorded, menu)
+    return menu
+
+
+def simulator_sources() -> list[str]:
+    """List the simulator directories and every simulator.toml in them.
+
+    Returns:
+        list[str]: Paths the simulator menu depends on.
+    """
+    sources = []
+    for directory in (config.simulator_path, os.path.expanduser("~/simulators")):
+        if not os.path.isdir(directory):
+            continue
+        sources.append(directory)
+        for sim in sorted(os.listdir(directory)):
+            config_file = os.path.join(directory, sim, "simulator.toml")
+            if os.path.isfile(config_file):
+                sources.append(config_file)
+    return sources
+
+
+def cached_menu() -> MainMenu:
+    """Return the main menu, see `menu_data.load_menu`."""
+    return load_cached("menu", [config.menu_file], load_menu)
+
+
+def cached_simulators() -> MainMenu:
+    """Return the simulator menu, see `simulators.load_simulators`."""
+    # The simulator loader pulls in tomllib and the simulator models, only import it when needed
+    from timedial.interface.simulators import load_simulators
+
+    return load_cached("simulators", simulator_sources(), load_simulators)
+
+
+def main() -> None:
+    """Build the shared menu cache, run as root after installing or updating menus and simulators."""
+    from timedial.interface.search_index import build_index, search_sources
+    from timedial.interface.simulators import load_simulators
+
+    builds: list[tuple[str, list[str], Callable[[], MainMenu]]] = [
+        ("menu", [config.menu_file], load_menu),
+        ("simulators", simulator_sources(), load_simulators),
+    ]
+    menus = {}
+    recorded = fingerprint(search_sources())
+    for name, sources, build in builds:
+        menus[name] = build()
+        write_cache(name, {source: recorded[source] for source in sources}, menus[name], directories=[config.menu_cache_dir])
+        print(f"Compiled {name} menu from {len(sources)} sources into {config.menu_cache_dir}")
+
+    index = build_index(menus["menu"], {"simulators": menus["simulators"]})
+    write_data("search", recorded, index, directories=[config.menu_cache_dir])
+    print(f"Indexed {len(index['documents'])} menu items into {config.menu_cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
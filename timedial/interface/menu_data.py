@@ -20,12 +20,9 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 from pathlib import Path
 
 from pydantic import BaseModel, field_validator
-from ruamel.yaml import YAML
 
 from timedial.config import config
 
-yaml = YAML()
-
 
 class Command(BaseModel):
     """Represents a shell or program command definition.
@@ -103,9 +100,12 @@ def load_menu() -> MainMenu:
         RuntimeError: If the menu file is missing or cannot be parsed.
         ValueError: If required fields are missing or invalid in the YAML data.
     """
+    # ruamel.yaml is slow to import, only load it when the menu is parsed
+    from ruamel.yaml import YAML
+
     try:
         with open(config.menu_file) as file:
-            data = yaml.load(file)
+            data = YAML().load(file)
     except FileNotFoundError as exc:
         raise RuntimeError(f"Menu file not found: {config.menu_file}") from exc
     except KeyError as exc:
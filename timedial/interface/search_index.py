@@ -0,0 +1,238 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import heapq
+import re
+from bisect import bisect_left
+from typing import Any
+
+from timedial.config import config
+from timedial.interface.menu_cache import fingerprint, read_data, simulator_sources, write_data
+from timedial.interface.menu_data import MainMenu, MenuItem
+
+INDEX_VERSION = 1
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Score of a match per field, so name matches rank above description matches
+WEIGHT_NAME = 8
+WEIGHT_DETAILS = 2  # Publisher, version and dates
+WEIGHT_DESCRIPTION = 1
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lower case words.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list[str]: The words, in order.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def search_sources() -> list[str]:
+    """List the files and directories the search index is built from.
+
+    Returns:
+        list[str]: The menu file and the simulator sources.
+    """
+    return [config.menu_file, *simulator_sources()]
+
+
+def item_fields(item: MenuItem) -> list[tuple[str, int]]:
+    """Return the searchable text of a menu item.
+
+    Args:
+        item (MenuItem): The menu item.
+
+    Returns:
+        list[tuple[str, int]]: Text and weight of each field.
+    """
+    description = item.description if isinstance(item.description, list) else [item.description]
+    fields = [(item.name, WEIGHT_NAME), *((line, WEIGHT_DESCRIPTION) for line in description)]
+    if item.command:
+        details = [item.command.publisher, item.command.version, item.command.version_date, item.command.original_date]
+        fields += [(detail, WEIGHT_DETAILS) for detail in details if detail]
+    return fields
+
+
+def build_index(menu: MainMenu, callables: dict[str, MainMenu]) -> dict[str, Any]:
+    """Build an inverted index over a menu tree.
+
+    Items with a callable are followed into the menu that callable returns, so
+    e.g. every simulator is found from the main menu.
+
+    Args:
+        menu (MainMenu): The main menu.
+        callables (dict[str, MainMenu]): The menus returned by the callables in MENU_CALLABLES.
+
+    Returns:
+        dict[str, Any]: The index, JSON serializable. Documents hold the name, the trail of
+        parent names and the path of item indexes from the main menu. Tokens are sorted, with
+        the postings (document and score pairs) of each token at the same position. Initials
+        hold the merged postings of all tokens per first character, ranked best first, as a
+        single character matches most of the index.
+    """
+    documents: list[dict[str, Any]] = []
+    postings: dict[str, dict[int, int]] = {}
+
+    def walk(items: list[MenuItem], path: list[int], trail: list[str]) -> None:
+        for position, item in enumerate(items):
+            document = len(documents)
+            documents.append({"name": item.name, "trail": " > ".join([*trail, item.name]), "path": [*path, position]})
+            for text, weight in item_fields(item):
+                for token in tokenize(text):
+                    scores = postings.setdefault(token, {})
+                    scores[document] = max(scores.get(document, 0), weight)
+
+            children = item.items or (callables[item.callable].items if item.callable in callables else None)
+            if children:
+                walk(children, [*path, position], [*trail, item.name])
+
+    walk(menu.items, [], [])
+    tokens = sorted(postings)
+    initials: dict[str, dict[int, int]] = {}
+    for token in tokens:
+        merged = initials.setdefault(token[0], {})
+        for document, score in postings[token].items():
+            merged[document] = max(merged.get(document, 0), score)
+
+    return {
+        "version": INDEX_VERSION,
+        "documents": documents,
+        "tokens": tokens,
+        "postings": [sorted(postings[token].items()) for token in tokens],
+        "initials": {
+            initial: sorted(merged.items(), key=lambda posting: (-posting[1], posting[0])) for initial, merged in initials.items()
+        },
+    }
+
+
+class SearchIndex:
+    """Prefix search over a prebuilt index, see `build_index`."""
+
+    def __init__(self, data: dict[str, Any]) -> None:
+        """Wrap index data.
+
+        Args:
+            data (dict[str, Any]): The index, as returned by `build_index`.
+
+        Raises:
+            ValueError: If the index is of another version.
+        """
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported search index version: {data.get('version')}")
+        self.documents: list[dict[str, Any]] = data["documents"]
+        self._tokens: list[str] = data["tokens"]
+        self._postings: list[list[list[int]]] = data["postings"]
+        self._initials: dict[str, list[list[int]]] = data["initials"]
+
+    def _prefix_scores(self, word: str) -> dict[int, int]:
+        """Score the documents containing a token starting with a word.
+
+        Args:
+            word (str): The word, the last one may be partially typed.
+
+        Returns:
+            dict[int, int]: Best score per document.
+        """
+        if len(word) == 1:
+            return {document: score for document, score in self._initials.get(word, [])}
+
+        scores: dict[int, int] = {}
+        # Tokens only contain [a-z0-9], '{' sorts after all of them
+        for position in range(bisect_left(self._tokens, word), bisect_left(self._tokens, word + "{")):
+            for document, score in self._postings[position]:
+                if scores.get(document, 0) < score:
+                    scores[document] = score
+        return scores
+
+    def search(self, query: str, limit: int = 100) -> list[dict[str, Any]]:
+        """Find the documents matching every word of a query.
+
+        Every word matches as a prefix, so results can be shown while typing. Results
+        are ranked by score, then by their order in the menu.
+
+        Args:
+            query (str): The search query.
+            limit (int): Maximum number of results.
+
+        Returns:
+            list[dict[str, Any]]: The best matching documents, best first.
+        """
+        words = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not words:
+            return []
+        if len(words) == 1 and len(words[0]) == 1:
+            return [self.documents[document] for document, _ in self._initials.get(words[0], [])[:limit]]
+
+        # Start with the longest word, it usually has the fewest matches
+        scores = self._prefix_scores(words[0])
+        for word in words[1:]:
+            if not scores:
+                break
+            word_scores = self._prefix_scores(word)
+            scores = {document: score + word_scores[document] for document, score in scores.items() if document in word_scores}
+
+        # Equal scores keep the menu order
+        ranked = heapq.nsmallest(limit, scores.items(), key=lambda posting: (-posting[1], posting[0]))
+        return [self.documents[document] for document, _ in ranked]
+
+
+def resolve(menu: MainMenu, path: list[int], callables: dict[str, MainMenu]) -> list[tuple[MainMenu | MenuItem, int]]:
+    """Follow an index path through the menu tree.
+
+    Args:
+        menu (MainMenu): The main menu.
+        path (list[int]): Item indexes from the main menu, as stored in the documents.
+        callables (dict[str, MainMenu]): The menus returned by the callables in MENU_CALLABLES.
+
+    Returns:
+        list[tuple[MainMenu | MenuItem, int]]: The menu shown at each level and the index of the item selected in it.
+
+    Raises:
+        LookupError: If the path doesn't exist in the tree.
+    """
+    levels: list[tuple[MainMenu | MenuItem, int]] = []
+    current: MainMenu | MenuItem = menu
+    for position in path:
+        if not current.items or position >= len(current.items):
+            raise LookupError(f"No menu item at {path}")
+        levels.append((current, position))
+        item = current.items[position]
+        current = callables[item.callable] if not item.items and item.callable in callables else item
+    return levels
+
+
+def cached_search_index() -> SearchIndex:
+    """Return the search index, built and cached with the menus.
+
+    Returns:
+        SearchIndex: The index.
+    """
+    sources = search_sources()
+    data = read_data("search", sources, dict)
+    if data is None:
+        from timedial.interface import MENU_CALLABLES
+        from timedial.interface.menu_cache import cached_menu
+
+        recorded = fingerprint(sources)
+        data = build_index(cached_menu(), {name: load() for name, load in MENU_CALLABLES.items()})
+        write_data("search", recorded, data)
+    return SearchIndex(data)
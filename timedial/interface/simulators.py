@@ -24,10 +24,8 @@ import tomllib
 
 from timedial.config import config
 from timedial.interface.menu_data import Command, MainMenu, MenuItem
-from timedial.logger import ui_logger_config
 from timedial.other.start_sim import ConfigModel
 
-ui_logger_config()
 logger = logging.getLogger("timedial.simmenu")
 
 
@@ -100,4 +98,7 @@ def load_simulators() -> MainMenu:
 
 
 if __name__ == "__main__":
+    from timedial.logger import ui_logger_config
+
+    ui_logger_config()
     load_simulators()
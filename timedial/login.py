@@ -23,10 +23,8 @@ import subprocess
 import sys
 import termios
 
-from timedial.interface import cursed_interface
 from timedial.logger import ui_logger_config
 
-ui_logger_config()
 root_logger = logging.getLogger("timedial")
 logger = logging.getLogger("timedial.login")
 
@@ -106,6 +104,7 @@ def main() -> None:
 
     Handles keyboard interrupts and logs unexpected exceptions.
     """
+    ui_logger_config()
     try:
         term = os.getenv("TERM")
         if not term:
@@ -114,6 +113,10 @@ def main() -> None:
         else:
             logger.info(f"Logged in with: {term}")
         os.system("clear")
+
+        # Imported here so the shell starts drawing as early as possible
+        from timedial.interface import cursed_interface
+
         cursed_interface.main()
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,359 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import bisect
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, ParamSpec, Self, TypeVar
+
+from timedial.config import config
+
+logger = logging.getLogger("timedial.metrics")
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+# Latency buckets in seconds, from a single syscall up to a full stale files pass
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def format_value(value: float) -> str:
+    """Format a sample value for the Prometheus text format."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 2**53:
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(pairs: Sequence[tuple[str, str]]) -> str:
+    """Format a label set for the Prometheus text format, escaping the values."""
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    """Base class of the metric types.
+
+    A metric declared with label names is a family; `labels()` returns the child for a
+    set of label values, which is created once and can be kept by the caller so the hot
+    path is a plain attribute update. Updates aren't locked: every daemon updates its
+    metrics from a single thread, and a torn read only skews one export.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs: Any) -> None:
+        """Initialize the metric.
+
+        Args:
+            name (str): The metric name.
+            documentation (str): The help text.
+            labelnames (Sequence[str]): Names of the labels, empty for a metric without labels.
+            **kwargs: Options of the metric type, passed on to the children.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._kwargs = kwargs
+        self._children: dict[tuple[str, ...], Self] = {}
+
+    def labels(self, *values: str) -> Self:
+        """Return the child for a set of label values.
+
+        Args:
+            *values (str): The label values, in the order of the label names.
+
+        Returns:
+            Self: The child metric.
+
+        Raises:
+            ValueError: If the number of values doesn't match the label names.
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = type(self)(self.name, self.documentation, **self._kwargs)
+            self._children[values] = child
+        return child
+
+    def _samples(self) -> Iterator[tuple[str, list[tuple[str, str]], float]]:
+        """Yield the samples of a single child as (name suffix, extra labels, value)."""
+        return iter(())
+
+    def render(self) -> str:
+        """Render the metric in the Prometheus text format.
+
+        Returns:
+            str: The HELP and TYPE lines followed by the samples.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        children: list[tuple[tuple[str, ...], Metric]] = sorted(self._children.items()) if self.labelnames else [((), self)]
+        for values, child in children:
+            labels = list(zip(self.labelnames, values))
+            for suffix, extra, value in child._samples():
+                lines.append(f"{self.name}{suffix}{format_labels(labels + extra)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A value that only goes up, like bytes reclaimed or users created. By convention its name ends in _total."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs: Any) -> None:
+        """Initialize the counter at zero."""
+        super().__init__(name, documentation, labelnames, **kwargs)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        """Increase the counter.
+
+        Args:
+            amount (float): The amount to add, must not be negative.
+        """
+        self.value += amount
+
+    def _samples(self) -> Iterator[tuple[str, list[tuple[str, str]], float]]:
+        yield "", [], self.value
+
+
+class Gauge(Metric):
+    """A value that goes up and down, like the number of open sessions."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs: Any) -> None:
+        """Initialize the gauge at zero."""
+        super().__init__(name, documentation, labelnames, **kwargs)
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        """Set the gauge."""
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        """Increase the gauge."""
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        """Decrease the gauge."""
+        self.value -= amount
+
+    def _samples(self) -> Iterator[tuple[str, list[tuple[str, str]], float]]:
+        yield "", [], self.value
+
+
+class Histogram(Metric):
+    """A distribution of observations in fixed buckets, used for latencies."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        **kwargs: Any,
+    ) -> None:
+        """Initialize an empty histogram.
+
+        Args:
+            name (str): The metric name.
+            documentation (str): The help text.
+            labelnames (Sequence[str]): Names of the labels, empty for a metric without labels.
+            buckets (Sequence[float]): Upper bounds of the buckets, in ascending order. +Inf is implied.
+            **kwargs: Options passed on to the children.
+        """
+        super().__init__(name, documentation, labelnames, buckets=buckets, **kwargs)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record an observation.
+
+        Args:
+            value (float): The observed value, in seconds for latencies.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the duration of the block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def _samples(self) -> Iterator[tuple[str, list[tuple[str, str]], float]]:
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            cumulative += count
+            yield "_bucket", [("le", format_value(bound))], cumulative
+        yield "_sum", [], self.sum
+        yield "_count", [], cumulative
+
+
+def timed(histogram: Histogram) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """Decorate a function to observe the duration of every call.
+
+    Args:
+        histogram (Histogram): The histogram receiving the durations.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorator(func: Callable[P, R]) -> Callable[P, R]:
+        @wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class Registry:
+    """The metrics of a process, by name."""
+
+    def __init__(self) -> None:
+        """Initialize an empty registry."""
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric_type: type[Metric], name: str, documentation: str, labelnames: Sequence[str], **kwargs: Any) -> Metric:
+        """Return the metric with a name, creating it if it doesn't exist yet.
+
+        Raises:
+            ValueError: If the name is registered as another metric type.
+        """
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = metric_type(name, documentation, labelnames, **kwargs)
+            self.metrics[name] = metric
+        elif type(metric) is not metric_type:
+            raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+        return metric
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format.
+
+        Returns:
+            str: The exposition text.
+        """
+        return "".join(metric.render() for _, metric in sorted(self.metrics.items()))
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Return the counter with a name from the process registry, creating it if needed."""
+    metric = REGISTRY.register(Counter, name, documentation, labelnames)
+    assert isinstance(metric, Counter)
+    return metric
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    """Return the gauge with a name from the process registry, creating it if needed."""
+    metric = REGISTRY.register(Gauge, name, documentation, labelnames)
+    assert isinstance(metric, Gauge)
+    return metric
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """Return the histogram with a name from the process registry, creating it if needed."""
+    metric = REGISTRY.register(Histogram, name, documentation, labelnames, buckets=buckets)
+    assert isinstance(metric, Histogram)
+    return metric
+
+
+def write_textfile(path: str, registry: Registry = REGISTRY) -> None:
+    """Atomically write the metrics to a file, for the node exporter's textfile collector.
+
+    Args:
+        path (str): The .prom file to write.
+        registry (Registry): The metrics to write.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(registry.render())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+_exporter: threading.Thread | None = None
+
+
+def start_exporter(job: str, interval: float | None = None) -> None:
+    """Export the process metrics to `<metrics_dir>/<job>.prom` in a background thread.
+
+    Rendering happens in the exporter thread every `metrics_interval` seconds, so the
+    instrumented code only pays for the in-memory updates. Calling it again is a no-op.
+
+    Args:
+        job (str): Name of the daemon, used as the file name.
+        interval (float | None): Seconds between exports. Defaults to `config.metrics_interval`.
+    """
+    global _exporter
+    if _exporter is not None:
+        return
+
+    gauge("timedial_process_start_time_seconds", "Start time of the daemon since the epoch in seconds.").set(time.time())
+    path = os.path.join(config.metrics_dir, f"{job}.prom")
+    period = interval or config.metrics_interval
+
+    def export() -> None:
+        failed = False
+        while True:
+            try:
+                write_textfile(path)
+                failed = False
+            except Exception as exc:
+                if not failed:  # Log once until it works again
+                    logger.error(f"Failed to write metrics to {path}: {exc}")
+                failed = True
+            time.sleep(period)
+
+    _exporter = threading.Thread(target=export, name="metrics-exporter", daemon=True)
+    _exporter.start()
@@ -1,23 +1,135 @@
 """ASCII player, based on https://github.com/mgracanin/ASCIIStarWars.
 
 ASCII Art (Star Wars) from https://www.asciimation.co.nz/
+
+The text file is compiled once into binary frames, stored in the shared demo pack
+by timedial-build-demos, so all guests share the same pages. The layout, all
+integers little-endian:
+
+    header: magic "TDSW", version (u16), frame count (u32)
+    frame:  duration in ticks (u16), run count (u16), followed by the runs
+    run:    row (u8), column (u8), length (u8), followed by the characters
+
+A run is a stretch of cells that changed since the previous frame, so playing a
+frame takes one addstr per run.
 """
 
 import curses
 import os
+import struct
 import sys
 import time
+from collections.abc import Iterator
+
+from timedial.other.demo_pack import open_pack
 
 starwars_file_path = "/opt/demos/starwars.txt"
+FRAMES_ASSET = "starwars.frames"
 
 LPF = 14  ## Lines per frame
 COLUMNS = 68  # Width of the frame
+FRAME_TIME = 0.06  # Seconds per tick
+MERGE_GAP = 3  # Unchanged cells between two runs that are cheaper to rewrite than to skip
+
+MAGIC = b"TDSW"
+VERSION = 1
+HEADER = struct.Struct("<4sHI")
+FRAME = struct.Struct("<HH")
+RUN = struct.Struct("<BBB")
+
+
+def diff_line(old: bytes, new: bytes) -> Iterator[tuple[int, bytes]]:
+    """Find the runs of changed characters between two lines.
+
+    Runs separated by no more than MERGE_GAP unchanged characters are merged.
+
+    Args:
+        old (bytes): The line as it is on screen.
+        new (bytes): The line to draw, the same length as old.
+
+    Yields:
+        tuple[int, bytes]: The column and characters of each run.
+    """
+    start = end = -1
+    for x, (old_char, new_char) in enumerate(zip(old, new)):
+        if old_char == new_char:
+            continue
+        if start < 0:
+            start = x
+        elif x - end > MERGE_GAP + 1:
+            yield start, new[start:end]
+            start = x
+        end = x + 1
+    if start >= 0:
+        yield start, new[start:end]
+
+
+def compile_frames(source: bytes) -> bytes:
+    """Compile the asciimation text into the binary frame format.
+
+    Args:
+        source (bytes): The contents of the text file.
+
+    Returns:
+        bytes: The compiled frames.
+    """
+    lines = source.split(b"\n")
+    screen = [b" " * COLUMNS for _ in range(LPF - 1)]  # Exclude timestamp line
+    frames = []
+    for i in range(0, len(lines) - LPF + 1, LPF):
+        duration = int(lines[i])
+        runs = []
+        for y, line in enumerate(lines[i + 1 : i + LPF]):
+            line = line.rstrip(b"\r")[:COLUMNS].ljust(COLUMNS)
+            for x, text in diff_line(screen[y], line):
+                runs.append(RUN.pack(y, x, len(text)) + text)
+            screen[y] = line
+        frames.append(FRAME.pack(duration, len(runs)) + b"".join(runs))
+    return HEADER.pack(MAGIC, VERSION, len(frames)) + b"".join(frames)
+
+
+def load_frames() -> bytes | memoryview:
+    """Return the compiled frames from the demo pack, or compile the text file if the pack lacks them.
+
+    Returns:
+        bytes | memoryview: The compiled frames.
+    """
+    pack = open_pack()
+    if pack and FRAMES_ASSET in pack:
+        frames = pack.get(FRAMES_ASSET)
+        if frames[: len(MAGIC)] == MAGIC and HEADER.unpack_from(frames)[1] == VERSION:
+            return frames
+
+    with open(starwars_file_path, "rb") as f:
+        return compile_frames(f.read())
+
+
+def iter_frames(frames: bytes | memoryview) -> Iterator[tuple[int, list[tuple[int, int, str]]]]:
+    """Decode the compiled frames.
+
+    Args:
+        frames (bytes | memoryview): The compiled frames.
+
+    Yields:
+        tuple[int, list[tuple[int, int, str]]]: The duration in ticks and the runs (row, column, characters) of each frame.
+    """
+    _, _, count = HEADER.unpack_from(frames)
+    offset = HEADER.size
+    for _ in range(count):
+        duration, run_count = FRAME.unpack_from(frames, offset)
+        offset += FRAME.size
+        runs = []
+        for _ in range(run_count):
+            y, x, length = RUN.unpack_from(frames, offset)
+            offset += RUN.size
+            runs.append((y, x, str(frames[offset : offset + length], "ascii")))
+            offset += length
+        yield duration, runs
 
 
 def main(window: curses.window) -> None:
     """Play the animation."""
-    with open(starwars_file_path) as f:
-        lines = f.readlines()
+    frames = load_frames()
 
     try:
         curses.curs_set(0)
@@ -26,29 +138,19 @@ def main(window: curses.window) -> None:
         cursor = True
         pass  # Terminal doesn't support hiding the cursor
 
-    frames = [lines[i : i + LPF] for i in range(0, len(lines), LPF)]
-
-    previous_frame = [" " * COLUMNS for _ in range(LPF - 1)]  # Exclude timestamp line
-
-    for frame in frames:
-        frame_time = int(frame[0])
-        content_lines = frame[1:]
-
-        for y, line in enumerate(content_lines):
-            line = line.rstrip("\n").ljust(COLUMNS)
-            prev_line = previous_frame[y]
-
-            if line != prev_line:
-                for x, (new_char, old_char) in enumerate(zip(line, prev_line)):
-                    if new_char != old_char:
-                        window.addch(y + 1, x + 1, new_char.encode("ascii"))  # +1 for 1-based coord
-
-            previous_frame[y] = line  # Update previous frame
+    # Frames are scheduled against a fixed start time, so time spent drawing doesn't add up
+    deadline = time.monotonic()
+    for duration, runs in iter_frames(frames):
+        for y, x, text in runs:
+            window.addstr(y + 1, x + 1, text)  # +1 for 1-based coord
 
         window.refresh()
         if cursor:
             window.move(1, 24)
-        time.sleep(frame_time * 0.06)  # frametime * 1/15 seconds
+        deadline += duration * FRAME_TIME
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
 
 
 def run() -> None:
@@ -0,0 +1,165 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+from collections.abc import Callable
+from functools import cache
+
+DEMOS_DIR = "/opt/demos"
+PACK_PATH = "/opt/demos/demos.pack"
+
+MAGIC = b"TDPK"
+VERSION = 1
+HEADER = struct.Struct("<4sHIQ")  # magic, version, entry count, index offset
+ENTRY = struct.Struct("<HQQ")  # name length, data offset, data length, followed by the name
+
+
+class Pack:
+    """A read-only pack of demo assets.
+
+    The pack is one file holding the assets back to back, followed by an index of
+    names, offsets and lengths. It is mapped read-only, so every guest shares the
+    same pages, and assets are returned as memoryviews without copying.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Map a pack file and read its index.
+
+        Args:
+            path (str): Path to the pack file.
+
+        Raises:
+            ValueError: If the file is not a pack of a supported version.
+        """
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        magic, version, count, offset = HEADER.unpack_from(self._view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} demo pack")
+
+        self._index: dict[str, tuple[int, int]] = {}
+        for _ in range(count):
+            name_length, data_offset, data_length = ENTRY.unpack_from(self._view, offset)
+            offset += ENTRY.size
+            name = str(self._view[offset : offset + name_length], "utf-8")
+            offset += name_length
+            self._index[name] = (data_offset, data_length)
+
+    def __contains__(self, name: str) -> bool:
+        """Check whether the pack holds an asset."""
+        return name in self._index
+
+    def names(self, prefix: str = "") -> list[str]:
+        """List the assets in the pack.
+
+        Args:
+            prefix (str): Only list assets whose name starts with this prefix.
+
+        Returns:
+            list[str]: The sorted asset names.
+        """
+        return sorted(name for name in self._index if name.startswith(prefix))
+
+    def get(self, name: str) -> memoryview:
+        """Return the contents of an asset.
+
+        Args:
+            name (str): The asset name, its path relative to the demos directory.
+
+        Returns:
+            memoryview: A read-only view of the asset.
+
+        Raises:
+            KeyError: If the pack doesn't hold the asset.
+        """
+        offset, length = self._index[name]
+        return self._view[offset : offset + length]
+
+
+@cache
+def open_pack() -> Pack | None:
+    """Open the shared demo pack.
+
+    Returns:
+        Pack | None: The pack, or None if it hasn't been built, in which case callers read the demo files directly.
+    """
+    try:
+        return Pack(PACK_PATH)
+    except (OSError, ValueError):
+        return None
+
+
+def write_pack(path: str, assets: dict[str, bytes]) -> None:
+    """Write a pack file atomically.
+
+    Args:
+        path (str): Path to the pack file.
+        assets (dict[str, bytes]): Contents per asset name.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".demos.")
+    with os.fdopen(fd, "wb") as f:
+        f.seek(HEADER.size)
+        index = []
+        for name, data in sorted(assets.items()):
+            encoded = name.encode()
+            index.append(ENTRY.pack(len(encoded), f.tell(), len(data)) + encoded)
+            f.write(data)
+        index_offset = f.tell()
+        f.write(b"".join(index))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(index), index_offset))
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def main() -> None:
+    """Pack the demos directory into the shared pack, run as root after installing the demos."""
+    from timedial.other.ascii_player import compile_frames
+
+    # Assets stored in compiled form, by source name
+    compilers: dict[str, tuple[str, Callable[[bytes], bytes]]] = {
+        "starwars.txt": ("starwars.frames", compile_frames),
+    }
+
+    assets = {}
+    for root, dirs, files in os.walk(DEMOS_DIR):
+        dirs.sort()
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            if path == PACK_PATH or file.startswith("."):
+                continue
+            name = os.path.relpath(path, DEMOS_DIR)
+            with open(path, "rb") as f:
+                data = f.read()
+            if name in compilers:
+                name, compiler = compilers[name]
+                data = compiler(data)
+            assets[name] = data
+
+    write_pack(PACK_PATH, assets)
+    print(f"Packed {len(assets)} demos into {PACK_PATH} ({os.path.getsize(PACK_PATH)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import gzip
+import os
+import sys
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO
+
+try:
+    import zstandard  # type: ignore[import-not-found, unused-ignore]
+except ImportError:  # Optional, only used when installed
+    zstandard = None
+
+LEVEL = int(os.getenv("TIMEDIAL_SIM_LEVEL", "6"))
+BUFFER_SIZE = int(os.getenv("TIMEDIAL_SIM_BUFFER", str(1024 * 1024)))
+WORKERS = int(os.getenv("TIMEDIAL_SIM_WORKERS", str(os.cpu_count() or 1)))
+CODEC = os.getenv("TIMEDIAL_SIM_CODEC", "gzip")
+
+
+class Progress:
+    """Thread-safe progress indicator for one or more files, printed on a single terminal line."""
+
+    def __init__(self, label: str, total: int, interval: float = 0.2) -> None:
+        """Initialize the progress indicator.
+
+        Args:
+            label (str): Text shown in front of the percentage.
+            total (int): Total number of bytes that will be processed.
+            interval (float): Minimum number of seconds between updates.
+        """
+        self.label = label
+        self.total = max(total, 1)
+        self.done = 0
+        self.interval = interval
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, count: int) -> None:
+        """Add processed bytes and redraw the progress line if the interval has passed.
+
+        Args:
+            count (int): Number of bytes processed since the last update.
+        """
+        with self._lock:
+            self.done += count
+            now = time.monotonic()
+            if now - self._last < self.interval:
+                return
+            self._last = now
+            self._print()
+
+    def finish(self) -> None:
+        """Draw the final state and end the line."""
+        with self._lock:
+            self.done = self.total
+            self._print()
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+
+    def _print(self) -> None:
+        """Write the progress line."""
+        percentage = min(100, self.done * 100 // self.total)
+        sys.stdout.write(f"\r{self.label}: {percentage:3d}% ({self.done / 2**20:.1f}/{self.total / 2**20:.1f} MiB)")
+        sys.stdout.flush()
+
+
+class Codec(ABC):
+    """Abstract base class for simulator image codecs."""
+
+    extension = ""
+    magic = b""
+
+    def __init__(self, level: int = LEVEL, buffer_size: int = BUFFER_SIZE, workers: int = WORKERS) -> None:
+        """Initialize the codec.
+
+        Args:
+            level (int): Compression level.
+            buffer_size (int): Size of the blocks read and written at once.
+            workers (int): Number of threads used to compress a single file.
+        """
+        self.level = level
+        self.buffer_size = buffer_size
+        self.workers = workers
+
+    @abstractmethod
+    def compress(self, source: str, destination: str, progress: Progress | None = None) -> None:
+        """Compress a file.
+
+        Args:
+            source (str): The file to compress.
+            destination (str): The compressed file to create.
+            progress (Progress | None): Optional progress indicator.
+        """
+        pass
+
+    @abstractmethod
+    def decompress(self, source: str, destination: str, progress: Progress | None = None) -> None:
+        """Decompress a file.
+
+        Args:
+            source (str): The compressed file.
+            destination (str): The decompressed file to create.
+            progress (Progress | None): Optional progress indicator, updated with compressed bytes read.
+        """
+        pass
+
+    def _blocks(self, f: BinaryIO) -> Iterator[bytes]:
+        """Read a file in blocks of `buffer_size` bytes.
+
+        Args:
+            f (BinaryIO): The file to read.
+
+        Yields:
+            bytes: The next block.
+        """
+        while block := f.read(self.buffer_size):
+            yield block
+
+
+class GzipCodec(Codec):
+    """Gzip codec that compresses blocks in parallel.
+
+    Every block is written as a separate gzip member, like pigz does. The result is a
+    standard multi-member gzip file that gunzip, pigz and Python's gzip module all read.
+    zlib releases the GIL while compressing, so the blocks are compressed on threads.
+    """
+
+    extension = ".gz"
+    magic = b"\x1f\x8b"
+
+    def _compress_block(self, block: bytes) -> bytes:
+        """Compress a block into a complete gzip member.
+
+        Args:
+            block (bytes): The uncompressed data.
+
+        Returns:
+            bytes: The gzip member.
+        """
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(block) + compressor.flush()
+
+    def compress(self, source: str, destination: str, progress: Progress | None = None) -> None:
+        """Compress a file into a multi-member gzip file, see `Codec.compress`."""
+        with open(source, "rb") as f_in, open(destination, "wb") as f_out, ThreadPoolExecutor(self.workers) as executor:
+            # Keep a bounded number of blocks in flight so memory use doesn't depend on the file size
+            pending = []
+            for block in self._blocks(f_in):
+                pending.append((len(block), executor.submit(self._compress_block, block)))
+                if len(pending) >= self.workers * 2:
+                    size, future = pending.pop(0)
+                    f_out.write(future.result())
+                    if progress:
+                        progress.update(size)
+            for size, future in pending:
+                f_out.write(future.result())
+                if progress:
+                    progress.update(size)
+
+    def decompress(self, source: str, destination: str, progress: Progress | None = None) -> None:
+        """Decompress a single or multi-member gzip file, see `Codec.decompress`."""
+        with open(source, "rb") as raw, gzip.GzipFile(fileobj=raw) as f_in, open(destination, "wb") as f_out:
+            position = 0
+            for block in self._blocks(f_in):  # type: ignore[arg-type]
+                f_out.write(block)
+                if progress:
+                    progress.update(raw.tell() - position)
+                    position = raw.tell()
+
+
+class ZstdCodec(Codec):
+    """Zstandard codec, only available when the zstandard module is installed."""
+
+    extension = ".zst"
+    magic = b"\x28\xb5\x2f\xfd"
+
+    def compress(self, source: str, destination: str, progress: Progress | None = None) -> None:
+        """Compress a file using zstd's own worker threads, see `Codec.compress`."""
+        compressor = zstandard.ZstdCompressor(level=self.level, threads=self.workers)
+        with open(source, "rb") as f_in, open(destination, "wb") as f_out, compressor.stream_writer(f_out) as writer:
+            for block in self._blocks(f_in):
+                writer.write(block)
+                if progress:
+                    progress.update(len(block))
+
+    def decompress(self, source: str, destination: str, progress: Progress | None = None) -> None:
+        """Decompress a zstd file, see `Codec.decompress`."""
+        decompressor = zstandard.ZstdDecompressor()
+        with open(source, "rb") as raw, decompressor.stream_reader(raw) as f_in, open(destination, "wb") as f_out:
+            position = 0
+            for block in self._blocks(f_in):
+                f_out.write(block)
+                if progress:
+                    progress.update(raw.tell() - position)
+                    position = raw.tell()
+
+
+CODECS: dict[str, type[Codec]] = {".gz": GzipCodec}
+if zstandard is not None:
+    CODECS[".zst"] = ZstdCodec
+
+
+def split_compressed(path: str) -> tuple[str, Codec | None]:
+    """Split the compression extension from a path.
+
+    Args:
+        path (str): The path to check.
+
+    Returns:
+        tuple[str, Codec | None]: The path without the extension and its codec,
+        or the unchanged path and None if it's not compressed.
+    """
+    for extension, codec in CODECS.items():
+        if path.lower().endswith(extension):
+            return path[: -len(extension)], codec()
+    return path, None
+
+
+def default_codec() -> Codec:
+    """Return the codec used to compress simulator images.
+
+    Returns:
+        Codec: The codec selected with TIMEDIAL_SIM_CODEC, or gzip if that's not available.
+    """
+    if CODEC == "zstd" and ".zst" in CODECS:
+        return CODECS[".zst"]()
+    return GzipCodec()
+
+
+def decompress_all(jobs: list[tuple[str, str]], label: str = "Uncompressing") -> list[tuple[str, Exception]]:
+    """Decompress files in parallel across a worker pool.
+
+    Args:
+        jobs (list[tuple[str, str]]): Pairs of compressed source and destination paths.
+        label (str): Text shown in front of the progress indicator.
+
+    Returns:
+        list[tuple[str, Exception]]: Sources that failed to decompress and the error.
+    """
+    if not jobs:
+        return []
+
+    progress = Progress(f"{label} {len(jobs)} file(s)", sum(os.path.getsize(source) for source, _ in jobs))
+    failed: list[tuple[str, Exception]] = []
+
+    def run(source: str, destination: str) -> None:
+        _, codec = split_compressed(source)
+        if codec is None:
+            raise ValueError(f"Unknown compression: {source}")
+        codec.decompress(source, destination, progress)
+
+    with ThreadPoolExecutor(max(1, min(WORKERS, len(jobs)))) as executor:
+        futures = [(source, executor.submit(run, source, destination)) for source, destination in jobs]
+        for source, future in futures:
+            try:
+                future.result()
+            except Exception as exc:
+                failed.append((source, exc))
+
+    progress.finish()
+    return failed
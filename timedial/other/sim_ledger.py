@@ -0,0 +1,283 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import tempfile
+import time
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from timedial.config import config
+from timedial.other.stats_collectors import ProcessStat
+from timedial.other.stats_history import SERIES_NAME
+
+LAUNCHER = "timedial-start-sim"
+LEDGER_FILE = "ledger.jsonl"
+CONCURRENCY_FILE = "running.json"
+CONCURRENCY_MAX_AGE = 5 * 60  # Seconds after which the published counts are ignored, the exporter stopped
+
+
+class RunningSimulator(NamedTuple):
+    """A simulator that is running right now, as seen in the process table.
+
+    Attributes:
+        simulator (str): The simulator name.
+        user (str): The user running it.
+        pid (int): The pid of the launcher that waits for the simulator.
+        start (float): Epoch time the launcher was started.
+        seen (float): Epoch time the run was last seen.
+        cpu_seconds (float): CPU time used by the launcher and everything it started so far.
+        peak_rss (int): The highest resident set size of the launcher and its descendants seen so far, in bytes.
+    """
+
+    simulator: str
+    user: str
+    pid: int
+    start: float
+    seen: float
+    cpu_seconds: float
+    peak_rss: int
+
+
+class SimulatorCost(NamedTuple):
+    """What the runs of a simulator cost, aggregated from the ledger.
+
+    Attributes:
+        runs (int): The number of completed runs.
+        seconds (float): Total wall clock time of the runs.
+        cpu_seconds (float): Total CPU time of the runs.
+        peak_rss (int): The highest peak resident set size of any run, in bytes.
+    """
+
+    runs: int = 0
+    seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss: int = 0
+
+
+def known_simulators() -> set[str]:
+    """List the simulators in the menu, the only names runs are accounted under.
+
+    Returns:
+        set[str]: The names of the simulators in `config.simulator_path` that are safe to use as series names.
+    """
+    try:
+        names = os.listdir(config.simulator_path)
+    except OSError:
+        return set()
+    return {
+        name
+        for name in names
+        if SERIES_NAME.fullmatch(name) and os.path.isfile(os.path.join(config.simulator_path, name, "simulator.toml"))
+    }
+
+
+def launched_simulator(command: str) -> str | None:
+    """Return the simulator a process launches, if it's a simulator launcher.
+
+    Args:
+        command (str): The command line of the process.
+
+    Returns:
+        str | None: The simulator name argument, or None if the process isn't a launcher.
+    """
+    args = command.split()
+    for i, arg in enumerate(args[:-1]):
+        if os.path.basename(arg) == LAUNCHER:
+            return args[i + 1]
+    return None
+
+
+def concurrency(runs: Iterable[RunningSimulator]) -> dict[str, int]:
+    """Count the users running each simulator.
+
+    Args:
+        runs (Iterable[RunningSimulator]): The running simulators.
+
+    Returns:
+        dict[str, int]: The number of distinct users per simulator name.
+    """
+    users: dict[str, set[str]] = {}
+    for run in runs:
+        users.setdefault(run.simulator, set()).add(run.user)
+    return {simulator: len(names) for simulator, names in users.items()}
+
+
+def published_concurrency() -> dict[str, int]:
+    """Read the users per running simulator, as last published by the stats exporter.
+
+    Returns:
+        dict[str, int]: The number of users per simulator name, empty if the counts are missing or stale.
+    """
+    try:
+        with open(os.path.join(config.sim_ledger_dir, CONCURRENCY_FILE)) as f:
+            data = json.load(f)
+        if time.time() - data["updated"] > CONCURRENCY_MAX_AGE:
+            return {}
+        return {str(name): int(users) for name, users in data["simulators"].items()}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return {}
+
+
+class Tracker:
+    """Accounts simulator runs from the process table, in the root owned stats exporter.
+
+    Every sample the simulator launchers are found by their command line, and only
+    launchers of simulators in the menu count. A run is the launcher with all its
+    descendants: its CPU time includes the children that already exited and were
+    waited for, its memory is the summed RSS of the tree. When a launcher is gone,
+    the run is appended to the ledger. Runs shorter than the sample interval aren't
+    seen, and the figures are as of the last sample.
+    """
+
+    def __init__(self, directory: str | None = None) -> None:
+        """Initialize the tracker.
+
+        Args:
+            directory (str | None): Directory of the ledger and the published counts. Defaults to `config.sim_ledger_dir`.
+        """
+        self.directory = directory or config.sim_ledger_dir
+        self.runs: dict[tuple[int, float], RunningSimulator] = {}
+
+    def update(self, processes: list[ProcessStat], simulators: set[str], now: float) -> dict[str, int]:
+        """Sample the running simulators, record the runs that ended and publish the counts.
+
+        Args:
+            processes (list[ProcessStat]): The process table.
+            simulators (set[str]): The simulators runs are accounted for.
+            now (float): Epoch time of the sample.
+
+        Returns:
+            dict[str, int]: The number of distinct users per running simulator.
+        """
+        children: dict[int, list[ProcessStat]] = {}
+        for proc in processes:
+            children.setdefault(proc.ppid, []).append(proc)
+
+        runs = {}
+        for proc in processes:
+            simulator = launched_simulator(proc.command)
+            if simulator not in simulators:
+                continue
+            tree, stack = [], [proc]
+            while stack:
+                node = stack.pop()
+                tree.append(node)
+                stack.extend(children.get(node.pid, []))
+            key = (proc.pid, proc.create_time)
+            previous = self.runs.get(key)
+            runs[key] = RunningSimulator(
+                simulator=simulator,
+                user=proc.user,
+                pid=proc.pid,
+                start=proc.create_time,
+                seen=now,
+                cpu_seconds=max(sum(node.cpu_time + node.children_cpu_time for node in tree), previous.cpu_seconds if previous else 0.0),
+                peak_rss=max(sum(node.rss for node in tree), previous.peak_rss if previous else 0),
+            )
+
+        os.makedirs(self.directory, mode=0o755, exist_ok=True)
+        for key, run in self.runs.items():
+            if key not in runs:
+                self.record(run)
+        self.runs = runs
+
+        counts = concurrency(runs.values())
+        self.publish(counts, now)
+        return counts
+
+    def record(self, run: RunningSimulator) -> None:
+        """Append a completed run to the ledger, which only root can read.
+
+        Args:
+            run (RunningSimulator): The run as it was last seen.
+        """
+        entry = {
+            "simulator": run.simulator,
+            "user": run.user,
+            "start": run.start,
+            "end": run.seen,
+            "cpu_seconds": round(run.cpu_seconds, 2),
+            "peak_rss": run.peak_rss,
+        }
+        fd = os.open(os.path.join(self.directory, LEDGER_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        try:
+            os.write(fd, (json.dumps(entry) + "\n").encode())
+        finally:
+            os.close(fd)
+
+    def publish(self, counts: dict[str, int], now: float) -> None:
+        """Atomically write the users per running simulator for the menu, readable by everyone.
+
+        Args:
+            counts (dict[str, int]): The number of distinct users per running simulator.
+            now (float): Epoch time of the sample.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".running.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"updated": now, "simulators": counts}, f)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, os.path.join(self.directory, CONCURRENCY_FILE))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class LedgerReader:
+    """Aggregates the costs per simulator from the ledger, reading only the runs appended since the last update."""
+
+    def __init__(self, path: str | None = None) -> None:
+        """Initialize the reader, the ledger is read on the first update.
+
+        Args:
+            path (str | None): Path of the ledger. Defaults to the ledger in `config.sim_ledger_dir`.
+        """
+        self.path = path or os.path.join(config.sim_ledger_dir, LEDGER_FILE)
+        self.inode = 0
+        self.offset = 0
+        self.costs: dict[str, SimulatorCost] = {}
+
+    def update(self) -> None:
+        """Read the runs appended since the last update."""
+        try:
+            with open(self.path, "rb") as f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self.inode or st.st_size < self.offset:
+                    self.inode, self.offset, self.costs = st.st_ino, 0, {}
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        complete = data[: data.rfind(b"\n") + 1]  # A run may be half written
+        self.offset += len(complete)
+        for line in complete.splitlines():
+            try:
+                run = json.loads(line)
+                cost = self.costs.get(run["simulator"], SimulatorCost())
+                self.costs[run["simulator"]] = SimulatorCost(
+                    runs=cost.runs + 1,
+                    seconds=cost.seconds + run["end"] - run["start"],
+                    cpu_seconds=cost.cpu_seconds + run["cpu_seconds"],
+                    peak_rss=max(cost.peak_rss, run["peak_rss"]),
+                )
+            except (ValueError, KeyError, TypeError):
+                continue
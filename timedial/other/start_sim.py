@@ -18,7 +18,9 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
 import argparse
-import gzip
+import fcntl
+import fnmatch
+import json
 import os
 import shutil
 import sys
@@ -27,8 +29,15 @@ from glob import glob
 import tomllib
 from pydantic import BaseModel
 
+from timedial.config import config
+from timedial.other.sim_codecs import Progress, decompress_all, default_codec, split_compressed
+
 SIMULATOR_DIR = "/opt/simulators"
 SIZE_LIMIT = 20 * 1024 * 1024  # 20 MB
+# "clone" uses reflinks or in-kernel copies where possible, "copy" always copies the data
+PROVISION_MODE = os.getenv("TIMEDIAL_SIM_PROVISION", "clone")
+FICLONE = 0x40049409  # From linux/fs.h
+MANIFEST = ".provisioned.json"  # Size and mtime of the files as they were provisioned into the home
 
 
 class Emulator(BaseModel):
@@ -37,10 +46,13 @@ class Emulator(BaseModel):
     Attributes:
         label (str): Label for the emulator.
         command (str): Command to start the emulator.
+        shared (list[str]): Glob patterns of files the emulator only reads, these are
+            symlinked to the simulator source instead of copied.
     """
 
     label: str
     command: str
+    shared: list[str] = []
 
 
 class Description(BaseModel):
@@ -75,12 +87,191 @@ class ConfigModel(BaseModel):
     description: Description = Description()
 
 
+def clone_file(source: str, destination: str) -> None:
+    """Copy a file, sharing the data blocks with the source where the filesystem allows it.
+
+    Tries a reflink (FICLONE) first, so no data is copied until either file is written.
+    That only works within a filesystem, which is why `prepare` clones from the staged
+    copy on the home filesystem. If it's not supported, `copy_file_range` lets the
+    kernel copy the data without passing it through user space. Falls back to a regular
+    copy if both fail.
+
+    Args:
+        source (str): The file to copy.
+        destination (str): Where to create the copy.
+
+    Raises:
+        OSError: If the file can't be copied completely, the partial copy is removed.
+    """
+    if PROVISION_MODE == "copy":
+        shutil.copy2(source, destination)
+        return
+
+    try:
+        with open(source, "rb") as f_in, open(destination, "wb") as f_out:
+            size = os.fstat(f_in.fileno()).st_size
+            try:
+                fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+            except OSError:
+                try:
+                    remaining = size
+                    while remaining > 0:
+                        copied = os.copy_file_range(f_in.fileno(), f_out.fileno(), remaining)
+                        if not copied:
+                            raise OSError(f"copy_file_range stopped {remaining} bytes short")
+                        remaining -= copied
+                except OSError:
+                    f_in.seek(0)
+                    f_out.seek(0)
+                    f_out.truncate()
+                    shutil.copyfileobj(f_in, f_out)
+            f_out.flush()
+            copied_size = os.fstat(f_out.fileno()).st_size
+            if copied_size != size:
+                raise OSError(f"Copied {copied_size} of {size} bytes")
+        shutil.copystat(source, destination)
+    except BaseException:
+        try:
+            os.remove(destination)
+        except OSError:
+            pass
+        raise
+
+
+def is_staged(source: str, staged: str) -> bool:
+    """Check whether the staged copy of a simulator file is complete and up to date.
+
+    Args:
+        source (str): The file in the simulator source.
+        staged (str): Its decompressed copy in `config.simulator_cache`.
+
+    Returns:
+        bool: True if the staged copy has the modification time of the source.
+    """
+    try:
+        return os.stat(staged).st_mtime_ns == os.stat(source).st_mtime_ns
+    except OSError:
+        return False
+
+
+def stage(simulator: str) -> None:
+    """Stage a decompressed copy of a simulator in `config.simulator_cache`.
+
+    The cache is on the home filesystem, so `prepare` can clone from it with reflinks
+    and the images are decompressed once instead of in every home. Copies get the
+    modification time of their source, files are only staged again when the source
+    changes. Shared files aren't staged, they are symlinked to the source.
+
+    Args:
+        simulator (str): The name of the simulator to stage.
+    """
+    source = os.path.join(SIMULATOR_DIR, simulator)
+    cache = os.path.join(config.simulator_cache, simulator)
+    shared = shared_files(source)
+    jobs: list[tuple[str, str]] = []
+    staged: dict[str, tuple[str, str]] = {}  # Source: (temporary path, staged path)
+
+    for s_path in glob(source + "/**", recursive=True):
+        rel_path = os.path.relpath(s_path, source)
+        if not os.path.isfile(s_path) or any(fnmatch.fnmatch(rel_path, pattern) for pattern in shared):
+            continue
+        c_path, codec = split_compressed(os.path.join(cache, rel_path))
+        if is_staged(s_path, c_path):
+            continue
+        os.makedirs(os.path.dirname(c_path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(c_path), f".{os.path.basename(c_path)}.tmp")
+        staged[s_path] = (tmp_path, c_path)
+        if codec:
+            jobs.append((s_path, tmp_path))
+            continue
+        try:
+            clone_file(s_path, tmp_path)
+        except Exception as exc:
+            print(f"Warning: Failed to stage: {s_path} - {exc}")
+            del staged[s_path]
+
+    failed = dict(decompress_all(jobs, f"Staging {simulator}:"))
+    for s_path, error in failed.items():
+        print(f"Warning: Failed to stage: {s_path} - {error}")
+    for s_path, (tmp_path, c_path) in staged.items():
+        if s_path in failed:
+            continue
+        st = os.stat(s_path)
+        os.chmod(tmp_path, 0o644)
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_path, c_path)
+
+
+def stage_simulators() -> None:
+    """Stage every simulator and remove the staged copies of simulators that are gone."""
+    simulators = [name for name in sorted(os.listdir(SIMULATOR_DIR)) if os.path.isdir(os.path.join(SIMULATOR_DIR, name))]
+    os.makedirs(config.simulator_cache, mode=0o755, exist_ok=True)
+    for name in os.listdir(config.simulator_cache):
+        if name not in simulators:
+            shutil.rmtree(os.path.join(config.simulator_cache, name), ignore_errors=True)
+    for name in simulators:
+        stage(name)
+
+
+def load_manifest(destination: str) -> dict[str, list[int]]:
+    """Load the sizes and modification times of the files as they were provisioned.
+
+    Args:
+        destination (str): The simulator directory in the home.
+
+    Returns:
+        dict[str, list[int]]: The mtime in nanoseconds and the size per relative path.
+    """
+    try:
+        with open(os.path.join(destination, MANIFEST)) as f:
+            return dict(json.load(f))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(destination: str, manifest: dict[str, list[int]]) -> None:
+    """Save the sizes and modification times of the provisioned files.
+
+    Args:
+        destination (str): The simulator directory in the home.
+        manifest (dict[str, list[int]]): The mtime in nanoseconds and the size per relative path.
+    """
+    try:
+        with open(os.path.join(destination, MANIFEST), "w") as f:
+            json.dump(manifest, f)
+    except OSError as exc:
+        print(f"Warning: Failed to save {MANIFEST} - {exc}")
+
+
+def shared_files(source: str) -> list[str]:
+    """Return the glob patterns of files that are shared with the simulator source.
+
+    Args:
+        source (str): The simulator source directory.
+
+    Returns:
+        list[str]: Patterns relative to the simulator directory.
+    """
+    try:
+        with open(os.path.join(source, "simulator.toml"), "rb") as f:
+            return ConfigModel(**tomllib.load(f)).emulator.shared
+    except Exception as exc:
+        print(f"Warning: Failed to read shared files from simulator.toml - {exc}")
+        return []
+
+
 def prepare(simulator: str) -> None:
     """Prepares a simulator environment by copying and decompressing necessary files.
 
     This function copies all files from the simulator's source directory to the user's
-    home directory if they are not already present. Gzipped files are automatically
-    decompressed unless an uncompressed version already exists.
+    home directory if they are not already present. Compressed files are automatically
+    decompressed unless an uncompressed version already exists. Files marked as shared
+    in simulator.toml are symlinked, other files are cloned with `clone_file` from their
+    staged copy on the home filesystem, or from the source if that isn't staged yet.
+    The size and mtime of every provisioned file is recorded, so `gzip_large_files`
+    can leave the files the simulator didn't change alone.
+
+    All decompression is collected first and then run in parallel.
 
     Args:
         simulator (str): The name of the simulator to prepare.
@@ -89,87 +280,128 @@ def prepare(simulator: str) -> None:
         SystemExit: If the specified simulator directory does not exist.
     """
     source = os.path.join(SIMULATOR_DIR, simulator)
+    cache = os.path.join(config.simulator_cache, simulator)
     destination = os.path.expanduser(f"~/simulators/{simulator}")
     destination_glob = glob(destination + "/**", recursive=True)
-    gzipped_rel_paths = {os.path.relpath(f, destination)[:-3] for f in destination_glob if f.lower().endswith(".gz")}
+    compressed_rel_paths = {
+        os.path.relpath(split_compressed(f)[0], destination) for f in destination_glob if split_compressed(f)[1] is not None
+    }
+    jobs: list[tuple[str, str]] = []
+    provisioned: list[str] = []
 
     if not os.path.isdir(source) and not os.path.isdir(destination):
         print(f"Simulator {simulator} does not exist!")
         sys.exit(1)
 
     if os.path.isdir(source):
+        shared = shared_files(source)
         # Copy the files from the simulator source.
         for s_path in glob(source + "/**", recursive=True):
-            d_path = os.path.join(destination, os.path.relpath(s_path, source))
+            rel_path = os.path.relpath(s_path, source)
+            d_path = os.path.join(destination, rel_path)
+            d_base, codec = split_compressed(d_path)
             if os.path.isfile(d_path):
                 # If the file already exists
                 continue
             if os.path.isdir(s_path):
                 continue
-            if os.path.relpath(s_path, source) in gzipped_rel_paths:
-                # If a gzipped version of the file exists
+            if os.path.relpath(d_base, destination) in compressed_rel_paths:
+                # If a compressed version of the file exists
                 continue
-            if s_path.lower().endswith(".gz") and os.path.isfile(d_path[:-3]):
-                # If a gunzipped version of the file exists
+            if codec and os.path.isfile(d_base):
+                # If an uncompressed version of the file exists
+                continue
+            c_path = os.path.join(cache, os.path.relpath(d_base, destination))
+            staged = is_staged(s_path, c_path)
+            if codec and not staged:
+                os.makedirs(os.path.dirname(d_path), exist_ok=True)
+                jobs.append((s_path, d_base))
+                provisioned.append(d_base)
                 continue
-            if s_path.lower().endswith(".gz"):
-                try:
-                    os.makedirs(os.path.dirname(d_path), exist_ok=True)
-                    with gzip.open(s_path, "rb") as f_in, open(d_path[:-3], "wb") as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                    continue
-                except Exception as exc:
-                    print(f"Warning: Failed to decompress: {s_path} - {exc}")
-                    continue
 
             try:
                 os.makedirs(os.path.dirname(d_path), exist_ok=True)
-                shutil.copy2(s_path, d_path)
+                if not codec and any(fnmatch.fnmatch(rel_path, pattern) for pattern in shared):
+                    if os.path.islink(d_path):
+                        os.remove(d_path)  # Dangling link
+                    os.symlink(s_path, d_path)
+                else:
+                    clone_file(c_path if staged else s_path, d_base)
+                    provisioned.append(d_base)
             except Exception as exc:
                 print(f"Warning: Failed to copy: {s_path} - {exc}")
 
     # Uncompress any remaining files in the destination
-    for gz_path in glob(destination + "/**", recursive=True):
-        if not os.path.isfile(gz_path):
+    remaining = []
+    for c_path in destination_glob:
+        if not os.path.isfile(c_path):
             continue
-        if not gz_path.lower().endswith(".gz"):
-            continue
-
-        print(f"Uncompressing: {gz_path}")
+        d_base, codec = split_compressed(c_path)
+        if codec:
+            remaining.append(c_path)
+            jobs.append((c_path, d_base))
+
+    failed = dict(decompress_all(jobs))
+    for s_path, error in failed.items():
+        print(f"Warning: Failed to decompress: {s_path} - {error}")
+    for c_path in remaining:
+        if c_path not in failed:
+            os.remove(c_path)
+
+    manifest = load_manifest(destination)
+    for c_path in remaining:
+        manifest.pop(os.path.relpath(split_compressed(c_path)[0], destination), None)  # Changed by an earlier run
+    for d_path in provisioned:
         try:
-            with gzip.open(gz_path, "rb") as f_in, open(gz_path[:-3], "wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
-            os.remove(gz_path)
-        except Exception as exc:
-            print(f"Warning: Failed to decompress remaining: {gz_path} - {exc}")
+            st = os.stat(d_path)
+        except OSError:
+            continue  # Failed to provision
+        manifest[os.path.relpath(d_path, destination)] = [st.st_mtime_ns, st.st_size]
+    if provisioned or remaining:
+        save_manifest(destination, manifest)
 
 
 def gzip_large_files(simulator: str) -> None:
-    """Compresses large files in the simulator's directory using gzip.
+    """Compresses large files in the simulator's directory.
 
-    Files larger than a predefined size threshold are compressed unless a compressed
-    version already exists. Original files are deleted after compression.
+    Files larger than a predefined size threshold are compressed with the default codec
+    unless a compressed version already exists. Original files are deleted after compression.
+    Files the simulator didn't change since `prepare` provisioned them are left alone, they
+    share their blocks with the staged copy or are compressed by the stale files handler.
 
     Args:
         simulator (str): The name of the simulator to process.
     """
+    codec = default_codec()
     destination = os.path.expanduser(f"~/simulators/{simulator}")
+    manifest = load_manifest(destination)
+    compressed = False
     for file_path in glob(destination + "/**", recursive=True):
-        if not os.path.isfile(file_path):
+        if not os.path.isfile(file_path) or os.path.islink(file_path):
             continue
-        if file_path.lower().endswith(".gz"):
+        if split_compressed(file_path)[1] is not None:
             continue
-        if os.path.isfile(file_path + ".gz"):
-            print(f"Warning: {file_path + '.gz'} already exists! Consider deleting or renaming it so we can safe space")
-        if os.path.getsize(file_path) <= SIZE_LIMIT:
+        compressed_path = file_path + codec.extension
+        if os.path.isfile(compressed_path):
+            print(f"Warning: {compressed_path} already exists! Consider deleting or renaming it so we can safe space")
+        st = os.stat(file_path)
+        size = st.st_size
+        if size <= SIZE_LIMIT:
             continue
+        rel_path = os.path.relpath(file_path, destination)
+        if manifest.get(rel_path) == [st.st_mtime_ns, size]:
+            continue  # Unchanged since it was provisioned
 
         try:
-            with open(file_path, "rb") as f_in, gzip.open(file_path + ".gz", "wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
+            progress = Progress(f"Compressing {os.path.basename(file_path)}", size)
+            codec.compress(file_path, compressed_path, progress)
+            progress.finish()
             os.remove(file_path)
+            compressed = compressed or manifest.pop(rel_path, None) is not None
         except Exception as exc:
             print(f"Warning, failed to compress: {file_path} - {exc}")
+    if compressed:
+        save_manifest(destination, manifest)
 
 
 def run_simulator(simulator: str) -> None:
@@ -0,0 +1,134 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import fcntl
+import os
+import re
+import select
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import termios
+import time
+
+# Last line of the welcome screen, the first frame drawn by timedial-login
+FIRST_FRAME_MARKER = b"Enjoy your trip through time!"
+IMPORTTIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def time_to_first_frame(timeout: float = 10.0, rows: int = 24, cols: int = 80) -> float:
+    """Start the login shell in a pseudo terminal and time how long it takes to draw the welcome screen.
+
+    Args:
+        timeout (float): Give up after this many seconds.
+        rows (int): Terminal height.
+        cols (int): Terminal width.
+
+    Returns:
+        float: Seconds from process start until the first frame was written.
+
+    Raises:
+        TimeoutError: If the first frame didn't appear within the timeout.
+    """
+    master, slave = os.openpty()
+    fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+
+    with tempfile.TemporaryDirectory() as home:
+        env = {**os.environ, "TERM": "vt100", "HOME": home, "LINES": str(rows), "COLUMNS": str(cols)}
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-c", "from timedial import login; login.main()"],
+            stdin=slave,
+            stdout=slave,
+            stderr=slave,
+            env=env,
+            start_new_session=True,
+        )
+        os.close(slave)
+
+        output = b""
+        try:
+            while FIRST_FRAME_MARKER not in output:
+                remaining = timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    raise TimeoutError(f"No first frame after {timeout} seconds, output: {output[-200:]!r}")
+                ready, _, _ = select.select([master], [], [], remaining)
+                if ready:
+                    try:
+                        output += os.read(master, 4096)
+                    except OSError:
+                        # The child exited and the pty was closed
+                        raise RuntimeError(f"Login shell exited before the first frame, output: {output[-200:]!r}") from None
+            elapsed = time.perf_counter() - start
+        finally:
+            proc.kill()
+            proc.wait()
+            os.close(master)
+
+    return elapsed
+
+
+def slowest_imports(module: str = "timedial.login", count: int = 10) -> list[tuple[int, str]]:
+    """Run `python -X importtime` for a module and return the slowest top-level imports.
+
+    Args:
+        module (str): The module to import.
+        count (int): The number of imports to return.
+
+    Returns:
+        list[tuple[int, str]]: Cumulative import time in microseconds and module name.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+
+    imports: list[tuple[int, str]] = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        # Only report imports made directly by the module or its first level dependencies
+        if match and len(match.group(3)) <= 3:
+            imports.append((int(match.group(2)), match.group(4)))
+
+    return sorted(imports, reverse=True)[:count]
+
+
+def main() -> None:
+    """Measure the startup time of timedial-login and fail if it's over budget."""
+    parser = argparse.ArgumentParser(description="Measure the time to first frame of timedial-login.")
+    parser.add_argument("--budget", type=float, default=0.5, help="Maximum median time to first frame in seconds.")
+    parser.add_argument("--runs", type=int, default=5, help="Number of measurements.")
+    args = parser.parse_args()
+
+    print("Slowest imports of timedial.login:")
+    for usec, name in slowest_imports():
+        print(f"  {usec / 1000:8.1f} ms  {name}")
+
+    timings = [time_to_first_frame() for _ in range(args.runs)]
+    median = statistics.median(timings)
+    print(f"\nTime to first frame: median {median * 1000:.1f} ms, min {min(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms")
+
+    if median > args.budget:
+        print(f"Over budget: {median * 1000:.1f} ms > {args.budget * 1000:.1f} ms")
+        sys.exit(1)
+    print(f"Within budget of {args.budget * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import struct
+import time
+from collections import deque
+from collections.abc import Iterator
+from typing import NamedTuple
+
+import psutil
+
+from timedial.config import config
+
+# struct utmp on Linux, as written by glibc on 64-bit systems (384 bytes)
+UTMP = struct.Struct("<hxxi32s4s32s256shhiii16s20x")
+RUN_LVL = 1
+BOOT_TIME = 2
+USER_PROCESS = 7
+DEAD_PROCESS = 8
+
+LAST_SESSIONS = 500  # Completed sessions kept from wtmp
+
+PROC_ATTRS = [
+    "pid",
+    "ppid",
+    "name",
+    "username",
+    "terminal",
+    "cmdline",
+    "create_time",
+    "cpu_percent",
+    "cpu_times",
+    "memory_info",
+    "memory_percent",
+]
+
+
+class UtmpRecord(NamedTuple):
+    """A utmp or wtmp record."""
+
+    type: int
+    pid: int
+    line: str
+    user: str
+    host: str
+    time: float
+
+
+class Session(NamedTuple):
+    """A login session reconstructed from wtmp, like a line of `last`.
+
+    Attributes:
+        user (str): The username, or "reboot" for a boot record.
+        line (str): The terminal, or "system boot".
+        host (str): The remote host.
+        login (float): Epoch time of the login.
+        logout (float | None): Epoch time of the logout, None while logged in.
+        end (str): How the session ended: "" for a logout, "crash" or "down".
+    """
+
+    user: str
+    line: str
+    host: str
+    login: float
+    logout: float | None
+    end: str = ""
+
+
+class ProcessStat(NamedTuple):
+    """Resource usage of a process."""
+
+    pid: int
+    user: str
+    terminal: str
+    cpu_percent: float
+    rss: int
+    memory_percent: float
+    cpu_time: float
+    create_time: float
+    command: str
+    ppid: int
+    children_cpu_time: float  # CPU time of the children that exited and were waited for
+
+
+def _decode(field: bytes) -> str:
+    return field.split(b"\0", 1)[0].decode(errors="replace")
+
+
+def parse_records(data: bytes | memoryview) -> Iterator[UtmpRecord]:
+    """Parse utmp records, ignoring a trailing partial record.
+
+    Args:
+        data (bytes | memoryview): The contents of a utmp or wtmp file.
+
+    Yields:
+        UtmpRecord: The records in file order.
+    """
+    for fields in UTMP.iter_unpack(data[: len(data) - len(data) % UTMP.size]):
+        ut_type, pid, line, _, user, host, _, _, _, tv_sec, tv_usec, _ = fields
+        yield UtmpRecord(ut_type, pid, _decode(line), _decode(user), _decode(host), tv_sec + tv_usec / 1e6)
+
+
+def read_utmp(path: str | None = None) -> list[UtmpRecord]:
+    """Read the current login sessions from utmp.
+
+    Args:
+        path (str | None): Path of the utmp file. Defaults to `config.utmp_path`.
+
+    Returns:
+        list[UtmpRecord]: The user sessions, empty if utmp doesn't exist.
+    """
+    try:
+        with open(path or config.utmp_path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    return [record for record in parse_records(data) if record.type == USER_PROCESS and record.user]
+
+
+class WtmpReader:
+    """Reads the login history from wtmp incrementally.
+
+    Every update only reads the records appended since the previous one. Sessions are
+    matched to their logout by terminal, like `last` does, and the most recent
+    LAST_SESSIONS completed sessions are kept. When wtmp is rotated or truncated the
+    history is read again from the start.
+    """
+
+    def __init__(self, path: str | None = None, keep: int = LAST_SESSIONS) -> None:
+        """Initialize the reader, the file is read on the first update.
+
+        Args:
+            path (str | None): Path of the wtmp file. Defaults to `config.wtmp_path`.
+            keep (int): Completed sessions to keep.
+        """
+        self.path = path or config.wtmp_path
+        self.keep = keep
+        self.reset(0)
+
+    def reset(self, inode: int) -> None:
+        """Forget the history, to read the file from the start."""
+        self.inode = inode
+        self.offset = 0
+        self.open: dict[str, Session] = {}
+        self.closed: deque[Session] = deque(maxlen=self.keep)
+
+    def _close_all(self, when: float, end: str) -> None:
+        for session in self.open.values():
+            self.closed.append(session._replace(logout=when, end=end))
+        self.open.clear()
+
+    def update(self) -> None:
+        """Read the records appended since the last update."""
+        try:
+            with open(self.path, "rb") as f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self.inode or st.st_size < self.offset:
+                    self.reset(st.st_ino)
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            self.reset(0)
+            return
+
+        self.offset += len(data) - len(data) % UTMP.size
+        for record in parse_records(data):
+            if record.type == USER_PROCESS and record.user:
+                previous = self.open.pop(record.line, None)
+                if previous:
+                    self.closed.append(previous._replace(logout=record.time))
+                self.open[record.line] = Session(record.user, record.line, record.host, record.time, None)
+            elif record.type == DEAD_PROCESS:
+                session = self.open.pop(record.line, None)
+                if session:
+                    self.closed.append(session._replace(logout=record.time))
+            elif record.type == BOOT_TIME:
+                self._close_all(record.time, "crash")
+                self.closed.append(Session("reboot", "system boot", record.host, record.time, record.time))
+            elif record.type == RUN_LVL and record.user == "shutdown":
+                self._close_all(record.time, "down")
+
+    def sessions(self) -> list[Session]:
+        """Return the known sessions, newest first.
+
+        Returns:
+            list[Session]: Open and completed sessions.
+        """
+        return sorted([*self.open.values(), *self.closed], key=lambda session: session.login, reverse=True)
+
+
+def process_stats() -> list[ProcessStat]:
+    """Collect the resource usage of every process in a single pass over the process table.
+
+    CPU usage is averaged since the previous call; psutil keeps the process objects
+    between calls, so the first call reports 0% for every process.
+
+    Returns:
+        list[ProcessStat]: One entry per process.
+    """
+    stats = []
+    for proc in psutil.process_iter(PROC_ATTRS):
+        info = proc.info
+        cpu_times = info["cpu_times"]
+        memory = info["memory_info"]
+        stats.append(
+            ProcessStat(
+                pid=info["pid"],
+                user=info["username"] or "?",
+                terminal=(info["terminal"] or "").removeprefix("/dev/"),
+                cpu_percent=info["cpu_percent"] or 0.0,
+                rss=memory.rss if memory else 0,
+                memory_percent=info["memory_percent"] or 0.0,
+                cpu_time=cpu_times.user + cpu_times.system if cpu_times else 0.0,
+                create_time=info["create_time"] or 0.0,
+                command=" ".join(info["cmdline"] or []) or f"[{info['name']}]",
+                ppid=info["ppid"] or 0,
+                children_cpu_time=cpu_times.children_user + cpu_times.children_system if cpu_times else 0.0,
+            )
+        )
+    return stats
+
+
+def idle_time(line: str, now: float | None = None) -> float | None:
+    """Return the seconds since a terminal was last used, from its access time.
+
+    Args:
+        line (str): The terminal, relative to /dev.
+        now (float | None): The current time. Defaults to time.time().
+
+    Returns:
+        float | None: The idle time, None if the terminal doesn't exist.
+    """
+    try:
+        return max(0.0, (now or time.time()) - os.stat(f"/dev/{line}").st_atime)
+    except OSError:
+        return None
@@ -18,61 +18,122 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
 import datetime
+import gzip
+import hashlib
+import json
 import logging
 import os
 import re
-import subprocess
+import shutil
+import tempfile
 import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
 
+import psutil
+
+from timedial import metrics
 from timedial.config import config
 from timedial.logger import daemon_logger_config
+from timedial.other import sim_ledger
+from timedial.other.stats_collectors import (
+    ProcessStat,
+    Session,
+    UtmpRecord,
+    WtmpReader,
+    idle_time,
+    process_stats,
+    read_utmp,
+)
+from timedial.other.stats_history import History
 
 daemon_logger_config()
 logger = logging.getLogger("timedial.stats")
 
+TOP_PROCESSES = 100  # Processes listed in the top files
+COMMAND_WIDTH = 300
+# Usage charts published for the website, by name and span in seconds
+HISTORY_CHARTS = {"day": 86400, "month": 30 * 86400, "year": 365 * 86400}
 
-def list_dir(path: str, extensions: bool = True) -> str:
-    """Lists the contents of a directory as a newline-separated string.
+RUN_SECONDS = metrics.histogram("timedial_stats_run_seconds", "Time spent generating all statistics files.")
+COLLECT_SECONDS = metrics.histogram("timedial_stats_collect_seconds", "Time spent reading the process table, utmp and wtmp.")
+HISTORY_SECONDS = metrics.histogram("timedial_stats_history_seconds", "Time spent recording the history and publishing the charts.")
+FILE_SECONDS = metrics.histogram("timedial_stats_file_seconds", "Time spent generating a statistics file.", ["file"])
+ERRORS = metrics.counter("timedial_stats_errors_total", "Failed collections and writes.")
+PUBLISHED = metrics.counter("timedial_stats_published_total", "Statistics files considered for publishing.", ["result"])
+
+# Digest of the last published content per file, excluding the generation time
+_digests: dict[str, bytes] = {}
 
-    Args:
-        path (str): Path to the directory.
-        extensions (bool): If False, strips file extensions.
+
+def list_guests() -> list[str]:
+    """List the registered guests.
 
     Returns:
-        str: Newline-separated list of filenames (or basenames if extensions is False).
+        list[str]: The sorted usernames, derived from the guest file names.
     """
-    data = sorted(os.listdir(path))
-    if not extensions:
-        data = [os.path.splitext(i)[0] for i in data]
-    return "\n".join(data)
+    return sorted(entry.stem for entry in Path(config.guest_dir).glob("*.json"))
 
 
-def execute(command: str | list[str]) -> str:
-    """Executes a shell command and returns its output.
+def replace_file(path: str, data: bytes) -> None:
+    """Atomically replace a file, so readers see either the old or the new content.
 
     Args:
-        command (str): The command to execute (e.g., '/usr/bin/w').
+        path (str): The file to replace.
+        data (bytes): The new content.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".stats.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def publish(filename: str, body: bytes, render: Callable[[], bytes] | None = None) -> bool:
+    """Publish a file in the stats directory for the website, along with a gzipped copy.
+
+    Nothing is written if the body didn't change since it was last published. The files
+    are replaced atomically and the .gz sibling lets nginx serve them with gzip_static.
+
+    Args:
+        filename (str): The name of the file to publish.
+        body (bytes): The content that decides whether the file changed.
+        render (Callable[[], bytes] | None): Returns the full file content, the body with its
+            generation time. Defaults to the body itself.
 
     Returns:
-        str: The standard output from the command, or an error message if it fails.
+        bool: True if the file was written.
     """
-    env = os.environ.copy()
-    env["COLUMNS"] = "300"  # set desired terminal width
-    env["LINES"] = "100"  # optional, if needed
+    digest = hashlib.sha256(body).digest()
+    if _digests.get(filename) == digest:
+        PUBLISHED.labels("unchanged").inc()
+        return False
 
+    path = os.path.join(config.stats_dir, filename)
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True, env=env)
-        return mask_ips(result.stdout)
+        data = render() if render else body
+        replace_file(f"{path}.gz", gzip.compress(data, compresslevel=9, mtime=0))
+        replace_file(path, data)
+    except Exception as exc:
+        ERRORS.inc()
+        logger.error(f"Failed to write: {path} - {exc}")
+        return False
 
-    except subprocess.CalledProcessError as e:
-        msg = f"Error executing 'w': {e}"
-        logger.error(msg)
-        return msg
+    _digests[filename] = digest
+    PUBLISHED.labels("written").inc()
+    return True
 
 
 def write_file(filename: str, content: str) -> None:
     """Writes content to a file within the configured stats directory.
 
+    The "Generated on" line records when the content last changed.
+
     Args:
         filename (str): The name of the file to write to.
         content (str): The content to write into the file.
@@ -80,13 +141,22 @@ def write_file(filename: str, content: str) -> None:
     Returns:
         None
     """
-    path = os.path.join(config.stats_dir, filename)
-    try:
-        with open(path, "w") as f:
-            f.write(f"Generated on: {datetime.datetime.now().isoformat()}\n\n")
-            f.write(content)
-    except Exception as exc:
-        logger.error(f"Failed to write: {path} - {exc}")
+    body = content.encode()
+    publish(filename, body, lambda: f"Generated on: {datetime.datetime.now().isoformat()}\n\n".encode() + body)
+
+
+def write_json(filename: str, data: dict[str, Any]) -> None:
+    """Writes structured data as JSON to a file within the configured stats directory.
+
+    Args:
+        filename (str): The name of the file to write to.
+        data (dict[str, Any]): The data, a "generated" timestamp is added.
+    """
+    publish(
+        filename,
+        json.dumps(data).encode(),
+        lambda: json.dumps({"generated": datetime.datetime.now().isoformat(), **data}).encode(),
+    )
 
 
 def mask_ips(text: str) -> str:
@@ -121,16 +191,308 @@ def mask_ips(text: str) -> str:
     return re.sub(ip_pattern, mask, text)
 
 
+def format_idle(seconds: float | None) -> str:
+    """Format an idle time the way `w` does."""
+    if seconds is None:
+        return "?"
+    if seconds < 60:
+        return f"{seconds:.2f}s"
+    if seconds < 3600:
+        return f"{int(seconds // 60)}:{int(seconds % 60):02d}"
+    if seconds < 86400:
+        return f"{int(seconds // 3600)}:{int(seconds % 3600 // 60):02d}m"
+    return f"{int(seconds // 86400)}days"
+
+
+def format_duration(seconds: float) -> str:
+    """Format a session length the way `last` does."""
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 1440)
+    text = f"{minutes // 60:02d}:{minutes % 60:02d}"
+    return f"({days}+{text})" if days else f"({text})"
+
+
+def summary(now: float, users: int) -> str:
+    """Return the uptime line shared by `w` and `top`."""
+    uptime = int(now - psutil.boot_time())
+    days, rest = divmod(uptime, 86400)
+    up = f"{days} day{'s' if days != 1 else ''}, " if days else ""
+    load = ", ".join(f"{value:.2f}" for value in psutil.getloadavg())
+    clock = datetime.datetime.fromtimestamp(now).strftime("%H:%M:%S")
+    return f" {clock} up {up}{rest // 3600:2d}:{rest % 3600 // 60:02d},  {users} users,  load average: {load}"
+
+
+def session_command(record: UtmpRecord, processes: list[ProcessStat]) -> str:
+    """Return the command most recently started on a session's terminal, like the WHAT column of `w`."""
+    on_tty = [proc for proc in processes if proc.terminal == record.line]
+    if not on_tty:
+        return "-"
+    return max(on_tty, key=lambda proc: proc.create_time).command
+
+
+def collect_w(now: float, sessions: list[UtmpRecord], processes: list[ProcessStat]) -> dict[str, Any]:
+    """Collect the logged in users.
+
+    Returns:
+        dict[str, Any]: The summary line and one entry per session.
+    """
+    return {
+        "summary": summary(now, len(sessions)),
+        "sessions": [
+            {
+                "user": record.user,
+                "tty": record.line,
+                "from": mask_ips(record.host),
+                "login": record.time,
+                "idle": idle_time(record.line, now),
+                "what": mask_ips(session_command(record, processes)),
+            }
+            for record in sessions
+        ],
+    }
+
+
+def format_w(data: dict[str, Any]) -> str:
+    """Format the logged in users like `w`."""
+    lines = [data["summary"], f"{'USER':<8} {'TTY':<8} {'FROM':<16} {'LOGIN@':<7} {'IDLE':>7}  WHAT"]
+    for session in data["sessions"]:
+        login = datetime.datetime.fromtimestamp(session["login"]).strftime("%H:%M")
+        lines.append(
+            f"{session['user']:<8} {session['tty']:<8} {session['from'][:16]:<16} {login:<7} "
+            f"{format_idle(session['idle']):>7}  {session['what'][:COMMAND_WIDTH]}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def collect_last(sessions: list[Session]) -> dict[str, Any]:
+    """Collect the login history.
+
+    Returns:
+        dict[str, Any]: One entry per session, newest first.
+    """
+    return {
+        "sessions": [
+            {
+                "user": session.user,
+                "tty": session.line,
+                "from": mask_ips(session.host),
+                "login": session.login,
+                "logout": session.logout,
+                "end": session.end,
+            }
+            for session in sessions
+        ]
+    }
+
+
+def format_last(data: dict[str, Any], now: float) -> str:
+    """Format the login history like `last`."""
+    lines = []
+    for session in data["sessions"]:
+        login = datetime.datetime.fromtimestamp(session["login"]).strftime("%a %b %e %H:%M")
+        line = f"{session['user']:<8} {session['tty']:<12} {session['from'][:16]:<16} {login}"
+        if session["logout"] is None:
+            line += "   still logged in"
+        elif session["user"] != "reboot":
+            logout = session["end"] or datetime.datetime.fromtimestamp(session["logout"]).strftime("%H:%M")
+            line += f" - {logout:<5}  {format_duration(session['logout'] - session['login'])}"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def collect_top(processes: list[ProcessStat], key: Callable[[ProcessStat], float]) -> dict[str, Any]:
+    """Collect the busiest processes.
+
+    Args:
+        processes (list[ProcessStat]): The process table.
+        key (Callable[[ProcessStat], float]): What to rank the processes by.
+
+    Returns:
+        dict[str, Any]: System totals and the top TOP_PROCESSES processes.
+    """
+    memory = psutil.virtual_memory()
+    ranked = sorted(processes, key=key, reverse=True)[:TOP_PROCESSES]
+    return {
+        "tasks": len(processes),
+        "memory": {"total": memory.total, "available": memory.available, "used": memory.used},
+        "processes": [{**proc._asdict(), "command": mask_ips(proc.command)} for proc in ranked],
+    }
+
+
+def format_top(data: dict[str, Any], now: float, users: int) -> str:
+    """Format the busiest processes like `top -b`."""
+    memory = data["memory"]
+    mib = 1024 * 1024
+    lines = [
+        "top -" + summary(now, users),
+        f"Tasks: {data['tasks']} total",
+        f"MiB Mem : {memory['total'] / mib:9.1f} total, {memory['available'] / mib:9.1f} avail, {memory['used'] / mib:9.1f} used",
+        "",
+        f"{'PID':>7} {'USER':<9} {'%CPU':>5} {'%MEM':>5} {'RES':>9} {'TIME+':>9} COMMAND",
+    ]
+    for proc in data["processes"]:
+        minutes, seconds = divmod(proc["cpu_time"], 60)
+        lines.append(
+            f"{proc['pid']:>7} {proc['user'][:9]:<9} {proc['cpu_percent']:5.1f} {proc['memory_percent']:5.1f} "
+            f"{proc['rss'] // 1024:>9} {int(minutes):>3}:{seconds:05.2f} {proc['command'][:COMMAND_WIDTH]}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def collect_simulators(running: dict[str, int], costs: dict[str, sim_ledger.SimulatorCost]) -> dict[str, Any]:
+    """Collect the live concurrency and the cost of every simulator.
+
+    Args:
+        running (dict[str, int]): The users per running simulator.
+        costs (dict[str, sim_ledger.SimulatorCost]): The aggregated costs of completed runs.
+
+    Returns:
+        dict[str, Any]: Per simulator the users right now, and the runs with their average duration, CPU time and peak RSS.
+    """
+    simulators = {}
+    for name in sorted(set(running) | set(costs)):
+        cost = costs.get(name, sim_ledger.SimulatorCost())
+        simulators[name] = {
+            "users": running.get(name, 0),
+            "runs": cost.runs,
+            "mean_seconds": round(cost.seconds / cost.runs, 1) if cost.runs else 0,
+            "mean_cpu_seconds": round(cost.cpu_seconds / cost.runs, 2) if cost.runs else 0,
+            "peak_rss": cost.peak_rss,
+        }
+    return {"simulators": simulators}
+
+
+def move_legacy_history(directory: str) -> None:
+    """Move the history rings out of the published statistics directory, where they used to be kept.
+
+    Args:
+        directory (str): The history directory.
+    """
+    legacy = os.path.join(config.stats_dir, "history")
+    if not os.path.isdir(legacy) or os.path.abspath(legacy) == os.path.abspath(directory):
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(legacy):
+            if not os.path.exists(os.path.join(directory, name)):
+                shutil.move(os.path.join(legacy, name), os.path.join(directory, name))
+        shutil.rmtree(legacy)
+        logger.info(f"Moved the history from {legacy} to {directory}")
+    except OSError as exc:
+        logger.error(f"Failed to move the history out of {legacy}: {exc}")
+
+
+def export(filename: str, produce: Callable[[], str]) -> None:
+    """Generate a statistics file, timing how long it takes.
+
+    Args:
+        filename (str): The name of the file to write to.
+        produce (Callable[[], str]): Returns the content of the file.
+    """
+    with FILE_SECONDS.labels(filename).time():
+        write_file(filename, produce())
+
+
+class Exporter:
+    """Collects the statistics every run and publishes them, keeping the state that carries over between runs.
+
+    Attributes:
+        wtmp (WtmpReader): The login history reader.
+        history (History): The usage time series.
+        tracker (sim_ledger.Tracker): Accounts the simulator runs from the process table.
+        ledger (sim_ledger.LedgerReader): The simulator costs from the ledger of completed runs.
+        guests (set[str] | None): The guests seen in the previous run, None before the first run.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the exporter and start measuring CPU usage for the first run."""
+        self.wtmp = WtmpReader()
+        self.history = History()
+        move_legacy_history(self.history.directory)
+        self.tracker = sim_ledger.Tracker()
+        self.ledger = sim_ledger.LedgerReader()
+        self.guests: set[str] | None = None
+        process_stats()
+        psutil.cpu_percent()
+
+    def record(self, now: float, sessions: list[UtmpRecord], simulators: dict[str, int], guests: list[str]) -> None:
+        """Record a usage sample in the history and publish the usage charts.
+
+        Args:
+            now (float): Epoch time of the sample.
+            sessions (list[UtmpRecord]): The logged in sessions.
+            simulators (dict[str, int]): The users per running simulator.
+            guests (list[str]): The registered guests.
+        """
+        registrations = len(set(guests) - self.guests) if self.guests is not None else 0
+        self.guests = set(guests)
+
+        samples = {
+            "sessions": float(len(sessions)),
+            "users": float(len({record.user for record in sessions})),
+            "cpu": psutil.cpu_percent(),
+            "memory": psutil.virtual_memory().percent,
+            "registrations": float(registrations),
+        }
+        # Only running simulators are sampled, a bucket without samples means nobody used it
+        for simulator, users in simulators.items():
+            samples[f"sim.{simulator}"] = float(users)
+
+        try:
+            self.history.record(now, samples)
+        except Exception as exc:
+            ERRORS.inc()
+            logger.error(f"Failed to record history: {exc}")
+
+        series = self.history.series()
+        for name, span in HISTORY_CHARTS.items():
+            write_json(f"history_{name}.json", self.history.chart(series, span, now))
+
+    def run(self) -> None:
+        """Collect everything once and write the text and JSON files."""
+        now = time.time()
+        with COLLECT_SECONDS.time():
+            processes = process_stats()
+            sessions = read_utmp()
+            self.wtmp.update()
+
+        w = collect_w(now, sessions, processes)
+        last = collect_last(self.wtmp.sessions())
+        top_cpu = collect_top(processes, lambda proc: proc.cpu_percent)
+        top_mem = collect_top(processes, lambda proc: proc.rss)
+        guests = list_guests()
+
+        export("w.txt", lambda: format_w(w))
+        export("last.txt", lambda: format_last(last, now))
+        export("top_cpu.txt", lambda: format_top(top_cpu, now, len(sessions)))
+        export("top_mem.txt", lambda: format_top(top_mem, now, len(sessions)))
+        export("user_list.txt", lambda: "\n".join(guests))
+
+        write_json("w.json", w)
+        write_json("last.json", last)
+        write_json("top_cpu.json", top_cpu)
+        write_json("top_mem.json", top_mem)
+        write_json("user_list.json", {"count": len(guests), "users": guests})
+
+        simulators = self.tracker.update(processes, sim_ledger.known_simulators(), now)
+        self.ledger.update()
+        write_json("simulators.json", collect_simulators(simulators, self.ledger.costs))
+
+        with HISTORY_SECONDS.time():
+            self.record(now, sessions, simulators, guests)
+
+
 def main() -> None:
     """Run through all files."""
+    metrics.start_exporter("stats_exporter")
+    exporter = Exporter()
+    time.sleep(1)
     while True:
         try:
-            write_file("w.txt", execute("/usr/bin/w"))
-            write_file("last.txt", execute("/usr/bin/last"))
-            write_file("top_cpu.txt", execute(["/usr/bin/top", "-b", "-o", "%CPU", "-n", "1", "-c"]))
-            write_file("top_mem.txt", execute(["/usr/bin/top", "-b", "-o", "%CPU", "-n", "1", "-c"]))
-            write_file("user_list.txt", list_dir("/data/guests", extensions=False))
+            with RUN_SECONDS.time():
+                exporter.run()
         except Exception as exc:
+            ERRORS.inc()
             logger.exception(f"Encountered error during run: {exc}")
 
         time.sleep(60)
@@ -0,0 +1,256 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import struct
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from timedial.config import config
+
+MAGIC = b"TDTS"
+VERSION = 1
+HEADER = struct.Struct("<4sHII")  # magic, version, resolution in seconds, capacity in records
+RECORD = struct.Struct("<IIddd")  # bucket start, sample count, sum, minimum, maximum
+
+# Resolutions in seconds and how many buckets of each are kept
+ROLLUPS = {
+    60: 2 * 1440,  # 2 days of minutes
+    3600: 90 * 24,  # 90 days of hours
+    86400: 5 * 366,  # 5 years of days
+}
+
+SERIES_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def pick_resolution(span: float) -> int:
+    """Return the finest resolution that keeps a span of history, or the coarsest one if none does."""
+    return next((resolution for resolution in sorted(ROLLUPS) if resolution * ROLLUPS[resolution] >= span), max(ROLLUPS))
+
+
+class Point(NamedTuple):
+    """The samples aggregated into one bucket.
+
+    Attributes:
+        start (int): Epoch time of the start of the bucket.
+        samples (int): The number of samples.
+        sum (float): The sum of the samples, the total for counts like new registrations.
+        min (float): The lowest sample.
+        max (float): The highest sample.
+    """
+
+    start: int
+    samples: int
+    sum: float
+    min: float
+    max: float
+
+    @property
+    def mean(self) -> float:
+        """The average of the samples."""
+        return self.sum / self.samples if self.samples else 0.0
+
+
+class Ring:
+    """A ring file holding one series at one resolution.
+
+    The file is a header followed by `capacity` fixed-width records. The slot of a bucket
+    follows from its start time, so recording a sample is a read and a write of one
+    record, old buckets are overwritten as time wraps around the ring, and a slot whose
+    start doesn't match the bucket is empty.
+    """
+
+    def __init__(self, path: str, resolution: int, capacity: int) -> None:
+        """Initialize the ring, the file is created on the first sample.
+
+        Args:
+            path (str): Path of the ring file.
+            resolution (int): Seconds per bucket.
+            capacity (int): Buckets kept.
+        """
+        self.path = path
+        self.resolution = resolution
+        self.capacity = capacity
+
+    def _offset(self, start: int) -> int:
+        return HEADER.size + (start // self.resolution) % self.capacity * RECORD.size
+
+    def _open(self) -> int:
+        """Open the ring file for writing, creating it or starting over if its layout changed."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        header = os.pread(fd, HEADER.size, 0)
+        if len(header) != HEADER.size or HEADER.unpack(header) != (MAGIC, VERSION, self.resolution, self.capacity):
+            os.ftruncate(fd, 0)
+            os.ftruncate(fd, HEADER.size + self.capacity * RECORD.size)
+            os.pwrite(fd, HEADER.pack(MAGIC, VERSION, self.resolution, self.capacity), 0)
+        return fd
+
+    def add(self, timestamp: float, value: float) -> None:
+        """Merge a sample into the bucket it falls in.
+
+        Args:
+            timestamp (float): Epoch time of the sample.
+            value (float): The sample.
+        """
+        start = int(timestamp) // self.resolution * self.resolution
+        offset = self._offset(start)
+        fd = self._open()
+        try:
+            slot_start, count, total, low, high = RECORD.unpack(os.pread(fd, RECORD.size, offset))
+            if slot_start == start and count:
+                record = RECORD.pack(start, count + 1, total + value, min(low, value), max(high, value))
+            else:
+                record = RECORD.pack(start, 1, value, value, value)
+            os.pwrite(fd, record, offset)
+        finally:
+            os.close(fd)
+
+    def points(self, start: float, end: float) -> list[Point]:
+        """Return the buckets that start in a time range.
+
+        Args:
+            start (float): Epoch time of the start of the range, inclusive.
+            end (float): Epoch time of the end of the range, exclusive.
+
+        Returns:
+            list[Point]: The buckets holding samples, oldest first.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        if len(data) != HEADER.size + self.capacity * RECORD.size or HEADER.unpack_from(data) != (
+            MAGIC,
+            VERSION,
+            self.resolution,
+            self.capacity,
+        ):
+            return []
+
+        first = max(int(start) // self.resolution, int(end - 1) // self.resolution - self.capacity + 1)
+        points = []
+        for bucket in range(first, int(end - 1) // self.resolution + 1):
+            point = Point(*RECORD.unpack_from(data, self._offset(bucket * self.resolution)))
+            if point.samples and point.start == bucket * self.resolution:
+                points.append(point)
+        return points
+
+
+class History:
+    """Time series of usage statistics, kept at minute, hour and day resolution.
+
+    Every series has a ring file per resolution in the history directory. Each sample is
+    merged into all of them, so the coarser rollups are always up to date and queries
+    never need to scan raw data.
+    """
+
+    def __init__(self, directory: str | None = None) -> None:
+        """Initialize the history.
+
+        Args:
+            directory (str | None): Directory of the ring files. Defaults to `config.stats_history_dir`.
+        """
+        self.directory = directory or config.stats_history_dir
+
+    def ring(self, series: str, resolution: int) -> Ring:
+        """Return the ring of a series at a resolution.
+
+        Raises:
+            ValueError: If the series name isn't safe to use as a file name, or the resolution isn't kept.
+        """
+        if not SERIES_NAME.fullmatch(series):
+            raise ValueError(f"Invalid series name: {series}")
+        if resolution not in ROLLUPS:
+            raise ValueError(f"Resolution {resolution} isn't one of {sorted(ROLLUPS)}")
+        return Ring(os.path.join(self.directory, f"{series}.{resolution}.ring"), resolution, ROLLUPS[resolution])
+
+    def record(self, timestamp: float, samples: dict[str, float]) -> None:
+        """Record a sample of every series.
+
+        A series with an invalid name doesn't keep the other series from being recorded.
+
+        Args:
+            timestamp (float): Epoch time of the samples.
+            samples (dict[str, float]): The sample per series name.
+
+        Raises:
+            ValueError: If a series name isn't safe to use as a file name, after recording the others.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        invalid = []
+        for series, value in samples.items():
+            if not SERIES_NAME.fullmatch(series):
+                invalid.append(series)
+                continue
+            for resolution in ROLLUPS:
+                self.ring(series, resolution).add(timestamp, value)
+        if invalid:
+            raise ValueError(f"Invalid series names: {', '.join(invalid)}")
+
+    def series(self) -> list[str]:
+        """List the recorded series.
+
+        Returns:
+            list[str]: The sorted series names.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted({name.rsplit(".", 2)[0] for name in names if name.endswith(".ring")})
+
+    def query(self, series: str, start: float, end: float, resolution: int | None = None) -> list[Point]:
+        """Return the buckets of a series in a time range.
+
+        Args:
+            series (str): The series name.
+            start (float): Epoch time of the start of the range, inclusive.
+            end (float): Epoch time of the end of the range, exclusive.
+            resolution (int | None): Seconds per bucket. Defaults to the finest resolution that covers the range.
+
+        Returns:
+            list[Point]: The buckets holding samples, oldest first.
+        """
+        return self.ring(series, resolution or pick_resolution(end - start)).points(start, end)
+
+    def chart(self, series: Iterable[str], span: float, now: float, resolution: int | None = None) -> dict[str, object]:
+        """Build the data of a usage chart, ready to serialize as JSON.
+
+        Args:
+            series (Iterable[str]): The series to include.
+            span (float): Seconds of history up to now.
+            now (float): Epoch time of the end of the chart.
+            resolution (int | None): Seconds per bucket. Defaults to the finest resolution that covers the span.
+
+        Returns:
+            dict[str, object]: The resolution and, per series, [start, mean, max, sum] of every bucket.
+        """
+        start = now - span
+        resolution = resolution or pick_resolution(span)
+        data = {name: self.query(name, start, now, resolution) for name in series}
+        return {
+            "resolution": resolution,
+            "start": int(start),
+            "end": int(now),
+            "series": {
+                name: [[point.start, round(point.mean, 3), point.max, point.sum] for point in points] for name, points in data.items()
+            },
+        }
@@ -0,0 +1,165 @@
+"""TimeDial project.
+
+Copyright (c) Martin Miedema
+Repository: https://github.com/number42net/timedial
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import curses
+import fcntl
+import os
+import select
+import struct
+import subprocess
+import sys
+import tempfile
+import termios
+import time
+
+from timedial.other.startup_bench import FIRST_FRAME_MARKER
+
+# Navigation script, as (description, terminfo capability or literal key)
+ACTIONS = [
+    ("close welcome", " "),
+    ("down", "kcud1"),
+    ("down", "kcud1"),
+    ("down", "kcud1"),
+    ("up", "kcuu1"),
+    ("show info", "?"),
+    ("down", "kcud1"),
+    ("enter menu", "\n"),
+    ("down", "kcud1"),
+    ("down", "kcud1"),
+    ("back", "kcub1"),
+    ("help", "kf1"),
+    ("close help", " "),
+]
+
+
+def read_until_quiet(fd: int, quiet: float, timeout: float = 10.0) -> bytes:
+    """Read from a file descriptor until nothing arrives for a while.
+
+    Args:
+        fd (int): The file descriptor to read.
+        quiet (float): Stop after this many seconds without output.
+        timeout (float): Stop after this many seconds in total.
+
+    Returns:
+        bytes: Everything read.
+    """
+    output = b""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        ready, _, _ = select.select([fd], [], [], quiet)
+        if not ready:
+            break
+        try:
+            output += os.read(fd, 65536)
+        except OSError:
+            break  # The child exited and the pty was closed
+    return output
+
+
+def key_sequence(key: str) -> bytes:
+    """Translate a terminfo key capability to the bytes the terminal sends, literal keys are returned as is.
+
+    Args:
+        key (str): A capability such as 'kcud1', or a literal key.
+
+    Returns:
+        bytes: The bytes to send.
+    """
+    if len(key) == 1:
+        return key.encode()
+    sequence = curses.tigetstr(key)
+    if not sequence:
+        raise ValueError(f"Terminal has no {key} key")
+    return sequence
+
+
+def measure(profile: str, term: str, quiet: float, rows: int = 24, cols: int = 80) -> tuple[int, list[int]]:
+    """Run timedial-login with an interface profile and count the bytes each navigation action sends.
+
+    Args:
+        profile (str): The interface profile, passed in TIMEDIAL_UI.
+        term (str): The terminal type.
+        quiet (float): Seconds without output after which an action is considered done.
+        rows (int): Terminal height.
+        cols (int): Terminal width.
+
+    Returns:
+        tuple[int, list[int]]: Bytes of the first frame, and bytes per action in ACTIONS.
+
+    Raises:
+        RuntimeError: If the first frame didn't appear.
+    """
+    master, slave = os.openpty()
+    fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+
+    with tempfile.TemporaryDirectory() as home:
+        env = {**os.environ, "TERM": term, "TIMEDIAL_UI": profile, "HOME": home, "LINES": str(rows), "COLUMNS": str(cols)}
+        proc = subprocess.Popen(
+            [sys.executable, "-c", "from timedial import login; login.main()"],
+            stdin=slave,
+            stdout=slave,
+            stderr=slave,
+            env=env,
+            start_new_session=True,
+        )
+        os.close(slave)
+
+        try:
+            first_frame = read_until_quiet(master, max(quiet, 1.0))
+            if FIRST_FRAME_MARKER not in first_frame:
+                raise RuntimeError(f"No first frame, output: {first_frame[-200:]!r}")
+
+            sent = []
+            for _, key in ACTIONS:
+                os.write(master, key_sequence(key))
+                sent.append(len(read_until_quiet(master, quiet)))
+        finally:
+            proc.kill()
+            proc.wait()
+            os.close(master)
+
+    return len(first_frame), sent
+
+
+def main() -> None:
+    """Compare the bytes sent per navigation action by each interface profile."""
+    parser = argparse.ArgumentParser(description="Count the bytes timedial-login sends per navigation action in each interface profile.")
+    parser.add_argument("--term", default="xterm", help="Terminal type to run the interface with.")
+    parser.add_argument("--baud", type=int, default=1200, help="Line speed to estimate the time per action at.")
+    parser.add_argument("--quiet", type=float, default=0.3, help="Seconds without output after which an action is done.")
+    args = parser.parse_args()
+
+    curses.setupterm(args.term, sys.stdout.fileno())
+    profiles = ["full", "low"]
+    results = {profile: measure(profile, args.term, args.quiet) for profile in profiles}
+
+    def row(name: str, counts: list[int]) -> str:
+        return f"{name:<16}" + "".join(f"{count:>8} {count * 10 / args.baud:>6.2f}s" for count in counts)
+
+    print(f"{'action':<16}" + "".join(f"{profile:>17}" for profile in profiles))
+    print(row("first frame", [results[profile][0] for profile in profiles]))
+    for index, (name, _) in enumerate(ACTIONS):
+        print(row(name, [results[profile][1][index] for profile in profiles]))
+    print(row("navigation", [sum(results[profile][1]) for profile in profiles]))
+    print(f"\nSeconds are estimated at {args.baud} baud, 10 bits per byte.")
+
+
+if __name__ == "__main__":
+    main()
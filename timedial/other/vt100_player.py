@@ -22,39 +22,77 @@ import shutil
 import sys
 import time
 
+from timedial.other.demo_pack import open_pack
+
 DIR = "/opt/demos/vt100"
-files = sorted(os.listdir(DIR))
+PACK_PREFIX = "vt100/"
+BITS_PER_BYTE = 10  # 8N1: start bit, 8 data bits, stop bit
+CHUNK_INTERVAL = 0.02  # Write a chunk every 20ms
+MIN_BAUD = 300
+MAX_BAUD = 115200
 
 naughty_list = ["dirty.vt", "dogs.vt", "safesex.vt", "monkey.vt", "startrek.vt"]
 
-# Max width 120 columns for readability
-term_width = min(shutil.get_terminal_size((80, 20)).columns, 120)
-term_lines = shutil.get_terminal_size((80, 20)).lines
 
-entries = [f"{i + 1}. {file}" for i, file in enumerate(files) if file not in naughty_list]
-max_width = max(len(entry.replace(".vt", "")) for entry in entries) + 2  # Add spacing
-columns = max(1, term_width // max_width)
+def list_files() -> list[str]:
+    """Lists the available animations, from the demo pack if it has been built.
+
+    Returns:
+        list[str]: The sorted animation file names.
+    """
+    pack = open_pack()
+    if pack:
+        return [name.removeprefix(PACK_PREFIX) for name in pack.names(PACK_PREFIX)]
+    return sorted(os.listdir(DIR))
+
+
+def read_file(file: str) -> bytes | memoryview:
+    """Reads an animation, from the demo pack if it has been built.
+
+    Args:
+        file: The filename of the .vt animation.
+
+    Returns:
+        bytes | memoryview: The animation, a view into the shared pack when available.
+    """
+    pack = open_pack()
+    if pack and PACK_PREFIX + file in pack:
+        return pack.get(PACK_PREFIX + file)
+    with open(os.path.join(DIR, file), "br") as f:
+        return f.read()
+
 
-# Warn about terminal
-if os.getenv("TERM", "").lower() != "vt100":
-    print("Note: these animations work best on a VT100 terminal!")
+def ask_baud() -> int:
+    """Asks the user for the baud rate to play the animations at.
 
-slow: bool | None = None
-while slow is None:
-    response = input("Slow down to 9600 baud? [Y/n]: ").strip().lower()
-    if response == "y" or response == "":
-        slow = True
-    elif response == "n":
-        slow = False
+    Returns:
+        int: A baud rate between MIN_BAUD and MAX_BAUD, or 0 for full speed.
+    """
+    while True:
+        response = input(f"Baud rate, {MIN_BAUD} to {MAX_BAUD} or 0 for full speed [9600]: ").strip()
+        if response == "":
+            return 9600
+        if response.isdigit() and (int(response) == 0 or MIN_BAUD <= int(response) <= MAX_BAUD):
+            return int(response)
 
 
-def print_list() -> None:
+def print_list(files: list[str]) -> None:
     """Prints the list of available animation files in columns.
 
     The function displays entries in column-major order, based on
     terminal width and filtered from a naughty_list. Entries are
     formatted to align evenly in the terminal.
+
+    Args:
+        files: The animation file names.
     """
+    # Max width 120 columns for readability
+    term_width = min(shutil.get_terminal_size((80, 20)).columns, 120)
+
+    entries = [f"{i + 1}. {file}" for i, file in enumerate(files) if file not in naughty_list]
+    max_width = max(len(entry.replace(".vt", "")) for entry in entries) + 2  # Add spacing
+    columns = max(1, term_width // max_width)
+
     rows = (len(entries) + columns - 1) // columns
     for row in range(rows):
         for col in range(columns):
@@ -64,26 +102,49 @@ def print_list() -> None:
         print()
 
 
-def print_animation(file: str) -> None:
+def play(data: bytes | memoryview, rate: int) -> None:
+    """Writes data to the terminal at the given baud rate.
+
+    The data is written in chunks, each one held back until its wall-clock deadline.
+    Sleep overshoot or a slow link only delays a chunk, it never adds up: when
+    the output falls behind, the following chunks are written without sleeping.
+
+    Args:
+        data: The data to write.
+        rate: Baud rate, 0 for full speed.
+    """
+    out = sys.stdout.buffer
+    if not rate:
+        out.write(data)
+        out.flush()
+        return
+
+    bytes_per_second = rate / BITS_PER_BYTE
+    chunk_size = max(1, int(bytes_per_second * CHUNK_INTERVAL))
+    start = time.monotonic()
+    for offset in range(0, len(data), chunk_size):
+        delay = start + offset / bytes_per_second - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        out.write(data[offset : offset + chunk_size])
+        out.flush()
+
+
+def print_animation(file: str, baud: int) -> None:
     """Plays a VT100-style animation from a file.
 
-    Clears the terminal and displays the contents of a .vt file
-    character by character, simulating terminal output. Optionally
-    slows the output to approximate 9600 baud speed.
+    Clears the terminal and displays the contents of a .vt file,
+    simulating terminal output at the selected baud rate.
 
     Args:
         file: The filename of the .vt animation to be displayed.
+        baud: Baud rate, 0 for full speed.
     """
     os.system("clear")
-    with open(os.path.join(DIR, file), "br") as f:
-        data = f.read()
+    data = read_file(file)
 
     try:
-        for char in data:
-            sys.stdout.buffer.write(bytes([char]))
-            sys.stdout.flush()
-            if slow:
-                time.sleep(1 / (9600 // 10))
+        play(data, baud)
     except KeyboardInterrupt:
         pass
 
@@ -107,9 +168,16 @@ def main() -> None:
 
     The loop continues until the user enters '0' to exit.
     """
+    # Warn about terminal
+    if os.getenv("TERM", "").lower() != "vt100":
+        print("Note: these animations work best on a VT100 terminal!")
+
+    baud = ask_baud()
+    files = list_files()
+
     while True:
         os.system("clear")
-        print_list()
+        print_list(files)
         request = input("\nMake a chocie, 0 to exit > ")
         if not request.isdigit():
             print(f"Enter a number from 1 to {len(files)}")
@@ -126,12 +194,12 @@ def main() -> None:
                     .lower()
                 )
                 if response == "y":
-                    print_animation(files[int(request) - 1])
+                    print_animation(files[int(request) - 1], baud)
                     break
                 elif response == "n" or response == "":
                     break
         else:
-            print_animation(files[int(request) - 1])
+            print_animation(files[int(request) - 1], baud)
 
 
 if __name__ == "__main__":